@@ -0,0 +1,32 @@
+"""Add inspection lease to suspicious domain
+
+Revision ID: 0fa62e3b9d14
+Revises: e43a9d05c7b8
+Create Date: 2025-10-18 09:54:41.205733
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0fa62e3b9d14'
+down_revision: Union[str, Sequence[str], None] = 'e43a9d05c7b8'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('suspicious_domain', sa.Column('lease_owner', sa.String(length=100), nullable=True))
+    op.add_column('suspicious_domain', sa.Column('lease_until', sa.DateTime(), nullable=True))
+    op.add_column('suspicious_domain', sa.Column('inspection_attempts', sa.Integer(), nullable=False, server_default='0'))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_column('suspicious_domain', 'inspection_attempts')
+    op.drop_column('suspicious_domain', 'lease_until')
+    op.drop_column('suspicious_domain', 'lease_owner')
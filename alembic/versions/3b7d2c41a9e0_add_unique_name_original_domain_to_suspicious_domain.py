@@ -0,0 +1,62 @@
+"""Add unique constraint on name and original domain to suspicious domain
+
+Revision ID: 3b7d2c41a9e0
+Revises: 9c9f8e2dde3a
+Create Date: 2025-10-06 10:12:31.482917
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '3b7d2c41a9e0'
+down_revision: Union[str, Sequence[str], None] = '9c9f8e2dde3a'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+# every suspicious domain with the id of the oldest suspicious domain of the same name and original domain
+DUPLICATES = """
+    SELECT id, MIN(id) OVER (PARTITION BY name, original_domain_id) AS keep_id
+    FROM suspicious_domain
+"""
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # the records and entities of the duplicates are moved to the kept suspicious domain, so neither the
+    # history nor the screenshots (saved by domain name and date) of the duplicates are lost
+    op.execute(
+        f"""
+        UPDATE website_record r
+        SET suspicious_domain_id = d.keep_id
+        FROM ({DUPLICATES}) d
+        WHERE r.suspicious_domain_id = d.id AND d.id <> d.keep_id
+        """
+    )
+    op.execute(
+        f"""
+        INSERT INTO suspicious_domain_entity (suspicious_domain_id, entity_id)
+        SELECT d.keep_id, e.entity_id
+        FROM suspicious_domain_entity e JOIN ({DUPLICATES}) d ON e.suspicious_domain_id = d.id
+        WHERE d.id <> d.keep_id
+        ON CONFLICT DO NOTHING
+        """
+    )
+    # remove duplicated suspicious domains keeping the oldest one, required by the bulk upsert
+    op.execute(
+        """
+        DELETE FROM suspicious_domain a
+        USING suspicious_domain b
+        WHERE a.name = b.name AND a.original_domain_id = b.original_domain_id AND a.id > b.id
+        """
+    )
+    op.create_unique_constraint('uix_suspicious_domain_original', 'suspicious_domain', ['name', 'original_domain_id'])
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_constraint('uix_suspicious_domain_original', 'suspicious_domain', type_='unique')
@@ -0,0 +1,39 @@
+"""Add screenshot blob to website record and screenshot tombstone
+
+Revision ID: 5d2e8b7a1c63
+Revises: 7e4a9f0c2b15
+Create Date: 2025-10-14 10:12:37.418206
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '5d2e8b7a1c63'
+down_revision: Union[str, Sequence[str], None] = '7e4a9f0c2b15'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def _has_tombstones() -> bool:
+    # the tombstone table is created by the application on startup, it may not exist yet
+    return sa.inspect(op.get_bind()).has_table('screenshot_tombstone')
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('website_record', sa.Column('screenshot_blob', sa.String(length=80), nullable=True))
+    op.create_index('ix_website_record_screenshot_blob', 'website_record', ['screenshot_blob'])
+    if _has_tombstones():
+        op.add_column('screenshot_tombstone', sa.Column('blob', sa.String(length=80), nullable=True))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    if _has_tombstones():
+        op.drop_column('screenshot_tombstone', 'blob')
+    op.drop_index('ix_website_record_screenshot_blob', table_name='website_record')
+    op.drop_column('website_record', 'screenshot_blob')
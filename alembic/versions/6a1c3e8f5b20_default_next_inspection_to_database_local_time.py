@@ -0,0 +1,29 @@
+"""Default next inspection to database local time
+
+Revision ID: 6a1c3e8f5b20
+Revises: 0fa62e3b9d14
+Create Date: 2025-10-19 10:12:37.418206
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '6a1c3e8f5b20'
+down_revision: Union[str, Sequence[str], None] = '0fa62e3b9d14'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # same default as the db_now() of the model, the clock used to schedule and lease the inspections
+    op.alter_column('suspicious_domain', 'next_inspection', server_default=sa.text("LOCALTIMESTAMP"))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.alter_column('suspicious_domain', 'next_inspection', server_default=sa.text("NOW()"))
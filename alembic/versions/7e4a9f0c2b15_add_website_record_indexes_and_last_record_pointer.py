@@ -0,0 +1,54 @@
+"""Add website record indexes and last record pointer to suspicious domain
+
+Revision ID: 7e4a9f0c2b15
+Revises: 3b7d2c41a9e0
+Create Date: 2025-10-07 09:41:12.905316
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '7e4a9f0c2b15'
+down_revision: Union[str, Sequence[str], None] = '3b7d2c41a9e0'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_index(
+        'ix_website_record_domain_creation_date',
+        'website_record',
+        ['suspicious_domain_id', sa.text('creation_date DESC')]
+    )
+    op.add_column('suspicious_domain', sa.Column('last_record_id', sa.Integer(), nullable=True))
+    op.create_foreign_key(
+        'fk_suspicious_domain_last_record',
+        'suspicious_domain', 'website_record',
+        ['last_record_id'], ['id'],
+        ondelete='SET NULL'
+    )
+    # point every suspicious domain to its latest record
+    op.execute(
+        """
+        UPDATE suspicious_domain sd
+        SET last_record_id = latest.id
+        FROM (
+            SELECT DISTINCT ON (suspicious_domain_id) id, suspicious_domain_id
+            FROM website_record
+            ORDER BY suspicious_domain_id, creation_date DESC
+        ) AS latest
+        WHERE latest.suspicious_domain_id = sd.id
+        """
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_constraint('fk_suspicious_domain_last_record', 'suspicious_domain', type_='foreignkey')
+    op.drop_column('suspicious_domain', 'last_record_id')
+    op.drop_index('ix_website_record_domain_creation_date', table_name='website_record')
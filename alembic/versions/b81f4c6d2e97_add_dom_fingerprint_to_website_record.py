@@ -0,0 +1,28 @@
+"""Add dom fingerprint to website record
+
+Revision ID: b81f4c6d2e97
+Revises: 5d2e8b7a1c63
+Create Date: 2025-10-15 16:03:52.117384
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'b81f4c6d2e97'
+down_revision: Union[str, Sequence[str], None] = '5d2e8b7a1c63'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('website_record', sa.Column('dom_fingerprint', sa.String(length=16), nullable=True))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_column('website_record', 'dom_fingerprint')
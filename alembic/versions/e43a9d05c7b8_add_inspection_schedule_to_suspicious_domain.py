@@ -0,0 +1,33 @@
+"""Add inspection schedule to suspicious domain
+
+Revision ID: e43a9d05c7b8
+Revises: b81f4c6d2e97
+Create Date: 2025-10-17 11:27:05.640912
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e43a9d05c7b8'
+down_revision: Union[str, Sequence[str], None] = 'b81f4c6d2e97'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('suspicious_domain', sa.Column('last_inspected', sa.DateTime(), nullable=True))
+    # existing domains are all due on the next run
+    op.add_column('suspicious_domain', sa.Column('next_inspection', sa.DateTime(), nullable=False, server_default=sa.text("NOW()")))
+    op.create_index('ix_suspicious_domain_next_inspection', 'suspicious_domain', ['next_inspection'])
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_suspicious_domain_next_inspection', table_name='suspicious_domain')
+    op.drop_column('suspicious_domain', 'next_inspection')
+    op.drop_column('suspicious_domain', 'last_inspected')
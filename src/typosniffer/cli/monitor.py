@@ -1,12 +1,15 @@
 
 from datetime import datetime, timedelta
 import os
+import socket
+from pathlib import Path
+from typing import Optional
 import click
 from typosniffer.config.config import get_config
-from typosniffer.service import domain, suspicious_domain
-from typosniffer.sniffing import notification, whoisds, whoisfinder
+from typosniffer.service import domain, suspicious_domain, website_record, whois_cache
+from typosniffer.sniffing import notification, sniffer, whoisds, whoisfinder
 from typosniffer.sniffing.monitor import inspect_domains
-from typosniffer.utils import console
+from typosniffer.utils import console, utility
 from apscheduler.schedulers.blocking import BlockingScheduler
 from typosniffer.utils.click_utility import LoggingCommand
 
@@ -22,8 +25,12 @@ def clear(days: int):
 
 @click.command(cls=LoggingCommand)
 @click.option('--force', is_flag=True, help='force scan even on already updated domains')
+@click.option('-o', '--output', type=click.Path(dir_okay=True, writable=True), help='File to export the suspicious domains found')
+@click.option('-f', '--format', type=click.Choice(utility.STREAM_FORMATS, case_sensitive=False), default='csv', help='format of output file')
 def discovery(
-    force: bool
+    force: bool,
+    output: Optional[str] = None,
+    format: str = 'csv'
 ):  
     """Discover and save new suspicious domains by scanning whoisds.com latest registered domains"""
     domains = domain.get_domains()
@@ -47,6 +54,8 @@ def discovery(
     #clear if max_days is set
     with console.status("Cleaning old Domains"):
         whoisds.clear_old_domains(clear_days)
+        if cfg.whois_cache_days > 0:
+            whois_cache.clear_whois_cache(cfg.whois_cache_days)
 
     #update domains files
     domains_files = whoisds.update_domains(days, max_workers=cfg.updating_workers)
@@ -60,10 +69,13 @@ def discovery(
 
         #sniff new updated files to find typo squatting
         sniff_result = whoisds.sniff_whoisds(domains, criteria=criteria, whoisds_files=domains_files, max_workers=cfg.discovery_workers)
+
+        if output:
+            utility.save_stream(sniff_result, Path(output).resolve(), sniffer.SNIFF_RESULT_FIELDS, format.lower())
         
         #given the list of suspicious domains retrieve their respective whois data
         with console.status("[bold green]Retrieving whois data[/bold green]"):
-            whois_data = whoisfinder.find_whois([sniff.domain for sniff in sniff_result], max_workers=cfg.whois_workers, requests_per_minute=cfg.requests_per_minute)
+            whois_data = whoisfinder.find_whois([sniff.domain for sniff in sniff_result], max_workers=cfg.whois_workers, requests_per_minute=cfg.requests_per_minute, server_requests_per_minute=cfg.server_requests_per_minute, cache_days=cfg.whois_cache_days, bootstrap_days=cfg.rdap_bootstrap_days)
         with console.status("[bold green]Updating Suspicious Domains List[/bold green]"):
             suspicious_domain.add_suspicious_domain(sniff_result, whois_data)
 
@@ -72,29 +84,50 @@ def discovery(
         console.print_info("Force a new scan by using: --force")
 
 @click.command(cls=LoggingCommand)
-def inspect():
-    """Given all the registered suspicious domains, check if the website (if it exist) changed and run a similarity comparison against the real domain"""
+@click.option('--all', '-a', 'inspect_all', is_flag=True, help="Inspect every suspicious domain, ignoring the inspection schedule.")
+@click.option('--budget', '-b', type=click.IntRange(min=1), help="Maximum number of domains inspected, the most overdue first. Defaults to the configured value.")
+@click.option('--worker', '-w', is_flag=True, help="Claim the due domains from the queue shared with the other workers, any number of workers can run on one or many hosts.")
+def inspect(inspect_all: bool, budget: Optional[int], worker: bool):
+    """Given the registered suspicious domains due for inspection, check if the website (if it exist) changed and run a similarity comparison against the real domain"""
 
-    with console.status("Retrieving suspicious domain list"):
-        domains = suspicious_domain.get_all_suspicious_domains()
-
-    if len(domains) == 0:
-        console.print_info("No suspicious domains have been found: use 'typosniffer discovery' to update the list")
-        return
+    if inspect_all and worker:
+        raise click.UsageError("--all cannot be used with --worker, workers only claim the domains due for inspection")
 
     cfg = get_config()
+    schedule = cfg.inspection.schedule
 
     start_date = datetime.now()
 
+    if worker:
+        worker_id = f"{socket.gethostname()}:{os.getpid()}"
+        console.print_info(f"Inspecting as worker {worker_id}")
+        domains = suspicious_domain.iter_claimed_suspicious_domains(worker_id, cfg.inspection.worker, budget)
+    elif inspect_all or not schedule.enabled:
+        domains = suspicious_domain.iter_suspicious_domains()
+    else:
+        budget = schedule.budget if budget is None else budget
+        #due dates are stored on the database clock
+        now = suspicious_domain.database_now()
+        due = suspicious_domain.count_due_suspicious_domains(now)
+        console.print_info(f"{due} suspicious domains due for inspection" + (f", inspecting at most {budget}" if budget is not None and due > budget else ""))
+        domains = suspicious_domain.iter_due_suspicious_domains(now, budget)
+
     with console.status("Inspecting suspicious domains"):
+        #suspicious domains are streamed from the database while they are inspected
         reports = inspect_domains(domains, cfg.inspection.max_workers)
 
-        for report in reports:
-            domain = report.suspicious_domain
-            if report.update_report:
-                console.print_info(f"Domain {domain.name} updated: {report.update_report}")
-            if report.phishing_report:
-                console.print_info(f"Domain {domain.name} phishing scan: {report.phishing_report}")
+    if len(reports) == 0:
+        console.print_info("No suspicious domains to inspect: use 'typosniffer discovery' to update the list or 'typosniffer inspect --all' to ignore the schedule")
+        return
+
+    domains = [report.suspicious_domain for report in reports]
+
+    for report in reports:
+        domain = report.suspicious_domain
+        if report.update_report:
+            console.print_info(f"Domain {domain.name} updated: {report.update_report}")
+        if report.phishing_report:
+            console.print_info(f"Domain {domain.name} phishing scan: {report.phishing_report}")
         
     notification.notify_inspection_suspicious_domains(inspection_date=start_date, reports=reports, suspicious_domains=domains)
 
@@ -112,6 +145,12 @@ def _monitor_task():
     #run inspect command
     ctx = click.Context(inspect)
     ctx.forward(inspect)
+
+    #compact old website records if a retention is configured
+    cfg = get_config().inspection
+    if cfg.record_retention_days is not None:
+        console.print_info("Compacting Website Records")
+        website_record.compact_records(cfg.record_retention_days, cfg.keep_screenshots)
             
 @click.command(cls=LoggingCommand)
 @click.argument('hour')
@@ -123,6 +162,8 @@ def monitor(hour: str, minute: str):
 
     try:
         scheduler.add_job(_monitor_task, 'cron', hour=hour, minute=minute)
+        #drain the screenshots left behind by deletions
+        scheduler.add_job(website_record.collect_screenshots, 'interval', minutes=10)
         console.print_info("Press Ctrl+{} to exit".format("Break" if os.name == "nt" else "C"))
         scheduler.start()
     except ValueError as e:
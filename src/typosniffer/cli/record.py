@@ -1,6 +1,8 @@
 import click
+from typing import Optional
 from rich.prompt import Confirm
 from rich.table import Table
+from typosniffer.config.config import get_config
 from typosniffer.data.dto import DomainDTO
 from typosniffer.service import website_record
 from typosniffer.utils import console
@@ -21,18 +23,16 @@ def list(suspicious_domain: str, order: str, limit: int):
 
     domain = DomainDTO(name = suspicious_domain)
     ascending = order == 'asc'
-    records = website_record.get_suspicious_domain_records(domain, ascending, limit)
-    
-    if records:
-        table = Table(title=f"{suspicious_domain} records")
-        table.add_column("Id")
-        table.add_column("Url")
-        table.add_column("Creation Date")
-        table.add_column("Status")
-
-        for record in records:
-            table.add_row(str(record.id), record.website_url, record.creation_date.isoformat(), record.status.name)
+    table = Table(title=f"{suspicious_domain} records")
+    table.add_column("Id")
+    table.add_column("Url")
+    table.add_column("Creation Date")
+    table.add_column("Status")
 
+    for record in website_record.iter_suspicious_domain_records(domain, ascending, limit):
+        table.add_row(str(record.id), record.website_url, record.creation_date.isoformat(), record.status.name)
+
+    if table.row_count > 0:
         console.print_info(table)
     else:
         console.print_info(f"Records not found for domain {suspicious_domain}")
@@ -48,4 +48,22 @@ def clear():
         console.print_warning("⚠️  Operation cancelled.")
 
 
+@record.command()
+@click.option('--days', '-d', type=click.IntRange(min=1), help="Compact records older than this number of days, defaults to the configured retention.")
+@click.option('--keep', '-k', type=click.IntRange(min=0), help="Number of newest screenshots kept for each domain, defaults to the configured value.")
+def compact(days: Optional[int], keep: Optional[int]):
+    """Compact old records to their status transitions and remove expired screenshots"""
+
+    cfg = get_config().inspection
+
+    days = days or cfg.record_retention_days
+    keep = cfg.keep_screenshots if keep is None else keep
+
+    if days is None:
+        console.print_error("Retention not configured: use --days or set inspection.record_retention_days")
+        return
+
+    with console.status("[bold green]Compacting records[/bold green]"):
+        deleted, removed = website_record.compact_records(days, keep)
 
+    console.print_info(f"Deleted {deleted} records and removed {removed} screenshots")
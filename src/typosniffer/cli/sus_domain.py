@@ -56,16 +56,14 @@ def domain_list(domain: str):
         console.print_info(f"Domain not found, use 'typosniffer domain add {domain}' to register it")
         return
 
-    suspicious_domains = suspicious_domain_service.get_suspicious_domains(domain_dto)
+    table = rich.table.Table(title="Suspicious Domains")
+    table.add_column("Id", justify="left")
+    table.add_column("Name", justify="right")
 
-    if len(suspicious_domains) > 0:
-        table = rich.table.Table(title="Suspicious Domains")
-        table.add_column("Id", justify="left")
-        table.add_column("Name", justify="right")
-
-        for domain in suspicious_domains:
-            table.add_row(str(domain.id), domain.name)  
+    for suspicious_domain in suspicious_domain_service.iter_suspicious_domains(domain_dto):
+        table.add_row(str(suspicious_domain.id), suspicious_domain.name)  
 
+    if table.row_count > 0:
         console.print_info(table)
     else:
         console.print_info(f"No suspicious domains were found for {domain}, use: 'typosniffer discovery' to update")
@@ -1,14 +1,17 @@
 import asyncio
+import multiprocessing
 from pathlib import Path
 import click
 import imagehash
-import whoisit
-from typosniffer.config.config import get_config
+import rich
+from typosniffer.config.config import CnnSettings, get_config
 from typosniffer.data.dto import DomainDTO
+from typosniffer.service import domain as domain_service
 from typosniffer.sniffing import cnn, fuzzer, monitor, sniffer, whoisfinder
 from typosniffer.utils import utility
 from typosniffer.utils import console
 from typosniffer.utils.click_utility import LoggingGroup
+from typosniffer.utils.exceptions import ServiceFailure
 from PIL import Image
 
 
@@ -17,6 +20,17 @@ def tools():
 	"""additional tools"""
 
 
+def _collect_domains(domains: tuple[str, ...], registered: bool) -> list[DomainDTO]:
+	"""Validate the given domain names, adding the registered domains if requested"""
+
+	domain_dtos = {DomainDTO(name=domain) for domain in domains}
+
+	if registered:
+		domain_dtos.update(DomainDTO(name=domain.name) for domain in domain_service.get_domains())
+
+	return sorted(domain_dtos, key=lambda domain: domain.name)
+
+
 @tools.command()
 @click.option(
 	'-w', '--max_workers',
@@ -45,21 +59,39 @@ def tools():
 	callback=utility.list_file_option,
 	default=utility.get_resource("words.txt")
 )
+@click.option(
+	'-fw', '--fuzzing-workers',
+	type=click.IntRange(min=1),
+	default=multiprocessing.cpu_count(),
+	help="Max numbers of processes used in parallel to fuzz the domains"
+)
+@click.option('-at', '--all-tlds', is_flag=True, default=False, help='Combine every permutation with every top level domain of the dictionary')
+@click.option('-r', '--registered', is_flag=True, default=False, help='Include all the registered domains')
 @click.option('-o', '--output', type=click.Path(dir_okay=True, writable=True), help='File to write results')
-@click.argument('domain')
-def dns(tld_dictionary: list[str], word_dictionary: list[str], nameservers: list[str], max_workers: int, output: str | None, domain: str):
-	"""Using a set of DNS servers and a target domain, return all potential fuzzed subdomains or domain variations that can be resolved"""
+@click.option('-f', '--format', type=click.Choice(utility.STREAM_FORMATS, case_sensitive=False), default='json', help='format of output file')
+@click.argument('domains', nargs=-1)
+def dns(tld_dictionary: list[str], word_dictionary: list[str], nameservers: list[str], max_workers: int, fuzzing_workers: int, all_tlds: bool, registered: bool, output: str | None, format: str, domains: tuple[str, ...]):
+	"""Using a set of DNS servers and one or more target domains, return all potential fuzzed subdomains or domain variations that can be resolved"""
 	
-	domain_dto = DomainDTO(name=domain)
+	domain_dtos = _collect_domains(domains, registered)
+
+	if len(domain_dtos) == 0:
+		console.print_error("No domains given: pass one or more domains or use --registered")
+		return
 	
 	with console.status("[bold green]Sniffing potential similar domains[/bold green]"):
-		results = sniffer.search_dns(domain_dto, tld_dictionary=tld_dictionary, word_dictionary=word_dictionary, nameservers=nameservers, max_workers=max_workers)
+		results = sniffer.iter_dns(domain_dtos, tld_dictionary=tld_dictionary, word_dictionary=word_dictionary, nameservers=nameservers, max_workers=max_workers, fuzzing_workers=fuzzing_workers, all_tlds=all_tlds)
+
+		if output:
+			# stream every resolved domain to the file as soon as it is resolved
+			total = utility.save_stream(results, Path(output).resolve(), sniffer.DNS_RESULT_FIELDS, format.lower())
+			console.print_info(f"[bold green]DNS resolution completed! {total} domains resolved[/bold green]")
+			return
+
+		results = {result.domain: result.ips for result in results}
 	
 	console.print_info("[bold green]DNS resolution completed![/bold green]")
 	console.print_info(results)
-	
-	if output:
-		utility.save_as_json(results, output)
 
 @tools.command()
 @click.option(
@@ -76,33 +108,34 @@ def dns(tld_dictionary: list[str], word_dictionary: list[str], nameservers: list
 	callback=utility.list_file_option,
 	default=utility.get_resource("words.txt")
 )
-@click.option('-f', '--format', type=click.Choice(['csv', 'json'], case_sensitive=False), default='csv', help='format of output file')
+@click.option('-f', '--format', type=click.Choice(utility.STREAM_FORMATS, case_sensitive=False), default='csv', help='format of output file')
 @click.option('-u', '--unicode', is_flag=True, default=False, help='Write domains in unicode instead of punycode')
-@click.argument('domain')
+@click.option(
+	'-fw', '--fuzzing-workers',
+	type=click.IntRange(min=1),
+	default=multiprocessing.cpu_count(),
+	help="Max numbers of processes used in parallel to fuzz the domains"
+)
+@click.option('-at', '--all-tlds', is_flag=True, default=False, help='Combine every permutation with every top level domain of the dictionary')
+@click.option('-r', '--registered', is_flag=True, default=False, help='Include all the registered domains')
+@click.argument('domains', nargs=-1)
 @click.argument('filename', type=click.Path(dir_okay=True, writable=True))
-def fuzzing(unicode: bool, tld_dictionary: list[str], word_dictionary: list[str], filename: str, format: str, domain: str):
-	"""Generate possible permutations of a given domain used in typosquatting"""
+def fuzzing(unicode: bool, tld_dictionary: list[str], word_dictionary: list[str], filename: str, format: str, fuzzing_workers: int, all_tlds: bool, registered: bool, domains: tuple[str, ...]):
+	"""Generate possible permutations of one or more domains used in typosquatting"""
 	format = format.lower()
 
-	domain_dto = DomainDTO(name=domain)
+	domain_dtos = _collect_domains(domains, registered)
+
+	if len(domain_dtos) == 0:
+		console.print_error("No domains given: pass one or more domains or use --registered")
+		return
 
 	with console.status("[bold green]Running Domain Fuzzing..[/bold green]"):
 		file_path = Path(filename).resolve()
 
-		fuzz_generator = fuzzer.fuzz(domain_dto, tld_dictionary, word_dictionary, unicode)
-
-		if format == 'json':
+		fuzz_generator = fuzzer.fuzz_many(domain_dtos, tld_dictionary, word_dictionary, unicode, max_workers=fuzzing_workers, all_tlds=all_tlds)
 
-			output = {}
-			for permutation in fuzz_generator:
-				output.setdefault(permutation.fuzzer, []).append(permutation.domain)
-
-			utility.save_as_json(output, file_path)
-		elif format == 'csv':
-			utility.save_as_csv(fuzz_generator, file_path)
-		else:
-			console.print_error(f"Unknown format: {format}. Supported: json, plain, csv")
-			return
+		utility.save_stream(fuzz_generator, file_path, fuzzer.PERMUTATION_FIELDS, format)
 		
 
 @tools.command()
@@ -123,11 +156,56 @@ def compare_images(file1: Path, file2: Path, hash_alg: str, hash_size: int):
 	hash1 = imagehash.hex_to_hash(str(hash1))
 	hash2 = imagehash.hex_to_hash(str(hash2))
 	
-	cnn_comparator = cnn.ImageComparator()
-
 	console.print_info(f"hash hamming: {hash2 - hash1}")
 	console.print_info(f"similarity hash: {1 - (hash2 - hash1) / (hash_size)**2}")
-	console.print_info(f"similarity ccn: {cnn_comparator.get_similarity(image1, image2)}")
+
+	with cnn.ImageComparator() as cnn_comparator:
+		console.print_info(f"similarity ccn: {cnn_comparator.get_similarity(image1, image2)}")
+
+# Models compared by benchmark_cnn when no candidate is given
+BENCHMARK_CANDIDATES = (
+	"torch:resnet50:256",
+	"torchscript:resnet50:256",
+	"torch:mobilenet_v3_large:224",
+	"torch:mobilenet_v3_small:224",
+	"torch:efficientnet_b0:224",
+)
+
+def _parse_candidate(candidate: str) -> CnnSettings:
+	"""parse a model candidate written as runtime:architecture[:resolution][:int8]"""
+	runtime, architecture, *options = candidate.split(":")
+	settings = {'runtime': runtime, 'architecture': architecture, 'quantize': 'int8' in options}
+	resolutions = [option for option in options if option.isdigit()]
+	if resolutions:
+		settings['resolution'] = int(resolutions[0])
+	return CnnSettings(**settings)
+
+@tools.command()
+@click.option('-c', '--candidate', 'candidates', multiple=True, help="Model to benchmark as runtime:architecture[:resolution][:int8], e.g. onnx:mobilenet_v3_small:224:int8. Can be repeated")
+@click.argument('pairs', type=click.Path(exists=True, dir_okay=False, path_type=Path))
+def benchmark_cnn(candidates: tuple[str, ...], pairs: Path):
+	"""Benchmark latency and accuracy of the screenshot comparison models on a labeled csv of screenshot pairs (columns: image1, image2, label)"""
+
+	labeled_pairs = cnn.read_pairs(pairs)
+	if not labeled_pairs:
+		console.print_error(f"No screenshot pairs found in {pairs}")
+		return
+
+	table = rich.table.Table(title=f"Benchmark on {len(labeled_pairs)} screenshot pairs")
+	for column in ("Model", "Load (s)", "Latency (ms/image)", "ROC AUC", "Accuracy", "Threshold"):
+		table.add_column(column, justify="right")
+
+	for candidate in candidates or BENCHMARK_CANDIDATES:
+		try:
+			settings = _parse_candidate(candidate)
+			with console.status(f"[bold green]Benchmarking {candidate}[/bold green]"):
+				result = cnn.benchmark(settings, labeled_pairs)
+		except (ValueError, ServiceFailure) as e:
+			console.print_error(f"Skipping {candidate}: {e}")
+			continue
+		table.add_row(result.name, f"{result.load_seconds:.2f}", f"{result.ms_per_image:.1f}", f"{result.auc:.3f}", f"{result.accuracy:.3f}", f"{result.threshold:.3f}")
+
+	console.print_info(table)
 
 @tools.command()
 @click.argument('domain1')
@@ -148,10 +226,20 @@ def compare_domains(domain1: str, domain2: str):
 
 @tools.command()
 @click.argument('domain')
-def who(domain: str):
+@click.option('-nc', '--no-cache', is_flag=True, default=False, help='Ignore the whois cache and always query the domain')
+def who(domain: str, no_cache: bool):
 
 	DomainDTO(name=domain)
 
-	whoisit.bootstrap(overrides=True)
-	console.console.print(whoisfinder.get_whois(domain))
+	cfg = get_config().discovery
+
+	whois_data = whoisfinder.find_whois(
+		[domain],
+		requests_per_minute=cfg.requests_per_minute,
+		max_workers=1,
+		server_requests_per_minute=cfg.server_requests_per_minute,
+		cache_days=0 if no_cache else cfg.whois_cache_days,
+		bootstrap_days=cfg.rdap_bootstrap_days
+	)
+	console.console.print(whois_data.get(domain))
 
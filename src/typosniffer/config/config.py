@@ -1,10 +1,10 @@
 
 import os
 import pathlib
-from typing import ClassVar, Optional
+from typing import ClassVar, Literal, Optional
 from pydantic_settings import BaseSettings, SettingsConfigDict
 import yaml
-from pydantic import ConfigDict, DirectoryPath, EmailStr, Field, FilePath
+from pydantic import ConfigDict, DirectoryPath, EmailStr, Field, FilePath, model_validator
 from typosniffer import FOLDER
 from typosniffer.data.dto import SniffCriteria
 from typosniffer.utils.utility import expand_and_create_dir, get_resource
@@ -45,12 +45,12 @@ class DatabaseSettings(BaseSettings):
 	"""Configuration for the database connection."""
 	model_config = ConfigDict(frozen=True)
 
-	drivername: str = Field("postgresql+psycopg2", description="The SQLAlchemy database drivername used to connect.")
+	drivername: str = Field("postgresql+psycopg2", description="The SQLAlchemy database drivername used to connect, use 'sqlite' for an embedded database.")
 	username: str = Field("postgres", description="Username for connecting to the database.")
 	password: str = Field("postgres", description="Password for authenticating the database user.")
 	host: str = Field("localhost", description="Hostname or IP address of the database server.")
 	port: int = Field(5432, description="Port number used to connect to the database.")
-	database: str = Field("postgres", description="Name of the database to connect to.")
+	database: str = Field("postgres", description="Name of the database to connect to, or the path of the database file when using sqlite.")
 
 # Configuration for the discovery step
 class DiscoverySettings(BaseSettings):
@@ -63,8 +63,96 @@ class DiscoverySettings(BaseSettings):
 	criteria: 'SniffCriteria' = Field(default_factory=lambda: SniffCriteria(), description="Criteria used when evaluating a domain.")
 
 	# Whois configuration
-	whois_workers: int = Field(default=10, ge=1, description="Thread pool size used to retrieve whois information from domains.")
+	whois_workers: int = Field(default=10, ge=1, description="Maximum number of concurrent requests used to retrieve whois information from domains.")
 	requests_per_minute: int = Field(default=10, ge=1, description="Number of whois requests allowed per minute per top-level domain.")
+	server_requests_per_minute: Optional[int] = Field(default=None, ge=1, description="Number of whois requests allowed per minute per rdap/whois server. If None, defaults to 'requests_per_minute'.")
+	whois_cache_days: int = Field(default=7, ge=0, description="Number of days the whois data of a domain is reused before querying it again. If 0, the whois cache is disabled.")
+	rdap_bootstrap_days: int = Field(default=7, ge=1, description="Number of days the rdap bootstrap data saved on disk is used before downloading it again.")
+
+# Describes how website pages are loaded and captured during the inspection
+class CaptureProfile(BaseSettings):
+	model_config = ConfigDict(frozen=True)
+
+	wait_until: Literal["commit", "domcontentloaded", "load", "networkidle"] = Field("networkidle", description="Event waited before taking the screenshot.")
+	blocked_resources: list[str] = Field(default_factory=list, description="Playwright resource types that are not downloaded, like 'font', 'media' or 'image'.")
+	blocked_domains: list[str] = Field(default_factory=list, description="Requests to these domains and their subdomains are blocked, useful for trackers and ads.")
+	viewport_width: int = Field(1366, ge=1, description="Width of the browser viewport.")
+	viewport_height: int = Field(768, ge=1, description="Height of the browser viewport.")
+	full_page: bool = Field(True, description="Capture the whole page instead of the viewport only.")
+	max_height: Optional[int] = Field(None, ge=1, description="Maximum height of a full page capture, longer pages are cut. If None, the whole page is captured.")
+	max_width: Optional[int] = Field(None, ge=1, description="Screenshots wider than this value are downscaled before being hashed and saved. If None, they are kept at full size.")
+
+
+TRACKER_DOMAINS = [
+	"google-analytics.com",
+	"googletagmanager.com",
+	"googlesyndication.com",
+	"googleadservices.com",
+	"doubleclick.net",
+	"facebook.net",
+	"hotjar.com",
+	"clarity.ms",
+	"scorecardresearch.com",
+	"quantserve.com",
+	"criteo.com",
+	"taboola.com",
+	"outbrain.com",
+	"adnxs.com",
+	"amazon-adsystem.com",
+]
+
+def default_capture_profiles() -> dict[str, CaptureProfile]:
+	return {
+		#page captured as it is, the slowest profile
+		"full": CaptureProfile(),
+		"balanced": CaptureProfile(
+			blocked_resources=["font", "media"],
+			blocked_domains=TRACKER_DOMAINS,
+			max_height=4096,
+			max_width=1024,
+		),
+		"light": CaptureProfile(
+			wait_until="load",
+			blocked_resources=["font", "media", "websocket", "eventsource"],
+			blocked_domains=TRACKER_DOMAINS,
+			full_page=False,
+			max_width=1024,
+		),
+	}
+
+# Configuration of the model used to compare the screenshots of suspicious and original domains
+class CnnSettings(BaseSettings):
+	model_config = ConfigDict(frozen=True)
+
+	runtime: Literal["torch", "torchscript", "onnx"] = Field("torch", description="Runtime of the model, 'onnx' requires the onnxruntime package.")
+	architecture: Literal["resnet50", "mobilenet_v3_large", "mobilenet_v3_small", "efficientnet_b0"] = Field("resnet50", description="Pretrained model used to compute the screenshot embeddings, mobilenet and efficientnet are lighter on cpu.")
+	resolution: int = Field(256, ge=32, description="Screenshots are fitted, keeping their aspect ratio, in a square of this many pixels before computing their embedding.")
+	quantize: bool = Field(False, description="Use dynamic int8 quantization of the model weights, only supported by the 'onnx' runtime.")
+
+	@model_validator(mode="after")
+	def check_quantize(self):
+		if self.quantize and self.runtime != "onnx":
+			raise ValueError("Dynamic quantization is only supported by the 'onnx' runtime")
+		return self
+
+# Configuration of the adaptive inspection schedule of the suspicious domains
+class ScheduleSettings(BaseSettings):
+	model_config = ConfigDict(frozen=True)
+
+	enabled: bool = Field(True, description="Inspect only the domains due according to their history. If False, every domain is inspected on every run.")
+	min_hours: int = Field(20, ge=1, description="Interval in hours between the inspections of active domains: changed since the last inspection or recently added. Keep it below the interval between runs.")
+	max_up_days: int = Field(7, ge=1, description="Maximum interval in days between the inspections of a stable website, the interval doubles after each inspection without changes.")
+	max_down_days: int = Field(60, ge=1, description="Maximum interval in days between the inspections of a domain without a website.")
+	new_domain_days: int = Field(7, ge=0, description="Days after being added during which a suspicious domain is inspected every min_hours.")
+	budget: Optional[int] = Field(None, ge=1, description="Maximum number of domains inspected in a run, the most overdue first. If None, every due domain is inspected.")
+
+# Configuration of the inspection workers sharing the queue of due suspicious domains
+class WorkerSettings(BaseSettings):
+	model_config = ConfigDict(frozen=True)
+
+	claim_size: int = Field(10, ge=1, description="Number of due domains claimed by a worker in a single transaction.")
+	lease_minutes: int = Field(10, ge=1, description="Minutes a claimed domain is reserved to its worker, if it is not inspected in time it can be claimed again.")
+	max_attempts: int = Field(3, ge=1, description="Claims of a domain whose lease expired before it is postponed to its next scheduled inspection.")
 
 # Configuration for the inspection step
 class InspectionSettings(BaseSettings):
@@ -74,6 +162,28 @@ class InspectionSettings(BaseSettings):
 	page_load_timeout: int = Field(default=30, ge=0, description="Timeout in seconds when loading a page to take a screenshot.")
 	hash_threshold: int = Field(default=6, ge=0, le=16, description="Hamming distance between the latest and current website screenshot hashes used to detect changes in the website")
 	max_workers: int = Field(default=multiprocessing.cpu_count(), ge=1, description="Maximum number of workers for parallel inspection tasks.")
+	browsers: int = Field(default=1, ge=1, description="Number of browser processes used to take screenshots, the workers are spread across them.")
+	image_workers: int = Field(default=multiprocessing.cpu_count(), ge=1, description="Process pool size used to decode, hash and encode screenshots.")
+	browser_recycle_pages: int = Field(default=200, ge=1, description="Number of pages a browser loads before it is restarted to release its memory.")
+	record_retention_days: Optional[int] = Field(default=None, ge=1, description="Website records older than this value are compacted to their status transitions by the monitor. If None, records are never compacted.")
+	dom_threshold: Optional[int] = Field(default=3, ge=0, le=64, description="Hamming distance between the DOM fingerprints of the last record and the current page under which the page is considered unchanged and its screenshot is not taken. If None, every page is screenshotted.")
+	screenshot_format: Literal["webp", "png"] = Field(default="webp", description="Lossless format of the stored screenshots, webp files are several times smaller than png.")
+	thumbnail_width: Optional[int] = Field(default=480, ge=16, description="Width of the thumbnail generated for each stored screenshot, thumbnails are uploaded in notifications instead of the full screenshot. If None, thumbnails are not generated.")
+	keep_screenshots: int = Field(default=5, ge=0, description="Number of newest screenshots kept for each suspicious domain when compacting website records.")
+	cnn: CnnSettings = Field(default_factory=CnnSettings, description="Model used to compare website screenshots.")
+	schedule: ScheduleSettings = Field(default_factory=ScheduleSettings, description="Adaptive schedule deciding which suspicious domains are inspected in a run.")
+	worker: WorkerSettings = Field(default_factory=WorkerSettings, description="Job queue used by 'inspect --worker' processes.")
+	capture_profile: str = Field(default="balanced", description="Name of the capture profile used to take screenshots, see 'capture_profiles'.")
+	capture_profiles: dict[str, CaptureProfile] = Field(default_factory=default_capture_profiles, description="Available capture profiles by name.")
+
+	@model_validator(mode="after")
+	def check_capture_profile(self):
+		if self.capture_profile not in self.capture_profiles:
+			raise ValueError(f"Capture profile '{self.capture_profile}' not found in capture_profiles")
+		return self
+
+	def get_capture_profile(self) -> CaptureProfile:
+		return self.capture_profiles[self.capture_profile]
 
 # Email configuration for sending notifications
 class EmailSettings(BaseSettings):
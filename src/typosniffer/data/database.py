@@ -1,4 +1,5 @@
-from sqlalchemy import URL, create_engine
+from pathlib import Path
+from sqlalchemy import URL, create_engine, event
 from sqlalchemy.orm import sessionmaker, scoped_session
 
 from typosniffer.config.config import get_config
@@ -7,6 +8,47 @@ from .tables import *
 
 
 
+# Pragmas applied to every sqlite connection: WAL lets readers run while the writer commits
+SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'foreign_keys': 'ON',
+    'busy_timeout': 30000,
+    'cache_size': -64000,
+    'temp_store': 'MEMORY',
+    'mmap_size': 268435456,
+}
+
+
+def _set_sqlite_pragmas(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    for pragma, value in SQLITE_PRAGMAS.items():
+        cursor.execute(f"PRAGMA {pragma}={value}")
+    cursor.close()
+
+
+def _create_engine(database_cfg):
+
+    if database_cfg.drivername.startswith('sqlite'):
+        #the database field is the path of the database file
+        database_file = Path(database_cfg.database).expanduser()
+        database_file.parent.mkdir(parents=True, exist_ok=True)
+        engine = create_engine(URL.create(drivername=database_cfg.drivername, database=str(database_file)), echo=False)
+        event.listen(engine, "connect", _set_sqlite_pragmas)
+        return engine
+
+    DATABASE_URL = URL.create( 
+        drivername = database_cfg.drivername,
+        username = database_cfg.username,
+        password = database_cfg.password,
+        host = database_cfg.host,
+        port = database_cfg.port,
+        database = database_cfg.database
+    )
+
+    return create_engine(DATABASE_URL, echo=False)
+
+
 class DB:
     _engine = None
     _session_factory = None
@@ -15,18 +57,7 @@ class DB:
     def get_session(cls):
         if cls._engine is None:
 
-            database_cfg = get_config().database
-
-            DATABASE_URL = URL.create( 
-                drivername = database_cfg.drivername,
-                username = database_cfg.username,
-                password = database_cfg.password,
-                host = database_cfg.host,
-                port = database_cfg.port,
-                database = database_cfg.database
-            )
-
-            cls._engine = create_engine(DATABASE_URL, echo=False)
+            cls._engine = _create_engine(get_config().database)
             cls._session_factory = scoped_session(sessionmaker(bind=cls._engine, expire_on_commit=False))
             Base.metadata.create_all(cls._engine)
         return cls._session_factory()
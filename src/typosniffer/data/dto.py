@@ -1,3 +1,4 @@
+from datetime import datetime
 import idna
 import enum
 from enum import Enum
@@ -40,6 +41,11 @@ class SuspiciousDomainDTO(BaseModel):
     id: int
     name: str = Field(pattern=VALID_FQDN_REGEX)
     original_domain: DomainDTO
+    #latest website record, used by the inspection to compare the website state
+    last_record: Optional["WebsiteRecordDTO"] = None
+    added_date: Optional[datetime] = None
+    last_inspected: Optional[datetime] = None
+    next_inspection: Optional[datetime] = None
 
     @field_validator("name", mode="before")
     @classmethod
@@ -69,6 +75,17 @@ class WebsiteStatus(Enum):
     def is_website_up(self) -> bool:
         return self in (WebsiteStatus.UP, WebsiteStatus.CHANGED)
 
+class WebsiteRecordDTO(BaseModel):
+    model_config = ConfigDict(from_attributes=True, frozen=True)
+
+    id: int
+    website_url: Optional[str] = None
+    screenshot_hash: Optional[str] = None
+    screenshot_blob: Optional[str] = None
+    dom_fingerprint: Optional[str] = None
+    creation_date: datetime
+    status: WebsiteStatus
+
 def dto_to_orm(dto: BaseModel, orm_cls):
     return orm_cls(**dto.model_dump())
 
@@ -1,6 +1,8 @@
-from typing import List
-from sqlalchemy import Column, Integer, Enum as SqlEnum, ForeignKey, String, Table, UniqueConstraint,DateTime, ARRAY, Boolean, func
+from typing import List, Optional
+from sqlalchemy import Column, Integer, Enum as SqlEnum, ForeignKey, Index, String, Table, UniqueConstraint,DateTime, ARRAY, Boolean, JSON, func
+from sqlalchemy.ext.compiler import compiles
 from sqlalchemy.orm import relationship, declarative_base, Mapped
+from sqlalchemy.sql.expression import FunctionElement
 
 from typosniffer.data.dto import EntityType
 from typosniffer.data.dto import WebsiteStatus
@@ -9,12 +11,36 @@ from typosniffer.data.dto import WebsiteStatus
 
 Base = declarative_base()
 
+# list of strings, stored as json on databases without native arrays like sqlite
+StringList = ARRAY(String(50)).with_variant(JSON(), 'sqlite')
+
+
+class db_now(FunctionElement):
+    """
+    Current time of the database, the single clock used to schedule and lease the inspections so that workers
+    on hosts with skewed clocks agree on which domains are due
+    """
+    type = DateTime()
+    inherit_cache = True
+
+
+@compiles(db_now)
+def _compile_db_now(element, compiler, **kw):
+    #timestamp without time zone in the session time zone, as stored by now() in a timestamp column
+    return "LOCALTIMESTAMP"
+
+
+@compiles(db_now, 'sqlite')
+def _compile_db_now_sqlite(element, compiler, **kw):
+    #UTC like CURRENT_TIMESTAMP, with microseconds so it sorts with the datetimes bound by python
+    return "strftime('%Y-%m-%d %H:%M:%f000', 'now')"
+
 class Domain(Base):
     __tablename__ = "domain"
 
     id = Column(Integer, primary_key=True)
     name = Column(String(100), nullable=False, unique=True)
-    suspicious_domains: Mapped[List["SuspiciousDomain"]] = relationship("SuspiciousDomain", back_populates="original_domain", cascade='all, delete-orphan, delete')
+    suspicious_domains: Mapped[List["SuspiciousDomain"]] = relationship("SuspiciousDomain", back_populates="original_domain", cascade='all, delete-orphan, delete', passive_deletes=True)
 
 
 suspicious_domain_entity = Table(
@@ -31,7 +57,16 @@ class SuspiciousDomain(Base):
     id = Column(Integer, primary_key=True)
     name = Column(String(100), nullable=False)
     original_domain_id = Column(Integer, ForeignKey('domain.id', ondelete='CASCADE'), nullable=False)
+    #latest website record of the domain, maintained when a record is added
+    last_record_id = Column(Integer, ForeignKey('website_record.id', ondelete='SET NULL', use_alter=True, name='fk_suspicious_domain_last_record'), nullable=True)
     added_date = Column(DateTime, nullable=False, server_default=func.now())
+    #inspection schedule, the domains are inspected in order of next_inspection once it is due
+    last_inspected = Column(DateTime, nullable=True)
+    next_inspection = Column(DateTime, nullable=False, server_default=db_now(), index=True)
+    #lease of the worker inspecting the domain, an expired lease makes the domain claimable again
+    lease_owner = Column(String(100), nullable=True)
+    lease_until = Column(DateTime, nullable=True)
+    inspection_attempts = Column(Integer, nullable=False, default=0, server_default='0')
 
     whois_server = Column(String(100), nullable=True)
     updated_date = Column(DateTime, nullable=True)
@@ -39,12 +74,17 @@ class SuspiciousDomain(Base):
     expiration_date = Column(DateTime, nullable=True)
     url = Column(String(100), nullable=True)
 
-    status = Column(ARRAY(String(50)))
-    nameservers = Column(ARRAY(String(50)))
+    status = Column(StringList)
+    nameservers = Column(StringList)
     dnssec= Column(Boolean())
 
+    __table_args__ = (
+        UniqueConstraint('name', 'original_domain_id', name='uix_suspicious_domain_original'),
+    )
+
     entities: Mapped[List["Entity"]] = relationship("Entity", secondary=suspicious_domain_entity, back_populates="suspicious_domains")
-    records: Mapped[List["WebsiteRecord"]] = relationship("WebsiteRecord", back_populates='suspicious_domain', cascade='all, delete-orphan, delete')
+    records: Mapped[List["WebsiteRecord"]] = relationship("WebsiteRecord", back_populates='suspicious_domain', cascade='all, delete-orphan, delete', foreign_keys="WebsiteRecord.suspicious_domain_id", passive_deletes=True)
+    last_record: Mapped[Optional["WebsiteRecord"]] = relationship("WebsiteRecord", foreign_keys=[last_record_id], post_update=True)
     original_domain: Mapped["Domain"] = relationship("Domain",back_populates="suspicious_domains",lazy="joined")
 
 
@@ -82,10 +122,38 @@ class WebsiteRecord(Base):
 
     website_url = Column(String, nullable=True)  
     screenshot_hash = Column(String(16), nullable=True)
+    # stored screenshot, shared by all the records with the same image
+    screenshot_blob = Column(String(80), nullable=True, index=True)
+    # SimHash of the page DOM, an unchanged fingerprint skips the screenshot
+    dom_fingerprint = Column(String(16), nullable=True)
     creation_date = Column(DateTime, nullable=False, index=True)
     status: WebsiteStatus = Column(SqlEnum(WebsiteStatus), nullable=False)
 
-    suspicious_domain: Mapped["SuspiciousDomain"] = relationship("SuspiciousDomain", back_populates="records")
+    # not partitioned by creation_date: the monitoring reads the newest records of a domain through this index
+    # and the last_record pointer, which never scan by date, and compact_records bounds the size of the table.
+    # A partitioned table would also need creation_date in its primary key, breaking the last_record foreign key
+    __table_args__ = (
+        Index('ix_website_record_domain_creation_date', 'suspicious_domain_id', creation_date.desc()),
+    )
+
+    suspicious_domain: Mapped["SuspiciousDomain"] = relationship("SuspiciousDomain", back_populates="records", foreign_keys=[suspicious_domain_id])
+
+
+class WhoisCache(Base):
+    __tablename__ = "whois_cache"
 
+    domain = Column(String(253), primary_key=True)
+    data = Column(JSON, nullable=False)
+    retrieval_date = Column(DateTime, nullable=False, index=True)
 
-    
\ No newline at end of file
+
+class ScreenshotTombstone(Base):
+    """screenshots waiting to be removed from disk by the garbage collector"""
+    __tablename__ = "screenshot_tombstone"
+
+    id = Column(Integer, primary_key=True)
+    domain_name = Column(String(100), nullable=False)
+    # date of the screenshot, if null the whole screenshot folder of the domain is removed
+    creation_date = Column(DateTime, nullable=True)
+    # stored screenshot, it is removed only if no record references it anymore
+    blob = Column(String(80), nullable=True)
@@ -1,9 +1,10 @@
 
+from sqlalchemy import select
 from sqlalchemy.exc import IntegrityError
 from typosniffer.data.database import DB
 from typosniffer.data.dto import DomainDTO, dto_to_orm
 from typosniffer.data.dto import orm_to_dto
-from typosniffer.data.tables import Domain
+from typosniffer.data.tables import Domain, SuspiciousDomain
 from typosniffer.service import suspicious_domain, website_record
 from typosniffer.utils.exceptions import ServiceFailure
 
@@ -43,23 +44,26 @@ def add_domains(domains: list[DomainDTO]):
                 raise ServiceFailure(f"Failed adding domains: '{orm_domain.name}' already exists.")
 
 def remove_domains(domains: list[DomainDTO]):
-    """Remove list of domains from DB"""
+    """Remove list of domains from DB, their suspicious domains are deleted by the database cascades"""
 
     domain_names = [domain.name for domain in domains]
 
     with DB.get_session() as session, session.begin():
-        
-        to_delete = session.query(Domain).filter(Domain.name.in_(domain_names)).all()
-        deleted_count = len(to_delete)
-        for d in to_delete:
-            session.delete(d)
+
+        domain_ids = select(Domain.id).where(Domain.name.in_(domain_names))
+        website_record.tombstone_suspicious_domains(session, SuspiciousDomain.original_domain_id.in_(domain_ids))
+        deleted_count = session.query(Domain).filter(Domain.name.in_(domain_names)).delete(synchronize_session=False)
+        suspicious_domain.delete_entity_orphan(session)
+
+    website_record.start_screenshot_collector()
         
     return deleted_count
 
 def clear_domains():
     
     with DB.get_session() as session, session.begin():
-        session.query(Domain).delete()
+        website_record.tombstone_suspicious_domains(session)
+        session.query(Domain).delete(synchronize_session=False)
         suspicious_domain.delete_entity_orphan(session)
-        website_record.remove_all_screenshots()
 
+    website_record.start_screenshot_collector()
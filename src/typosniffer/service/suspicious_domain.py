@@ -1,15 +1,24 @@
-from typing import Optional
+import datetime
+import time
+from typing import Generator, Optional
+from sqlalchemy import or_, select, tuple_, update
+from sqlalchemy.dialects import postgresql, sqlite
 from sqlalchemy.orm import Session, joinedload, with_loader_criteria
 
 from typosniffer.data.database import DB
+from typosniffer.config.config import WorkerSettings
 from typosniffer.data.dto import DomainDTO, EntityType, SuspiciousDomainDTO, orm_to_dto
-from typosniffer.data.tables import Domain, Entity, SuspiciousDomain
+from typosniffer.data.tables import Domain, Entity, SuspiciousDomain, db_now, suspicious_domain_entity
 from typosniffer.service import website_record
 from typosniffer.sniffing.sniffer import SniffResult
 from typosniffer.utils.exceptions import ServiceFailure
 from typosniffer.utils.logger import log
 
 
+# Number of suspicious domains read in a single page
+PAGE_SIZE = 500
+
+
 def get_suspicious_domain(domain: str, types: list[EntityType]) -> Optional[SuspiciousDomain]:
      with DB.get_session() as session, session.begin():
         return (
@@ -22,21 +31,196 @@ def get_suspicious_domain(domain: str, types: list[EntityType]) -> Optional[Susp
             .first()
         )
 
-def get_all_suspicious_domains() -> list[SuspiciousDomainDTO]:
+def iter_suspicious_domains(domain: Optional[DomainDTO] = None, page_size: int = PAGE_SIZE) -> Generator[SuspiciousDomainDTO, None, None]:
+    """
+    Lazily yield the suspicious domains, optionally only the ones of a registered domain.
+
+    Rows are read in pages using keyset pagination on the id, each page in a short transaction,
+    so the first domains can be processed while the next ones are still to be fetched.
+    """
+
+    last_id = 0
+
+    while True:
+
+        with DB.get_session() as session, session.begin():
+
+            query = (
+                session.query(SuspiciousDomain)
+                .options(joinedload(SuspiciousDomain.last_record))
+                .filter(SuspiciousDomain.id > last_id)
+            )
+            if domain is not None:
+                query = query.join(SuspiciousDomain.original_domain).filter(Domain.name == domain.name)
+
+            page = [orm_to_dto(sd, SuspiciousDomainDTO) for sd in query.order_by(SuspiciousDomain.id).limit(page_size)]
 
+        yield from page
+
+        if len(page) < page_size:
+            return
+
+        last_id = page[-1].id
+
+
+def database_now() -> datetime.datetime:
+    """current time of the database, inspections are scheduled and leased on this clock, see tables.db_now"""
     with DB.get_session() as session, session.begin():
-        
-        suspicious_domains = session.query(SuspiciousDomain).all()
+        return session.scalar(select(db_now()))
+
+
+def _due_criteria(now: datetime.datetime) -> tuple:
+    """domains due for inspection at now, the ones being inspected by a worker are skipped until their lease expires"""
+    return (
+        SuspiciousDomain.next_inspection <= now,
+        or_(SuspiciousDomain.lease_until.is_(None), SuspiciousDomain.lease_until < now)
+    )
+
+
+def iter_due_suspicious_domains(now: datetime.datetime, budget: Optional[int] = None, page_size: int = PAGE_SIZE) -> Generator[SuspiciousDomainDTO, None, None]:
+    """
+    Lazily yield the suspicious domains due for inspection at now, the most overdue first, at most budget domains.
+    now is a time of the database clock, see database_now.
+
+    The index on next_inspection is used as priority queue, rows are read in pages using keyset pagination
+    on (next_inspection, id). Inspected domains are scheduled after now, so they are never yielded twice.
+    """
 
-        return [orm_to_dto(sd, SuspiciousDomainDTO) for sd in suspicious_domains]
+    last_key = None
+    remaining = budget
 
+    while remaining is None or remaining > 0:
 
-def get_suspicious_domains(domain: DomainDTO) -> list[SuspiciousDomain]:
+        limit = page_size if remaining is None else min(page_size, remaining)
+
+        with DB.get_session() as session, session.begin():
+
+            query = (
+                session.query(SuspiciousDomain)
+                .options(joinedload(SuspiciousDomain.last_record))
+                .filter(*_due_criteria(now))
+            )
+            if last_key is not None:
+                query = query.filter(tuple_(SuspiciousDomain.next_inspection, SuspiciousDomain.id) > last_key)
+
+            page = [orm_to_dto(sd, SuspiciousDomainDTO) for sd in query.order_by(SuspiciousDomain.next_inspection, SuspiciousDomain.id).limit(limit)]
+
+        yield from page
+
+        if len(page) < limit:
+            return
+
+        last_key = (page[-1].next_inspection, page[-1].id)
+        if remaining is not None:
+            remaining -= len(page)
+
+
+def count_due_suspicious_domains(now: datetime.datetime) -> int:
+    with DB.get_session() as session, session.begin():
+        return session.query(SuspiciousDomain).filter(*_due_criteria(now)).count()
+
+
+def schedule_inspections(session: Session, schedules: list[tuple[int, datetime.datetime, datetime.datetime]]):
+    """store the inspection schedule of a batch of suspicious domains given as (id, last_inspected, next_inspection), releasing their leases"""
+    session.execute(
+        update(SuspiciousDomain),
+        [
+            {
+                'id': id,
+                'last_inspected': last_inspected,
+                'next_inspection': next_inspection,
+                'lease_owner': None,
+                'lease_until': None,
+                'inspection_attempts': 0
+            }
+            for id, last_inspected, next_inspection in schedules
+        ]
+    )
+
+
+def claim_suspicious_domains(worker: str, settings: WorkerSettings, limit: Optional[int] = None) -> list[SuspiciousDomainDTO]:
+    """
+    Lease to the worker the most overdue suspicious domains that are not leased by another worker.
+
+    Rows are selected FOR UPDATE SKIP LOCKED, so concurrent workers never wait for each other nor claim the same domain.
+    The lease is released when the inspection schedule of the domain is stored, a domain whose lease expired is claimed
+    again; after max_attempts claims it is postponed to its next scheduled inspection instead.
+    Due dates and leases are compared with the database clock, so workers on different hosts agree on them.
+    """
+
+    limit = settings.claim_size if limit is None else min(limit, settings.claim_size)
 
     with DB.get_session() as session, session.begin():
-        
-        suspicious_domains = session.query(SuspiciousDomain).join(SuspiciousDomain.original_domain).filter(Domain.name == domain.name).all()
-        return suspicious_domains
+
+        now = session.scalar(select(db_now()))
+
+        ids = []
+        while not ids:
+
+            rows = session.execute(
+                select(SuspiciousDomain.id, SuspiciousDomain.inspection_attempts, SuspiciousDomain.next_inspection, SuspiciousDomain.last_inspected)
+                .where(*_due_criteria(now))
+                .order_by(SuspiciousDomain.next_inspection, SuspiciousDomain.id)
+                .limit(limit)
+                .with_for_update(skip_locked=True)
+            ).all()
+
+            if not rows:
+                return []
+
+            failed = [row for row in rows if row.inspection_attempts >= settings.max_attempts]
+            if failed:
+                log.warning(f"Postponing {len(failed)} suspicious domains whose inspection failed {settings.max_attempts} times")
+                postponed = []
+                for row in failed:
+                    #keep the current interval, a domain never inspected is retried the next day
+                    interval = row.next_inspection - row.last_inspected if row.last_inspected else datetime.timedelta(days=1)
+                    postponed.append((row.id, row.last_inspected or now, now + interval))
+                schedule_inspections(session, postponed)
+
+            ids = [row.id for row in rows if row.inspection_attempts < settings.max_attempts]
+
+        session.execute(
+            update(SuspiciousDomain)
+            .where(SuspiciousDomain.id.in_(ids))
+            .values(
+                lease_owner=worker,
+                lease_until=now + datetime.timedelta(minutes=settings.lease_minutes),
+                inspection_attempts=SuspiciousDomain.inspection_attempts + 1
+            )
+        )
+
+        return [
+            orm_to_dto(sd, SuspiciousDomainDTO)
+            for sd in (
+                session.query(SuspiciousDomain)
+                .options(joinedload(SuspiciousDomain.last_record))
+                .filter(SuspiciousDomain.id.in_(ids))
+                .order_by(SuspiciousDomain.next_inspection, SuspiciousDomain.id)
+            )
+        ]
+
+
+def iter_claimed_suspicious_domains(worker: str, settings: WorkerSettings, budget: Optional[int] = None) -> Generator[SuspiciousDomainDTO, None, None]:
+    """Lazily claim and yield due suspicious domains until none is left or budget domains were claimed, see claim_suspicious_domains"""
+
+    remaining = budget
+
+    while remaining is None or remaining > 0:
+
+        claimed = claim_suspicious_domains(worker, settings, remaining)
+        if not claimed:
+            return
+
+        log.debug(f"Worker {worker} claimed {len(claimed)} suspicious domains")
+        yield from claimed
+
+        if remaining is not None:
+            remaining -= len(claimed)
+
+
+def get_all_suspicious_domains() -> list[SuspiciousDomainDTO]:
+    return list(iter_suspicious_domains())
 
 
 def delete_entity_orphan(session: Session):
@@ -45,142 +229,196 @@ def delete_entity_orphan(session: Session):
 
 
 def remove_suspicious_domain(suspicious_domains: list[str]) -> int:
-
+    """Remove suspicious domains by name, their records and entity links are deleted by the database cascades"""
 
     with DB.get_session() as session, session.begin():
 
-        to_delete = session.query(SuspiciousDomain).filter(SuspiciousDomain.name.in_(suspicious_domains)).all()
-        deleted_count = len(to_delete)
-        for d in to_delete:
-            session.delete(d)
+        criteria = SuspiciousDomain.name.in_(suspicious_domains)
+        website_record.tombstone_suspicious_domains(session, criteria)
+        deleted_count = session.query(SuspiciousDomain).filter(criteria).delete(synchronize_session=False)
         delete_entity_orphan(session)
 
+    website_record.start_screenshot_collector()
+
     return deleted_count
 
 def clear_suspicious_domains():
     
     with DB.get_session() as session, session.begin():
-        session.query(SuspiciousDomain).delete()
+        website_record.tombstone_suspicious_domains(session)
+        session.query(SuspiciousDomain).delete(synchronize_session=False)
         delete_entity_orphan(session)
-        website_record.remove_all_screenshots()
 
+    website_record.start_screenshot_collector()
 
 
-def _get_or_create_entity(session: Session, entity_type: EntityType, entity_data: dict) -> Entity:
-    """create or get a domain entity based on a dictionary containing the relevant data"""
 
+# Number of sniff results persisted in a single transaction
+BATCH_SIZE = 1000
 
-    log.debug(f"Adding new entity: {entity_data}")
+# Bound parameters allowed in a single statement, a multi-row INSERT is split to stay below them
+# (SQLITE_MAX_VARIABLE_NUMBER of sqlite before 3.32, the protocol limit of postgresql)
+MAX_PARAMETERS = {'sqlite': 999, 'postgresql': 65535}
 
-    name = entity_data.get("name", "")
-    url = entity_data.get("url", "")
-    entity = session.query(Entity).filter_by(name=name, type=entity_type, url=url).first()
-    if entity is None:
+# Whois fields stored in the suspicious domain columns
+SUSPICIOUS_DOMAIN_FIELDS = {
+    'nameservers': 'nameservers',
+    'url': 'url',
+    'dnssec': 'dnssec',
+    'whois_server': 'whois_server',
+    'last_changed_date': 'updated_date',
+    'registration_date': 'creation_date',
+    'expiration_date': 'expiration_date',
+    'status': 'status',
+}
 
-        flat_data = entity_data.copy()
-        address_data = flat_data.pop("address", {})
-        flat_data.update(address_data)
+ENTITY_FIELDS = {col.name for col in Entity.__table__.columns} - {'id', 'type'}
 
-        valid_fields = {col.name for col in Entity.__table__.columns}
-        filtered_data = {k: v for k, v in flat_data.items() if k in valid_fields}
-        filtered_data['type'] = entity_type
 
-        entity = Entity(**filtered_data)
+def _entity_row(entity_type: EntityType, entity_data: dict) -> dict:
+    """flatten the whois data of an entity to the entity columns"""
 
-        log.debug(f"Added new entity: {entity}")
-    else:
-        log.debug(f"Entity already persisted {entity}")
+    flat_data = entity_data.copy()
+    address_data = flat_data.pop("address", {}) or {}
+    flat_data.update(address_data)
 
+    #every row needs the same columns to be inserted in a single statement
+    row = {k: flat_data.get(k) for k in ENTITY_FIELDS}
+    row['name'] = row.get('name') or ''
+    row['url'] = row.get('url') or ''
+    row['type'] = entity_type
+    return row
 
-    return entity
 
+def _entity_key(row: dict) -> tuple:
+    return (row['name'], row['type'], row['url'])
 
-def create_suspicious_domain(
-    session: Session,
-    original_domain_name: str, 
-    suspicious_domain: SuspiciousDomain,
-    entities: list[Entity] | None = None, 
-) -> SuspiciousDomain:
-    """Create or get a SuspiciousDomain and attach entities"""
-    log.debug(f"Creating new suspicious domain: {suspicious_domain.name}")
 
+def _insert(session: Session, table):
+    """INSERT supporting ON CONFLICT for the dialect in use"""
+    if session.get_bind().dialect.name == 'sqlite':
+        return sqlite.insert(table)
+    return postgresql.insert(table)
 
-    entities = entities or []
 
-    # Get original domain
-    original_domain = session.query(Domain).filter_by(name=original_domain_name).first()
-    if original_domain is None:
-        raise ServiceFailure(f"Original domain '{original_domain_name}' not found")
-    
-    # Check if suspicious domain already exists
-    suspicious = (
-        session.query(SuspiciousDomain)
-        .filter_by(name=suspicious_domain.name, original_domain_id=original_domain.id)
-        .first()
-    )
+def _chunks(session: Session, table, rows: list[dict]) -> Generator[list[dict], None, None]:
+    """
+    split the rows of a multi-row INSERT so that each statement stays below the bound parameters limit,
+    every column of the table is counted since the columns with a python default are bound too
+    """
+    if not rows:
+        return
+    size = max(1, MAX_PARAMETERS.get(session.get_bind().dialect.name, MAX_PARAMETERS['sqlite']) // len(table.columns))
+    for i in range(0, len(rows), size):
+        yield rows[i:i + size]
+
+
+def _upsert_entities(session: Session, rows: list[dict]) -> dict[tuple, int]:
+    """insert the missing entities and return the id of each entity key"""
+
+    ids = {}
+
+    for chunk in _chunks(session, Entity.__table__, rows):
+        #the no-op update makes RETURNING include the entities already persisted
+        stmt = _insert(session, Entity).values(chunk)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=['name', 'type', 'url'],
+            set_={'name': stmt.excluded.name}
+        ).returning(Entity.id, Entity.name, Entity.type, Entity.url)
+
+        ids.update({(name, entity_type, url): id for id, name, entity_type, url in session.execute(stmt)})
 
-    if suspicious is None:
-        # Assign original domain and entities at creation
-        session.add(suspicious_domain)
-        suspicious_domain.original_domain_id = original_domain.id
-        suspicious_domain.entities = entities
-        suspicious = suspicious_domain
-        log.debug(f"Added new suspicious domain: {suspicious}")
-    else:
-        # Add any new entities that are not already linked
-        for entity in entities:
-            if entity not in suspicious.entities:
-                suspicious.entities.append(entity)
-        log.debug(f"Suspicious domain already persisted: {suspicious}")
+    return ids
 
-    return suspicious
 
+def _upsert_suspicious_domains(session: Session, rows: list[dict]) -> dict[tuple, int]:
+    """insert the missing suspicious domains, already persisted ones are left untouched, and return their ids"""
 
+    ids = {}
+
+    for chunk in _chunks(session, SuspiciousDomain.__table__, rows):
+        stmt = _insert(session, SuspiciousDomain).values(chunk)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=['name', 'original_domain_id'],
+            set_={'name': stmt.excluded.name}
+        ).returning(SuspiciousDomain.id, SuspiciousDomain.name, SuspiciousDomain.original_domain_id)
+
+        ids.update({(name, original_domain_id): id for id, name, original_domain_id in session.execute(stmt)})
+
+    return ids
+
+
+def _persist_batch(session: Session, batch: list[SniffResult], whois_data: dict, original_domain_ids: dict[str, int]) -> int:
+    """persist a batch of sniff results, returns the number of rows written"""
+
+    entity_rows: dict[tuple, dict] = {}
+    domain_rows: dict[tuple, dict] = {}
+    domain_entities: dict[tuple, set[tuple]] = {}
+
+    for result in batch:
+
+        data = whois_data.get(result.domain, {})
+
+        domain_key = (result.domain, original_domain_ids[result.original_domain])
+
+        row = {column: data.get(field) for field, column in SUSPICIOUS_DOMAIN_FIELDS.items()}
+        row['name'], row['original_domain_id'] = domain_key
+        domain_rows[domain_key] = row
+
+        #entities are deduplicated in memory, the same registrar is usually shared by many domains
+        keys = domain_entities.setdefault(domain_key, set())
+        for entity_type, entities in (data.get('entities') or {}).items():
+            for entity_data in entities or []:
+                entity_row = _entity_row(EntityType[entity_type.upper()], entity_data)
+                key = _entity_key(entity_row)
+                entity_rows.setdefault(key, entity_row)
+                keys.add(key)
+
+    entity_ids = _upsert_entities(session, list(entity_rows.values()))
+    domain_ids = _upsert_suspicious_domains(session, list(domain_rows.values()))
+
+    links = [
+        {'suspicious_domain_id': domain_ids[domain_key], 'entity_id': entity_ids[key]}
+        for domain_key, keys in domain_entities.items()
+        for key in keys
+    ]
+
+    for chunk in _chunks(session, suspicious_domain_entity, links):
+        session.execute(_insert(session, suspicious_domain_entity).values(chunk).on_conflict_do_nothing())
+
+    return len(entity_rows) + len(domain_rows) + len(links)
 
 
 def add_suspicious_domain(sniff_results: set[SniffResult], whois_data: dict):
-    """Add Suspicious domain given sniff result and domain data"""
+    """
+    Add Suspicious domains given sniff results and domain data.
+
+    Original domains are resolved with a single query, then results are written in batches
+    using INSERT ... ON CONFLICT (postgresql or sqlite), one transaction per batch.
+    """
 
     log.info(f"Adding {len(sniff_results)} to database")
 
+    start = time.perf_counter()
 
-    for result in sniff_results:
-        with DB.get_session() as session, session.begin():
-    
-            log.debug(f"Init {result.domain} persistance")
-
-            
-            data = whois_data.get(result.domain, {})
-
-            #list of entities present in the whois data
-            found_entities: list[Entity] = []
-            
-            for entityType, entities in data.get('entities', {}).items():
-                if not entities:
-                    continue
-                for entity_data in entities:
-                    found_entities.append(_get_or_create_entity(session, EntityType[entityType.upper()], entity_data))
-
-                    
-            create_suspicious_domain(
-                session=session,
-                original_domain_name=result.original_domain,
-                entities=found_entities,
-                suspicious_domain=SuspiciousDomain(
-                    name=result.domain,
-                    nameservers=data.get('nameservers'),
-                    url=data.get('url'),
-                    dnssec=data.get('dnssec'),
-                    whois_server=data.get('whois_server'),
-                    updated_date = data.get('last_changed_date'),
-                    creation_date = data.get('registration_date'),
-                    expiration_date = data.get('expiration_date'),
-                    status = data.get('status')
-                )
-            )
-            log.debug(f"End {result.domain} persistance")
+    results = list(sniff_results)
+    original_names = {result.original_domain for result in results}
 
+    with DB.get_session() as session:
 
+        with session.begin():
+            original_domain_ids = dict(
+                session.query(Domain.name, Domain.id).filter(Domain.name.in_(original_names)).all()
+            )
 
+        missing = original_names - original_domain_ids.keys()
+        if missing:
+            raise ServiceFailure(f"Original domains not found: {', '.join(sorted(missing))}")
 
+        rows = 0
+        for i in range(0, len(results), BATCH_SIZE):
+            with session.begin():
+                rows += _persist_batch(session, results[i:i + BATCH_SIZE], whois_data, original_domain_ids)
 
+    elapsed = time.perf_counter() - start
+    log.info(f"Persisted {len(results)} suspicious domains, {rows} rows in {elapsed:.2f}s ({rows / max(elapsed, 1e-6):.0f} rows/s)")
@@ -2,92 +2,333 @@
 
 import datetime
 import os
+import shutil
+import threading
+import time
 from pathlib import Path
-from typing import Optional
+from typing import Generator, Optional
 from typosniffer.config.config import get_config
 from typosniffer.data.database import DB
-from typosniffer.data.dto import DomainDTO, SuspiciousDomainDTO
-from typosniffer.data.tables import SuspiciousDomain, WebsiteRecord
+from typosniffer.data.dto import DomainDTO, SuspiciousDomainDTO, WebsiteStatus
+from typosniffer.data.tables import ScreenshotTombstone, SuspiciousDomain, WebsiteRecord
 from sqlalchemy.orm import Session
-from sqlalchemy import event
+from sqlalchemy import and_, func, insert, or_, select, update
 
 from typosniffer.utils.logger import log
 
-@event.listens_for(Session, "before_flush")
-def delete_screenshots(session, flush_context, instances):
 
-    for obj in session.deleted:
-        
-        if isinstance(obj, WebsiteRecord):
-            remove_record_screenshot(obj)
+# Number of tombstones drained by the screenshot garbage collector in a single transaction
+GC_BATCH_SIZE = 1000
+
+# Blobs written more recently than this are never collected, the record referencing them may not be committed yet
+BLOB_GRACE_SECONDS = 3600
+
+# Folders of the screenshot store inside the screenshot directory
+BLOBS_DIR = "blobs"
+THUMBNAILS_DIR = "thumbnails"
+
+# only one garbage collector drains the tombstones of this process at a time
+_gc_lock = threading.Lock()
 
 
 def add_record(session: Session, record: WebsiteRecord):
-    return session.add(record)
+    """add a record and make it the last record of its suspicious domain"""
+    session.add(record)
+    session.flush()
+    (
+        session.query(SuspiciousDomain)
+        .filter(SuspiciousDomain.id == record.suspicious_domain_id)
+        .update({SuspiciousDomain.last_record_id: record.id}, synchronize_session=False)
+    )
+
+
+def add_records(session: Session, records: list[WebsiteRecord]):
+    """add a batch of records and make each one the last record of its suspicious domain"""
+    session.add_all(records)
+    session.flush()
+    last_records = {record.suspicious_domain_id: record.id for record in records}
+    session.execute(
+        update(SuspiciousDomain),
+        [{'id': domain_id, 'last_record_id': record_id} for domain_id, record_id in last_records.items()]
+    )
+
+
+def set_dom_fingerprints(session: Session, fingerprints: list[tuple[int, str]]):
+    """store the DOM fingerprints of a batch of records given as (id, dom_fingerprint)"""
+    session.execute(
+        update(WebsiteRecord),
+        [{'id': id, 'dom_fingerprint': dom_fingerprint} for id, dom_fingerprint in fingerprints]
+    )
 
 
 def get_last_record_of_domain(session: Session, domain: SuspiciousDomainDTO) -> Optional[WebsiteRecord]:
     return (
-            session.query(WebsiteRecord) 
-            .join(WebsiteRecord.suspicious_domain) 
-            .filter(SuspiciousDomain.name == domain.name) 
-            .order_by(WebsiteRecord.creation_date.desc()) 
+            session.query(WebsiteRecord)
+            .join(SuspiciousDomain, SuspiciousDomain.last_record_id == WebsiteRecord.id)
+            .filter(SuspiciousDomain.id == domain.id)
             .first()
         )
 
-def get_suspicious_domain_records(domain: DomainDTO, ascending: bool, limit: int) -> Optional[list[WebsiteRecord]]:
+def iter_suspicious_domain_records(domain: DomainDTO, ascending: bool, limit: int, batch_size: int = 500) -> Generator[WebsiteRecord, None, None]:
+    """Lazily yield the records of a suspicious domain, rows are streamed from a server side cursor in batches"""
     with DB.get_session() as session, session.begin():
+        suspicious_domain_ids = session.query(SuspiciousDomain.id).filter(SuspiciousDomain.name == domain.name).scalar_subquery()
         query = (
             session.query(WebsiteRecord)
-            .join(WebsiteRecord.suspicious_domain) 
-            .filter(SuspiciousDomain.name == domain.name)
+            .filter(WebsiteRecord.suspicious_domain_id.in_(suspicious_domain_ids))
         )
         order_expr = WebsiteRecord.creation_date.asc() if ascending else WebsiteRecord.creation_date.desc()
         query = query.order_by(order_expr)
         if limit > 0:
             query = query.limit(limit)
-        return query.all()
+        yield from query.execution_options(stream_results=True).yield_per(batch_size)
 
-def get_screenshot_from_record(record: WebsiteRecord) -> Path:  
-    return get_screenshot(record.suspicious_domain, record.creation_date)
+def get_blob_path(blob: str) -> Path:
+    return get_config().inspection.screenshot_dir / BLOBS_DIR / blob[:2] / blob
 
-def get_screenshot(suspicious_domain: SuspiciousDomainDTO, date: datetime) -> Path:
+def get_thumbnail_path(blob: str) -> Path:
+    return get_config().inspection.screenshot_dir / THUMBNAILS_DIR / blob[:2] / f"{Path(blob).stem}.webp"
+
+def get_screenshot_preview(blob: str) -> Path:
+    """thumbnail of a stored screenshot, or the screenshot itself if it has no thumbnail"""
+    thumbnail = get_thumbnail_path(blob)
+    return thumbnail if thumbnail.exists() else get_blob_path(blob)
+
+def _write_file(path: Path, data: bytes):
+    """write a file atomically, readers never see a partial file"""
+    os.makedirs(path.parent, exist_ok=True)
+    tmp_path = path.with_name(f"{path.name}.{threading.get_ident()}.tmp")
+    tmp_path.write_bytes(data)
+    os.replace(tmp_path, path)
+
+def store_screenshot(blob: str, data: bytes, thumbnail: Optional[bytes] = None) -> Path:
+    """
+    Store a screenshot in the content addressed store, blobs are named by the digest of the image so a screenshot
+    identical to an already stored one (e.g. parking pages) is not written again.
+    Must be called before the record referencing the blob is committed.
+    """
+    path = get_blob_path(blob)
+    try:
+        #refresh the age of the blob so the garbage collector does not remove it before the record is committed
+        os.utime(path)
+    except FileNotFoundError:
+        _write_file(path, data)
+    if thumbnail is not None and not get_thumbnail_path(blob).exists():
+        _write_file(get_thumbnail_path(blob), thumbnail)
+    return path
+
+def _screenshot_path(domain_name: str, date: datetime.datetime) -> Path:
     timestamp = date.strftime("%Y%m%d_%H%M%S")
-    image_file = get_config().inspection.screenshot_dir / suspicious_domain.name / f"{timestamp}.png"
+    image_file = get_config().inspection.screenshot_dir / domain_name / f"{timestamp}.png"
     return image_file
 
-def remove_record_screenshot(record: WebsiteRecord):
-    domain_screenshot_file: Path = get_screenshot_from_record(record)
+def _remove_screenshot(domain_screenshot_file: Path) -> bool:
     log.debug(f"Removing screenshot in {domain_screenshot_file}")
     if domain_screenshot_file.exists():
         domain_screenshot_file.unlink()
 
         if not any(domain_screenshot_file.parent.iterdir()):
             domain_screenshot_file.parent.rmdir()
+        return True
+    return False
+
+def _is_recent_blob(blob: str) -> bool:
+    try:
+        return time.time() - get_blob_path(blob).stat().st_mtime < BLOB_GRACE_SECONDS
+    except FileNotFoundError:
+        return False
+
+def _remove_blob(blob: str) -> bool:
+    log.debug(f"Removing screenshot blob {blob}")
+    get_thumbnail_path(blob).unlink(missing_ok=True)
+    path = get_blob_path(blob)
+    if path.exists():
+        path.unlink()
+        return True
+    return False
+
+def _remove_screenshot_dir(domain_name: str) -> bool:
+    domain_screenshot_dir = get_config().inspection.screenshot_dir / domain_name
+    log.debug(f"Removing screenshots in {domain_screenshot_dir}")
+    if domain_screenshot_dir.is_dir():
+        shutil.rmtree(domain_screenshot_dir, ignore_errors=True)
+        return True
+    return False
+
+
+def tombstone_suspicious_domains(session: Session, *criteria) -> int:
+    """
+    Queue the removal of the screenshots of the suspicious domains matching the criteria.
+
+    Must be called in the same transaction and before the suspicious domains (or their records) are deleted,
+    the files are removed later by collect_screenshots.
+    """
+    names = select(SuspiciousDomain.name).where(*criteria).distinct()
+    blobs = (
+        select(SuspiciousDomain.name, WebsiteRecord.screenshot_blob)
+        .join(SuspiciousDomain, SuspiciousDomain.id == WebsiteRecord.suspicious_domain_id)
+        .where(WebsiteRecord.screenshot_blob.is_not(None), *criteria)
+        .distinct()
+    )
+    return (
+        session.execute(insert(ScreenshotTombstone).from_select(['domain_name'], names)).rowcount
+        + session.execute(insert(ScreenshotTombstone).from_select(['domain_name', 'blob'], blobs)).rowcount
+    )
+
+
+def tombstone_records(session: Session, *criteria) -> int:
+    """Queue the removal of the screenshots of the website records matching the criteria, see tombstone_suspicious_domains"""
+    screenshots = (
+        select(SuspiciousDomain.name, WebsiteRecord.creation_date, WebsiteRecord.screenshot_blob)
+        .join(SuspiciousDomain, SuspiciousDomain.id == WebsiteRecord.suspicious_domain_id)
+        .where(WebsiteRecord.screenshot_hash.is_not(None), *criteria)
+    )
+    return session.execute(insert(ScreenshotTombstone).from_select(['domain_name', 'creation_date', 'blob'], screenshots)).rowcount
+
+
+def collect_screenshots(batch_size: int = GC_BATCH_SIZE) -> int:
+    """
+    Drain the screenshot tombstones removing their files from disk.
+
+    Tombstones are read and deleted in short transactions, no transaction is held open while files are removed.
+    A tombstone is deleted only after its files are gone, so an interrupted collection is resumed by the next one.
+    A blob is removed only if no record references it, the tombstone of a blob written in the last
+    BLOB_GRACE_SECONDS is kept for a later collection.
+
+    Returns:
+        int: number of removed screenshot files and folders.
+    """
+
+    removed = 0
+    last_id = 0
+
+    with _gc_lock, DB.get_session() as session:
+
+        while True:
+
+            with session.begin():
+                tombstones = (
+                    session.query(ScreenshotTombstone.id, ScreenshotTombstone.domain_name, ScreenshotTombstone.creation_date, ScreenshotTombstone.blob)
+                    .filter(ScreenshotTombstone.id > last_id)
+                    .order_by(ScreenshotTombstone.id)
+                    .limit(batch_size)
+                    .all()
+                )
+                blobs = {blob for _, _, _, blob in tombstones if blob is not None}
+                referenced = set(session.scalars(
+                    select(WebsiteRecord.screenshot_blob).where(WebsiteRecord.screenshot_blob.in_(blobs)).distinct()
+                )) if blobs else set()
+
+            if not tombstones:
+                break
+            last_id = tombstones[-1].id
+
+            collected = []
+            for id, domain_name, creation_date, blob in tombstones:
+                try:
+                    if blob is not None:
+                        if blob in referenced:
+                            #still used by other records
+                            pass
+                        elif _is_recent_blob(blob):
+                            continue
+                        else:
+                            removed += _remove_blob(blob)
+                    elif creation_date is None:
+                        removed += _remove_screenshot_dir(domain_name)
+                    else:
+                        removed += _remove_screenshot(_screenshot_path(domain_name, creation_date))
+                except OSError as e:
+                    log.debug(f"Failed removing screenshots of {domain_name}: {e}")
+                collected.append(id)
+
+            with session.begin():
+                (
+                    session.query(ScreenshotTombstone)
+                    .filter(ScreenshotTombstone.id.in_(collected))
+                    .delete(synchronize_session=False)
+                )
+
+    if removed:
+        log.info(f"Screenshot garbage collector removed {removed} screenshots")
+
+    return removed
+
+
+def start_screenshot_collector() -> threading.Thread:
+    """Drain the screenshot tombstones in a background thread, the thread is not a daemon so the process waits for it before exiting"""
+    thread = threading.Thread(target=collect_screenshots, name="screenshot-gc")
+    thread.start()
+    return thread
+
+
+def compact_records(retention_days: int, keep_screenshots: int) -> tuple[int, int]:
+    """
+    Compact the website records older than retention_days days.
+
+    Old history is reduced to the status transitions: CHANGED records are deleted while UP and DOWN
+    records are kept. The newest keep_screenshots screenshots of each domain and its last record are
+    always kept, the screenshots of the other old records are removed.
+
+    Returns:
+        tuple[int, int]: number of deleted records and of removed screenshot files.
+    """
+
+    oldest_date = datetime.datetime.now() - datetime.timedelta(days=retention_days)
+
+    with DB.get_session() as session, session.begin():
+
+        #rank the records with a screenshot of each domain, the newest one first
+        ranked = (
+            select(
+                WebsiteRecord.id.label('id'),
+                WebsiteRecord.creation_date.label('creation_date'),
+                WebsiteRecord.status.label('status'),
+                func.row_number().over(
+                    partition_by=WebsiteRecord.suspicious_domain_id,
+                    order_by=(WebsiteRecord.screenshot_hash.is_(None), WebsiteRecord.creation_date.desc())
+                ).label('rank'),
+                SuspiciousDomain.last_record_id.label('last_record_id'),
+            )
+            .join(SuspiciousDomain, SuspiciousDomain.id == WebsiteRecord.suspicious_domain_id)
+            .subquery()
+        )
+
+        expired = and_(
+            ranked.c.creation_date < oldest_date,
+            ranked.c.rank > keep_screenshots,
+            or_(ranked.c.last_record_id.is_(None), ranked.c.id != ranked.c.last_record_id)
+        )
+
+        expired_ids = select(ranked.c.id).where(expired)
+        tombstone_records(session, WebsiteRecord.id.in_(expired_ids))
+
+        #the kept records of the expired screenshots no longer have one, so they are not tombstoned again
+        (
+            session.query(WebsiteRecord)
+            .filter(WebsiteRecord.id.in_(expired_ids), WebsiteRecord.screenshot_hash.is_not(None))
+            .update({WebsiteRecord.screenshot_hash: None, WebsiteRecord.screenshot_blob: None}, synchronize_session=False)
+        )
+
+        removable = select(ranked.c.id).where(expired, ranked.c.status == WebsiteStatus.CHANGED)
+
+        deleted_records = (
+            session.query(WebsiteRecord)
+            .filter(WebsiteRecord.id.in_(removable))
+            .delete(synchronize_session=False)
+        )
+
+    #screenshots are removed once the records are committed
+    removed_screenshots = collect_screenshots()
+
+    log.info(f"Compacted website records older than {retention_days} days: {deleted_records} records deleted, {removed_screenshots} screenshots removed")
+
+    return deleted_records, removed_screenshots
 
 def clear_all_records():
     
     with DB.get_session() as session, session.begin():
-        session.query(WebsiteRecord).delete()
-        remove_all_screenshots()
-
-def remove_all_screenshots():
-    for dirpath, dirnames, filenames in os.walk(get_config().inspection.screenshot_dir, topdown=False):
-        # Remove all .png files
-        for filename in filenames:
-            if filename.lower().endswith(".png"):
-                file_path = os.path.join(dirpath, filename)
-                try:
-                    os.remove(file_path)
-                    log.debug(f"Deleted: {file_path}")
-                except Exception as e:
-                    log.debug(f"Failed to delete {file_path}: {e}")
-
-        try:
-            if not os.listdir(dirpath):
-                os.rmdir(dirpath)
-                log.debug(f"Removed empty folder: {dirpath}")
-        except Exception as e:
-            log.debug(f"Failed to remove {dirpath}: {e}")
-        
-    
\ No newline at end of file
+        tombstone_suspicious_domains(session, SuspiciousDomain.records.any())
+        session.query(WebsiteRecord).delete(synchronize_session=False)
+
+    start_screenshot_collector()
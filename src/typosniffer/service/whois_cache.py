@@ -0,0 +1,69 @@
+import datetime
+from typosniffer.data.database import DB
+from typosniffer.data.tables import WhoisCache
+from typosniffer.utils.logger import log
+
+
+# Date fields of the normalized whois data, stored as iso strings in the json column
+DATE_FIELDS = ('last_changed_date', 'registration_date', 'expiration_date')
+
+
+def _to_json(data: dict) -> dict:
+    json_data = dict(data)
+    for field in DATE_FIELDS:
+        if isinstance(json_data.get(field), datetime.datetime):
+            json_data[field] = json_data[field].isoformat()
+    return json_data
+
+
+def _from_json(json_data: dict) -> dict:
+    data = dict(json_data)
+    for field in DATE_FIELDS:
+        if data.get(field):
+            data[field] = datetime.datetime.fromisoformat(data[field])
+    return data
+
+
+def get_fresh_whois(domains: list[str], max_days: int) -> dict[str, dict]:
+    """Return the cached whois data of the given domains retrieved in the last max_days days"""
+
+    oldest_date = datetime.datetime.now() - datetime.timedelta(days=max_days)
+
+    with DB.get_session() as session:
+
+        cached = {}
+
+        #query in chunks to keep the IN clause bounded
+        for i in range(0, len(domains), 1000):
+            rows = (
+                session.query(WhoisCache)
+                .filter(WhoisCache.domain.in_(domains[i:i + 1000]))
+                .filter(WhoisCache.retrieval_date >= oldest_date)
+                .all()
+            )
+            cached.update({row.domain: _from_json(row.data) for row in rows})
+
+    log.debug(f"Found {len(cached)} fresh whois data in cache")
+
+    return cached
+
+
+def save_whois(whois_data: dict[str, dict]):
+    """Store the whois data of the given domains, replacing the previous entries"""
+
+    retrieval_date = datetime.datetime.now()
+
+    with DB.get_session() as session, session.begin():
+        for domain, data in whois_data.items():
+            session.merge(WhoisCache(domain=domain, data=_to_json(data), retrieval_date=retrieval_date))
+
+    log.debug(f"Cached {len(whois_data)} whois data")
+
+
+def clear_whois_cache(max_days: int) -> int:
+    """Remove the cached whois data older than max_days days"""
+
+    oldest_date = datetime.datetime.now() - datetime.timedelta(days=max_days)
+
+    with DB.get_session() as session, session.begin():
+        return session.query(WhoisCache).filter(WhoisCache.retrieval_date < oldest_date).delete(synchronize_session=False)
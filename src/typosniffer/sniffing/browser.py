@@ -0,0 +1,200 @@
+import asyncio
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, field
+from typing import AsyncGenerator, Awaitable, Callable, Optional
+from playwright.async_api import Browser, BrowserContext, Page, Playwright
+from typosniffer.utils.logger import log
+
+
+# Attempts made to launch a browser before giving up
+LAUNCH_ATTEMPTS = 3
+
+
+@dataclass(eq=False)
+class PooledBrowser:
+	"""a browser process of the pool, it serves a fixed number of page slots"""
+	slots: int
+	browser: Optional[Browser] = None
+	served: int = 0
+	returned: int = 0
+	retiring: bool = False
+	failed: bool = False
+
+	def is_alive(self) -> bool:
+		return self.browser is not None and self.browser.is_connected()
+
+
+@dataclass(eq=False)
+class PageLease:
+	"""a pre-warmed context and page borrowed from the pool"""
+	pooled: PooledBrowser
+	context: BrowserContext
+	page: Page
+	crashed: bool = field(default=False)
+
+	def is_alive(self) -> bool:
+		return not self.crashed and not self.page.is_closed() and self.pooled.is_alive()
+
+
+async def _close_quietly(closeable):
+	try:
+		await closeable.close()
+	except Exception as e:
+		log.debug(f"Failed closing {closeable}: {e}")
+
+
+class BrowserPool:
+	"""
+	Pool of pre-warmed browser contexts and pages spread across one or more browser processes.
+
+	Every new context is passed to setup_context, e.g. to install request routes.
+	The context of a page is replaced after each use, so no cookie, storage, cache or service worker of any visited
+	origin carries over to the next lease, while the browser process stays warm. A browser is restarted once it
+	served recycle_after pages, to contain its memory growth, or when it crashed. A browser that fails
+	to restart is launched again on the next lease.
+
+	Usage:
+		async with BrowserPool(playwright, browsers=2, pages=8) as pool:
+			async with pool.lease() as lease:
+				await lease.page.goto(url)
+	"""
+
+	def __init__(self, playwright: Playwright, browsers: int = 1, pages: int = 4, recycle_after: int = 200, launch_options: Optional[dict] = None, context_options: Optional[dict] = None, setup_context: Optional[Callable[[BrowserContext], Awaitable[None]]] = None):
+		browsers = max(1, min(browsers, pages))
+		self.playwright = playwright
+		self.recycle_after = recycle_after
+		self.launch_options = launch_options or {}
+		self.context_options = context_options or {}
+		self.setup_context = setup_context
+		#spread the page slots evenly across the browsers
+		self.browsers = [PooledBrowser(slots=pages // browsers + (i < pages % browsers)) for i in range(browsers)]
+		#a None takes the place of the pages of a browser that failed to restart
+		self.free: asyncio.Queue[Optional[PageLease]] = asyncio.Queue()
+		self.relaunching = asyncio.Lock()
+
+	async def __aenter__(self):
+		await self.start()
+		return self
+
+	async def __aexit__(self, *args):
+		await self.close()
+
+	async def start(self):
+		await asyncio.gather(*(self._start_browser(pooled) for pooled in self.browsers))
+
+	async def close(self):
+		for pooled in self.browsers:
+			if pooled.browser is not None:
+				await _close_quietly(pooled.browser)
+				pooled.browser = None
+
+	@asynccontextmanager
+	async def lease(self) -> AsyncGenerator[PageLease, None]:
+		"""borrow a page, its context is replaced by a new one on exit"""
+
+		while True:
+			lease = await self.free.get()
+			if lease is None:
+				async with self.relaunching:
+					await self._relaunch_failed()
+				continue
+			if lease.is_alive() and not lease.pooled.retiring:
+				break
+			#the browser crashed or is being recycled while the page was idle
+			await self._release(lease)
+
+		lease.pooled.served += 1
+		try:
+			yield lease
+		finally:
+			await self._release(lease)
+
+	async def _launch(self) -> Browser:
+		for attempt in range(1, LAUNCH_ATTEMPTS + 1):
+			try:
+				return await self.playwright.chromium.launch(**self.launch_options)
+			except Exception as e:
+				if attempt == LAUNCH_ATTEMPTS:
+					raise
+				log.warning(f"Failed to launch browser (attempt {attempt}/{LAUNCH_ATTEMPTS}): {e}")
+				await asyncio.sleep(attempt)
+
+	async def _start_browser(self, pooled: PooledBrowser):
+		pooled.browser = await self._launch()
+		pooled.served = 0
+		pooled.returned = 0
+		pooled.retiring = False
+		leases = await asyncio.gather(*(self._new_lease(pooled) for _ in range(pooled.slots)))
+		for lease in leases:
+			self.free.put_nowait(lease)
+
+	async def _restart_browser(self, pooled: PooledBrowser):
+		log.debug(f"Restarting browser after {pooled.served} pages")
+		await _close_quietly(pooled.browser)
+		pooled.browser = None
+		try:
+			await self._start_browser(pooled)
+		except Exception as e:
+			log.error(f"Failed to restart browser, it is launched again on the next lease: {e}")
+			await self._fail_browser(pooled)
+			#wake the leases waiting for a page of this browser
+			for _ in range(pooled.slots):
+				self.free.put_nowait(None)
+
+	async def _relaunch_failed(self):
+		"""launch again the browsers that failed to restart, raises if every browser of the pool failed"""
+		for pooled in self.browsers:
+			if not pooled.failed:
+				continue
+			try:
+				await self._start_browser(pooled)
+				pooled.failed = False
+			except Exception as e:
+				await self._fail_browser(pooled)
+				#retried by a later lease
+				self.free.put_nowait(None)
+				if all(pooled.failed for pooled in self.browsers):
+					raise
+				log.error(f"Failed to launch browser again: {e}")
+
+	async def _fail_browser(self, pooled: PooledBrowser):
+		#the pages opened before the failure are closed with their browser
+		if pooled.browser is not None:
+			await _close_quietly(pooled.browser)
+			pooled.browser = None
+		pooled.failed = True
+
+	async def _new_lease(self, pooled: PooledBrowser) -> PageLease:
+		context = await pooled.browser.new_context(**self.context_options)
+		if self.setup_context is not None:
+			await self.setup_context(context)
+		page = await context.new_page()
+		lease = PageLease(pooled, context, page)
+
+		def on_crash(_):
+			lease.crashed = True
+
+		page.on("crash", on_crash)
+		return lease
+
+	async def _release(self, lease: PageLease):
+		pooled = lease.pooled
+
+		if not pooled.is_alive() or pooled.served >= self.recycle_after:
+			pooled.retiring = True
+
+		await _close_quietly(lease.context)
+
+		if not pooled.retiring:
+			#a fresh context of the same browser takes the place of the used one
+			try:
+				self.free.put_nowait(await self._new_lease(pooled))
+				return
+			except Exception as e:
+				log.warning(f"Failed to open a new page, restarting browser: {e}")
+				pooled.retiring = True
+
+		#the browser is restarted once all of its pages are back
+		pooled.returned += 1
+		if pooled.returned == pooled.slots:
+			await self._restart_browser(pooled)
@@ -1,35 +1,465 @@
+import abc
+from collections import OrderedDict
+from concurrent.futures import Future
+import csv
+from dataclasses import dataclass
+import hashlib
+import os
+from pathlib import Path
+import queue
+import threading
+import time
+from typing import Optional
+import numpy
+from PIL import Image, ImageOps
+import typosniffer
+from typosniffer.config.config import CnnSettings, get_config
+from typosniffer.utils.exceptions import ServiceFailure
+from typosniffer.utils.logger import log
+
+
+EMBEDDING_CACHE_DIR = typosniffer.FOLDER / "embeddings"
+# Exported models (torchscript and onnx) are saved here, named by embedding_name as their input size is fixed
+MODELS_DIR = typosniffer.FOLDER / "models"
+# Embeddings kept on disk, the least recently used ones are removed first
+MAX_CACHED_EMBEDDINGS = 5000
+# Embeddings kept in memory, the least recently used ones are evicted first
+MAX_MEMORY_EMBEDDINGS = 1000
+
+# Color of the bands padding the screenshots to a square, the background of most pages
+PAD_COLOR = (255, 255, 255)
+
+# Maximum number of images in a single forward pass and seconds waited to fill it
+BATCH_SIZE = 16
+BATCH_DELAY = 0.02
+
+# torchvision constructor, pretrained weights and classification head replaced to get the pooled features
+ARCHITECTURES = {
+    'resnet50': ('resnet50', 'ResNet50_Weights.DEFAULT', 'fc'),
+    'mobilenet_v3_large': ('mobilenet_v3_large', 'MobileNet_V3_Large_Weights.DEFAULT', 'classifier'),
+    'mobilenet_v3_small': ('mobilenet_v3_small', 'MobileNet_V3_Small_Weights.DEFAULT', 'classifier'),
+    'efficientnet_b0': ('efficientnet_b0', 'EfficientNet_B0_Weights.DEFAULT', 'classifier'),
+}
+
+
+def _load_model(architecture: str):
+    """load a pretrained torchvision model returning its pooled features instead of the class scores"""
+    import torch
+    from torchvision import models
+
+    constructor, weights, head = ARCHITECTURES[architecture]
+    model = getattr(models, constructor)(weights=weights)
+    setattr(model, head, torch.nn.Identity())
+    model.eval()
+    return model
+
+
+def _export(path: Path, export):
+    """export a model file once, written atomically so an interrupted export is not reused"""
+    if path.exists():
+        return
+    os.makedirs(path.parent, exist_ok=True)
+    tmp_path = path.with_suffix(".tmp")
+    log.info(f"Exporting model {path}")
+    export(tmp_path)
+    os.replace(tmp_path, path)
+
+
+def embedding_name(architecture: str, resolution: int, quantize: bool = False) -> str:
+    """identify the embeddings produced by a model, models with the same name produce the same embeddings"""
+    return f"{architecture}-{resolution}x{resolution}" + ("-int8" if quantize else "")
+
+
+def letterbox(image: Image.Image, resolution: int) -> Image.Image:
+    """fit the image in a square of resolution pixels keeping its aspect ratio, the free space is padded"""
+    return ImageOps.pad(image.convert("RGB"), (resolution, resolution), color=PAD_COLOR, centering=(0.5, 0))
+
+
+class EmbeddingBackend(abc.ABC):
+    """
+    Model computing the embeddings of the screenshots.
+
+    Screenshots are letterboxed to a square of resolution pixels, so that any of them can be stacked in the same batch
+    without distorting a long full page capture.
+    """
+
+    def __init__(self, architecture: str, resolution: int, quantize: bool = False):
+        from torchvision import transforms
+
+        self.architecture = architecture
+        self.resolution = resolution
+        self.name = embedding_name(architecture, resolution, quantize)
+        self.transform = transforms.ToTensor()
+
+    def preprocess(self, image: Image.Image):
+        return self.transform(letterbox(image, self.resolution))
+
+    @abc.abstractmethod
+    def embed(self, batch):
+        """embeddings (N, D) of a batch of preprocessed images (N, 3, resolution, resolution)"""
+
+
+class TorchBackend(EmbeddingBackend):
+    """torchvision model run by pytorch, optionally compiled to a frozen torchscript module saved in MODELS_DIR"""
+
+    def __init__(self, architecture: str, resolution: int, script: bool = False):
+        import torch
+        super().__init__(architecture, resolution)
+
+        if script:
+            path = MODELS_DIR / f"{self.name}.pt"
+            example = torch.zeros(1, 3, resolution, resolution)
+            _export(path, lambda tmp_path: torch.jit.save(torch.jit.freeze(torch.jit.trace(_load_model(architecture), example)), str(tmp_path)))
+            self.model = torch.jit.optimize_for_inference(torch.jit.load(str(path)))
+        else:
+            self.model = _load_model(architecture)
+
+    def embed(self, batch):
+        import torch
+        with torch.no_grad():
+            return self.model(batch).flatten(1)
+
+
+class OnnxBackend(EmbeddingBackend):
+    """torchvision model exported to onnx and run by onnxruntime, optionally with dynamic int8 quantization"""
+
+    def __init__(self, architecture: str, resolution: int, quantize: bool = False):
+        import torch
+        try:
+            import onnxruntime
+        except ImportError as e:
+            raise ServiceFailure("The onnx runtime requires the onnx extra, install it with: pip install 'typosniffer[onnx]'") from e
+
+        super().__init__(architecture, resolution, quantize)
+
+        path = MODELS_DIR / f"{embedding_name(architecture, resolution)}.onnx"
+        example = torch.zeros(1, 3, resolution, resolution)
+        _export(path, lambda tmp_path: torch.onnx.export(
+            _load_model(architecture),
+            example,
+            str(tmp_path),
+            input_names=['input'],
+            output_names=['embedding'],
+            dynamic_axes={'input': {0: 'batch'}, 'embedding': {0: 'batch'}},
+            dynamo=False,
+        ))
+
+        if quantize:
+            from onnxruntime.quantization import QuantType, quantize_dynamic
+            quantized_path = MODELS_DIR / f"{self.name}.onnx"
+            _export(quantized_path, lambda tmp_path: quantize_dynamic(str(path), str(tmp_path), weight_type=QuantType.QInt8))
+            path = quantized_path
+
+        self.session = onnxruntime.InferenceSession(str(path), providers=['CPUExecutionProvider'])
+
+    def embed(self, batch):
+        import torch
+        output = self.session.run(None, {'input': batch.numpy()})[0]
+        return torch.from_numpy(output).flatten(1)
+
+
+def create_backend(settings: CnnSettings) -> EmbeddingBackend:
+    log.info(f"Loading {settings.runtime} model {settings.architecture}, resolution {settings.resolution}, quantized: {settings.quantize}")
+    if settings.runtime == 'onnx':
+        return OnnxBackend(settings.architecture, settings.resolution, settings.quantize)
+    return TorchBackend(settings.architecture, settings.resolution, script=settings.runtime == 'torchscript')
+
+
+def image_key(image: Image.Image) -> str:
+    """digest of the image pixels, used as embedding cache key"""
+    digest = hashlib.sha256(f"{image.mode}:{image.size}".encode())
+    digest.update(image.tobytes())
+    return digest.hexdigest()
+
+
+class EmbeddingCache:
+    """
+    Embeddings by image key, the most recently used are kept in memory and all of them are saved on disk as .npy files
+    so they are reused across runs
+    """
+
+    def __init__(self, folder: Path, max_entries: int = MAX_CACHED_EMBEDDINGS, max_memory_entries: int = MAX_MEMORY_EMBEDDINGS):
+        self.folder = folder
+        self.max_entries = max_entries
+        self.max_memory_entries = max_memory_entries
+        self.memory: OrderedDict[str, numpy.ndarray] = OrderedDict()
+        self.lock = threading.Lock()
+        os.makedirs(folder, exist_ok=True)
+
+    def _path(self, key: str) -> Path:
+        return self.folder / f"{key}.npy"
+
+    def _remember(self, key: str, embedding: numpy.ndarray):
+        with self.lock:
+            self.memory[key] = embedding
+            self.memory.move_to_end(key)
+            while len(self.memory) > self.max_memory_entries:
+                self.memory.popitem(last=False)
+
+    def get(self, key: str) -> Optional[numpy.ndarray]:
+        with self.lock:
+            embedding = self.memory.get(key)
+            if embedding is not None:
+                self.memory.move_to_end(key)
+                return embedding
+
+        path = self._path(key)
+        try:
+            embedding = numpy.load(path)
+            #mark the embedding as recently used
+            path.touch()
+        except (OSError, ValueError):
+            return None
+
+        self._remember(key, embedding)
+        return embedding
+
+    def put(self, key: str, embedding: numpy.ndarray):
+        self._remember(key, embedding)
+
+        path = self._path(key)
+        tmp_path = path.with_suffix(".tmp")
+        try:
+            with open(tmp_path, "wb") as f:
+                numpy.save(f, embedding)
+            os.replace(tmp_path, path)
+        except OSError:
+            log.warning(f"Failed to save embedding {path}", exc_info=True)
+
+    def prune(self):
+        """remove the least recently used embeddings beyond max_entries"""
+        files = sorted(self.folder.glob("*.npy"), key=lambda path: path.stat().st_mtime, reverse=True)
+        for path in files[self.max_entries:]:
+            path.unlink(missing_ok=True)
+
+
+def cosine_similarity(embedding1: numpy.ndarray, embedding2: numpy.ndarray) -> float:
+    embedding1 = embedding1.ravel()
+    embedding2 = embedding2.ravel()
+    norm = max(float(numpy.linalg.norm(embedding1) * numpy.linalg.norm(embedding2)), 1e-8)
+    return float(numpy.dot(embedding1, embedding2)) / norm
+
+
 class ImageComparator:
-    def __init__(self):
+    """
+    Compare images using the embeddings of a pretrained model, see inspection.cnn to choose it.
+
+    Embeddings are cached by image digest, in memory and on disk, so the screenshot of an original domain is
+    embedded once and reused for all of its suspicious domains, across runs too. Images to embed are queued to a
+    single inference thread that groups them in batches, one forward pass for each batch.
+
+    The model is loaded, and the inference thread started, only when an embedding is not found in the cache.
+    """
+
+    def __init__(self, settings: Optional[CnnSettings] = None, backend: Optional[EmbeddingBackend] = None, cache_dir: Optional[Path] = EMBEDDING_CACHE_DIR, batch_size: int = BATCH_SIZE, batch_delay: float = BATCH_DELAY):
+
+        self.settings = settings or get_config().inspection.cnn
+        self.backend = backend
+        name = backend.name if backend is not None else embedding_name(self.settings.architecture, self.settings.resolution, self.settings.quantize)
+        self.cache = EmbeddingCache(cache_dir / name) if cache_dir is not None else None
+        self.batch_size = batch_size
+        self.batch_delay = batch_delay
+
+        #embeddings being computed by image key, concurrent requests of the same image share the result
+        self.pending: dict[str, Future] = {}
+        self.lock = threading.Lock()
+        self.load_lock = threading.Lock()
+        self.requests: queue.Queue = queue.Queue()
+        self.thread: Optional[threading.Thread] = None
+
+    def _load(self):
+        """load the model and start the inference thread on first use"""
+        with self.load_lock:
+            if self.backend is None:
+                start = time.perf_counter()
+                self.backend = create_backend(self.settings)
+                log.info(f"Loaded model {self.backend.name} in {time.perf_counter() - start:.2f}s")
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run, name="cnn-inference", daemon=True)
+                self.thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        """stop the inference thread and prune the embedding cache"""
+        with self.load_lock:
+            if self.thread is not None:
+                self.requests.put(None)
+                self.thread.join()
+                self.thread = None
+        self.prune_cache()
+
+    def prune_cache(self):
+        if self.cache is not None:
+            self.cache.prune()
+
+    def _run(self):
+        while True:
+            request = self.requests.get()
+            if request is None:
+                return
+            batch = [request]
+            deadline = time.monotonic() + self.batch_delay
+            while len(batch) < self.batch_size:
+                try:
+                    request = self.requests.get(timeout=max(0, deadline - time.monotonic()))
+                except queue.Empty:
+                    break
+                if request is None:
+                    self._infer(batch)
+                    return
+                batch.append(request)
+            self._infer(batch)
+
+    def _infer(self, batch: list[tuple]):
         import torch
-        from torchvision import models, transforms
-    
 
-        # Load pretrained model
-        model = models.resnet50(weights='ResNet50_Weights.DEFAULT')
-        model.share_memory()
-        model.eval()
-        
-        self.feature_extractor = torch.nn.Sequential(*list(model.children())[:-1])
+        try:
+            features = self.backend.embed(torch.stack([tensor for tensor, _ in batch]))
+            log.debug(f"Embedded {len(batch)} images in a single batch")
+            for (_, future), embedding in zip(batch, features):
+                future.set_result(embedding.unsqueeze(0).numpy())
+        except Exception as e:
+            for _, future in batch:
+                future.set_exception(e)
+
+    def _done(self, key: str, future: Future):
+        if self.cache is not None and future.exception() is None:
+            self.cache.put(key, future.result())
+        with self.lock:
+            self.pending.pop(key, None)
+
+    def submit(self, image: Image.Image) -> Future:
+        """queue an image to embed, returns a future of its embedding, a cached embedding needs no model"""
+        key = image_key(image)
 
-        # Preprocessing
-        self.preprocess = transforms.Compose([
-            transforms.Resize(256),
-            transforms.ToTensor()
-        ])
-        torch.set_num_threads(1)
-        torch.set_num_interop_threads(1)
+        if self.cache is not None:
+            embedding = self.cache.get(key)
+            if embedding is not None:
+                future = Future()
+                future.set_result(embedding)
+                return future
 
+        with self.lock:
+            future = self.pending.get(key)
+            if future is not None:
+                return future
+            future = Future()
+            self.pending[key] = future
+
+        future.add_done_callback(lambda f: self._done(key, f))
+        try:
+            self._load()
+            self.requests.put((self.backend.preprocess(image), future))
+        except Exception as e:
+            future.set_exception(e)
+        return future
 
     def get_embedding(self, image):
-        import torch
-        image = image.convert("RGB")
-        img_tensor = self.preprocess(image).unsqueeze(0)
-        with torch.no_grad():
-            features = self.feature_extractor(img_tensor)
-            return features.flatten(1)
+        return self.submit(image).result()
 
     def get_similarity(self, image1, image2):
-        import torch.nn.functional as F
-        emb1 = self.get_embedding(image1)
-        emb2 = self.get_embedding(image2)
-        return F.cosine_similarity(emb1, emb2)[0].item()
+        #both images are queued before waiting, so they can share a batch
+        future1 = self.submit(image1)
+        future2 = self.submit(image2)
+        return cosine_similarity(future1.result(), future2.result())
+
+
+
+_shared_comparator: Optional[ImageComparator] = None
+_shared_lock = threading.Lock()
+
+
+def get_image_comparator() -> ImageComparator:
+    """
+    Comparator shared by the whole process, its model is loaded the first time a comparison needs it and then
+    stays resident, e.g. across the scheduled runs of the monitor daemon. It is replaced if the configured model changes.
+    """
+    global _shared_comparator
+
+    settings = get_config().inspection.cnn
+    with _shared_lock:
+        if _shared_comparator is None or _shared_comparator.settings != settings:
+            if _shared_comparator is not None:
+                _shared_comparator.close()
+            _shared_comparator = ImageComparator(settings)
+        return _shared_comparator
+
+
+@dataclass(frozen=True)
+class BenchmarkResult:
+    name: str
+    load_seconds: float
+    ms_per_image: float
+    auc: float
+    accuracy: float
+    threshold: float
+
+
+def read_pairs(file: Path) -> list[tuple[Path, Path, bool]]:
+    """
+    Read a labeled set of screenshot pairs from a csv file with columns image1, image2 and label,
+    label is 1 when the two screenshots show the same website. Relative paths are resolved from the csv folder.
+    """
+    with open(file, newline='', encoding='utf-8') as f:
+        return [
+            (file.parent / row['image1'], file.parent / row['image2'], row['label'].strip() in ('1', 'true', 'True'))
+            for row in csv.DictReader(f)
+        ]
+
+
+def _roc_auc(scores: list[float], labels: list[bool]) -> float:
+    """probability that a positive pair scores higher than a negative one"""
+    positives = [score for score, label in zip(scores, labels) if label]
+    negatives = [score for score, label in zip(scores, labels) if not label]
+    if not positives or not negatives:
+        return float('nan')
+    wins = sum((p > n) + 0.5 * (p == n) for p in positives for n in negatives)
+    return wins / (len(positives) * len(negatives))
+
+
+def _best_threshold(scores: list[float], labels: list[bool]) -> tuple[float, float]:
+    """similarity threshold with the best accuracy, returns the accuracy and the threshold"""
+    best = (0.0, 0.0)
+    for threshold in sorted(set(scores)):
+        accuracy = sum((score >= threshold) == label for score, label in zip(scores, labels)) / len(scores)
+        best = max(best, (accuracy, threshold))
+    return best
+
+
+def benchmark(settings: CnnSettings, pairs: list[tuple[Path, Path, bool]]) -> BenchmarkResult:
+    """
+    Measure a model on a labeled set of screenshot pairs: time to load it, latency of a single embedding,
+    and how well the cosine similarity separates same-website pairs (roc auc and best threshold accuracy).
+    """
+    import torch.nn.functional as F
+
+    start = time.perf_counter()
+    backend = create_backend(settings)
+    load_seconds = time.perf_counter() - start
+
+    images = {path for pair in pairs for path in pair[:2]}
+    embeddings = {}
+    elapsed = 0.0
+    for path in images:
+        tensor = backend.preprocess(Image.open(path))
+        start = time.perf_counter()
+        embeddings[path] = backend.embed(tensor.unsqueeze(0))
+        elapsed += time.perf_counter() - start
+
+    scores = [F.cosine_similarity(embeddings[image1], embeddings[image2])[0].item() for image1, image2, _ in pairs]
+    labels = [label for _, _, label in pairs]
+    accuracy, threshold = _best_threshold(scores, labels)
+
+    return BenchmarkResult(
+        name=backend.name + f" ({settings.runtime})",
+        load_seconds=load_seconds,
+        ms_per_image=elapsed * 1000 / max(1, len(images)),
+        auc=_roc_auc(scores, labels),
+        accuracy=accuracy,
+        threshold=threshold,
+    )
@@ -0,0 +1,48 @@
+import hashlib
+import re
+import numpy
+
+
+# Characters of visible text used to fingerprint a page, the rest is ignored
+MAX_TEXT_LENGTH = 200_000
+
+# Returns the visible text of the page and the tag names of its elements in document order
+DOM_SCRIPT = f"""() => {{
+    const body = document.body;
+    if (!body) return ['', ''];
+    const tags = Array.from(body.getElementsByTagName('*'), element => element.tagName);
+    return [body.innerText.slice(0, {MAX_TEXT_LENGTH}), tags.join(' ')];
+}}"""
+
+WORD_PATTERN = re.compile(r"\w+")
+
+
+def dom_features(text: str, tags: str) -> set[str]:
+    """
+    Distinct words of the visible text and sequences of three consecutive tags, so both the content and the structure
+    count. Repetitions are ignored, otherwise the tags repeated all over a page would outweigh its text.
+    """
+    features = set(WORD_PATTERN.findall(text.lower()))
+    tag_list = tags.split()
+    features.update("<" + "><".join(tag_list[i:i + 3]) + ">" for i in range(max(0, len(tag_list) - 2)))
+    return features
+
+
+def simhash(features: set[str]) -> str:
+    """64 bit SimHash of features as hex, similar feature sets have hashes at a small hamming distance"""
+    if not features:
+        return "0" * 16
+
+    digests = b"".join(hashlib.blake2b(feature.encode(), digest_size=8).digest() for feature in features)
+    bits = numpy.unpackbits(numpy.frombuffer(digests, dtype=numpy.uint8).reshape(-1, 8), axis=1)
+    votes = bits.sum(axis=0, dtype=numpy.int64) * 2 - len(features)
+    return numpy.packbits(votes > 0).tobytes().hex()
+
+
+def dom_fingerprint(text: str, tags: str) -> str:
+    """fingerprint of a page from the output of DOM_SCRIPT"""
+    return simhash(dom_features(text, tags))
+
+
+def fingerprint_distance(fingerprint1: str, fingerprint2: str) -> int:
+    return (int(fingerprint1, 16) ^ int(fingerprint2, 16)).bit_count()
@@ -1,23 +1,244 @@
-from dnstwist import Fuzzer
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from dataclasses import dataclass
+import multiprocessing
+import re
+from typing import Generator, Optional
+import idna
+from dnstwist import Fuzzer, Permutation
 from typosniffer.data.dto import DomainDTO
 from typosniffer.utils import utility
+from typosniffer.utils.logger import log
 
-def fuzz(domain: DomainDTO, tld_dictionary: list[str], word_dictionary: list[str], unicode: bool = False):
+
+# Fuzzers applied to the domain label, in the same order used by dnstwist
+LABEL_FUZZERS = (
+    'addition', 'bitsquatting', 'cyrillic', 'homoglyph', 'hyphenation',
+    'insertion', 'omission', 'plural', 'repetition', 'replacement',
+    'subdomain', 'transposition', 'vowel-swap', 'dictionary',
+)
+
+# One or more punycode labels (the subdomain fuzzer can split a label in two)
+LABEL_REGEX = re.compile(r'^((?!-)[a-z0-9-]{1,63}(?<!-)\.)*(?!-)[a-z0-9-]{1,63}(?<!-)$', re.IGNORECASE)
+TLD_REGEX = re.compile(r'^[a-z0-9-]{2,63}$', re.IGNORECASE)
+MAX_DOMAIN_LENGTH = 253
+
+# Fields written when exporting permutations
+PERMUTATION_FIELDS = ('domain', 'fuzzer')
+
+
+@dataclass(frozen=True)
+class LabelPermutations:
+    """Label permutations of a domain, they are combined lazily with the top level domains"""
+    subdomain: str
+    label: str
+    tld: str
+    # permuted label mapped to the fuzzer that generated it
+    labels: dict[str, str]
+    # (prefix, tld) pairs of the 'various' fuzzer
+    various: list[tuple[str, str]]
+
+    def prefix(self, label: str) -> str:
+        return '.'.join(filter(None, [self.subdomain, label]))
+
+
+class _Deduplicator:
+    """
+    Exact deduplication of the generated domains.
+
+    A prefix combined with the whole tld dictionary is stored once instead of once per tld,
+    so memory stays proportional to the label permutations and not to the generated domains.
+    """
+
+    def __init__(self, tlds: list[str]):
+        self.tlds = tlds
+        self.tld_set = set(tlds)
+        self.crossed: set[str] = set()
+        self.single: set[str] = set()
+
+    def add(self, prefix: str, tld: str) -> Optional[str]:
+        """Return the domain made of prefix and tld if it was never generated before"""
+        domain = f"{prefix}.{tld}"
+        if len(domain) > MAX_DOMAIN_LENGTH or domain in self.single or (tld in self.tld_set and prefix in self.crossed):
+            return None
+        self.single.add(domain)
+        return domain
+
+    def cross(self, prefix: str) -> Generator[str, None, None]:
+        """Yield the prefix combined with every tld of the dictionary not generated before"""
+        if prefix in self.crossed:
+            return
+        self.crossed.add(prefix)
+        for tld in self.tlds:
+            domain = f"{prefix}.{tld}"
+            if len(domain) <= MAX_DOMAIN_LENGTH and domain not in self.single:
+                yield domain
+
+
+def _encode_label(label: str) -> Optional[str]:
+    """Punycode encode a label, returns None if the label is not valid"""
+    try:
+        encoded = idna.encode(label).decode()
+    except Exception:
+        return None
+    return encoded if LABEL_REGEX.match(encoded) else None
+
+
+def permutate_labels(domain: str, word_dictionary: list[str]) -> LabelPermutations:
+    """
+    Generate the label permutations of a domain using the dnstwist fuzzers.
+
+    Every label is encoded and validated here once, combining it with a top level domain
+    afterwards only requires a length check.
+    """
+
+    f = Fuzzer(domain, dictionary=word_dictionary)
+
+    original = _encode_label(f.domain)
+
+    labels: dict[str, str] = {}
+    for name in LABEL_FUZZERS:
+        for label in getattr(f, '_' + name.replace('-', '_'))():
+            encoded = _encode_label(label)
+            # the first fuzzer generating a label wins, like in dnstwist
+            if encoded and encoded != original and encoded not in labels:
+                labels[encoded] = name
+
+    # mirror the 'various' fuzzer of dnstwist, concatenations use the unicode label before encoding
+    various = []
+    if '.' in f.tld:
+        head, last = f.tld.rsplit('.', 1)
+        various.append((f.domain, last))
+        various.append((f.domain + head, last))
+    if '.' not in f.tld:
+        various.append((f.domain + f.tld, f.tld))
+    if f.tld != 'com' and '.' not in f.tld:
+        various.append((f.domain + '-' + f.tld, 'com'))
+        various.append((f.domain + f.tld, 'com'))
+
+    various = [('.'.join(filter(None, [f.subdomain, label])), tld) for label, tld in various]
+
+    if f.subdomain:
+        various.append((f.subdomain + f.domain, f.tld))
+        various.append((f.subdomain.replace('.', '') + f.domain, f.tld))
+        various.append((f.subdomain + '-' + f.domain, f.tld))
+        various.append((f.subdomain.replace('.', '-') + '-' + f.domain, f.tld))
+
+    encoded_various = []
+    for prefix, tld in various:
+        encoded = _encode_label(prefix)
+        if encoded:
+            encoded_various.append((encoded, tld))
+
+    return LabelPermutations(subdomain=f.subdomain, label=original, tld=f.tld, labels=labels, various=encoded_various)
+
+
+def _combine(permutations: LabelPermutations, deduplicator: _Deduplicator, all_tlds: bool) -> Generator[Permutation, None, None]:
+    """Lazily combine the label permutations of a domain with the top level domains"""
+
+    tld = permutations.tld
+    original = permutations.prefix(permutations.label)
+
+    if domain := deduplicator.add(original, tld):
+        yield Permutation(fuzzer='*original', domain=domain)
+
+    for label, fuzzer in permutations.labels.items():
+        if domain := deduplicator.add(permutations.prefix(label), tld):
+            yield Permutation(fuzzer=fuzzer, domain=domain)
+
+    # every label permutation with every tld of the dictionary
+    if all_tlds:
+        for label, fuzzer in permutations.labels.items():
+            for domain in deduplicator.cross(permutations.prefix(label)):
+                yield Permutation(fuzzer=fuzzer, domain=domain)
+
+    for domain in deduplicator.cross(original):
+        yield Permutation(fuzzer='tld-swap', domain=domain)
+
+    for prefix, various_tld in permutations.various:
+        if domain := deduplicator.add(prefix, various_tld):
+            yield Permutation(fuzzer='various', domain=domain)
+
+
+def _valid_tlds(tld_dictionary: list[str]) -> list[str]:
+    return [tld for tld in dict.fromkeys(tld_dictionary) if TLD_REGEX.match(tld)]
+
+
+def generate(
+    domain: str,
+    tld_dictionary: list[str],
+    word_dictionary: list[str],
+    all_tlds: bool = False
+) -> Generator[Permutation, None, None]:
+    """
+    Lazily generate the permutations of a domain.
+
+    Label permutations are kept in memory while the combinations with the top level domains are
+    yielded one at a time, when all_tlds is set every label permutation is combined with every tld.
+    """
+    deduplicator = _Deduplicator(_valid_tlds(tld_dictionary))
+    yield from _combine(permutate_labels(domain, word_dictionary), deduplicator, all_tlds)
+
+
+def _to_unicode(permutation: Permutation) -> Permutation:
+    permutation.domain = permutation.domain.encode("ascii").decode("idna")
+    return permutation
+
+
+def fuzz(domain: DomainDTO, tld_dictionary: list[str], word_dictionary: list[str], unicode: bool = False, all_tlds: bool = False):
 
     tld_dict = tld_dictionary if tld_dictionary else read_tld_dictionary()
 
-    f = Fuzzer(domain.name, tld_dictionary=tld_dict, dictionary=word_dictionary)
-    f.generate()
+    for variant in generate(domain.name, tld_dict, word_dictionary, all_tlds):
+        yield _to_unicode(variant) if unicode else variant
 
-    for variant in f.domains:
-        if unicode:
-            variant.domain = variant.domain.encode("ascii").decode("idna")
-        yield variant
 
-def read_tld_dictionary() -> list[str]:
-    return utility.read_lines(utility.get_resource("tld.txt"))
+def fuzz_many(
+    domains: list[DomainDTO],
+    tld_dictionary: list[str],
+    word_dictionary: list[str],
+    unicode: bool = False,
+    max_workers: int = multiprocessing.cpu_count(),
+    all_tlds: bool = False
+) -> Generator[Permutation, None, None]:
+    """
+    Fuzz multiple domains in parallel using a process pool.
 
+    Workers compute the label permutations of each domain, which are then combined lazily with the
+    top level domains. The permutations of every domain are merged and deduplicated, a domain generated
+    by more than one target is yielded only once. Permutations are yielded as soon as the worker
+    fuzzing a domain completes, so they can be streamed to a file or to the dns stage.
+
+    Parameters:
+    - domains: List of DomainDTO objects to fuzz.
+    - tld_dictionary: List of top-level domains used by the tld-swap fuzzer.
+    - word_dictionary: List of words used by the dictionary fuzzer.
+    - unicode: Yield domains in unicode instead of punycode.
+    - max_workers: Maximum number of worker processes.
+    - all_tlds: Combine every label permutation with every top-level domain.
+    """
+
+    tld_dict = tld_dictionary if tld_dictionary else read_tld_dictionary()
 
+    # Shared between targets, used to remove permutations generated by more than one domain
+    deduplicator = _Deduplicator(_valid_tlds(tld_dict))
 
+    log.info(f"Fuzzing {len(domains)} domains using {max_workers} workers")
 
+    with ProcessPoolExecutor(max_workers=max(1, min(max_workers, len(domains)))) as executor:
 
+        future_to_domain = {
+            executor.submit(permutate_labels, domain.name, word_dictionary): domain
+            for domain in domains
+        }
+
+        for future in as_completed(future_to_domain):
+            domain = future_to_domain[future]
+            permutations = future.result()
+
+            log.debug(f"Fuzzed {domain.name}: {len(permutations.labels)} label permutations")
+
+            for variant in _combine(permutations, deduplicator, all_tlds):
+                yield _to_unicode(variant) if unicode else variant
+
+def read_tld_dictionary() -> list[str]:
+    return utility.read_lines(utility.get_resource("tld.txt"))
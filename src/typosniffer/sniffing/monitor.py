@@ -1,37 +1,66 @@
-from datetime import datetime
+from datetime import datetime, timedelta
 from pathlib import Path
-from typing import Optional
+from typing import Iterable, Optional
 from dataclasses import dataclass
-from typosniffer.config.config import get_config
+from typosniffer.config.config import CaptureProfile, get_config
 from typosniffer.data.database import DB
 from typosniffer.data.dto import SuspiciousDomainDTO
-from typosniffer.data.dto import WebsiteStatus
+from typosniffer.data.dto import WebsiteRecordDTO, WebsiteStatus
 from typosniffer.data.tables import WebsiteRecord
-from typosniffer.service import website_record
-from typosniffer.sniffing import cnn
+from typosniffer.service import suspicious_domain, website_record
+from typosniffer.sniffing import cnn, fingerprint, scheduler
+from typosniffer.sniffing.browser import BrowserPool
+from typosniffer.sniffing.prober import SchemeProber
 from typosniffer.utils import console, request
+from typosniffer.utils.connectivity import connectivity
 from typosniffer.utils import utility
 from typosniffer.utils.logger import log
-from typosniffer.utils.utility import expand_and_create_dir
 from PIL import Image
 import imagehash
 import io
 import asyncio
-from playwright.async_api import Browser as PlayBrowser, BrowserContext, Page, TimeoutError as PageTimeoutError
+import functools
+from concurrent.futures import Executor, ProcessPoolExecutor
+import itertools
+import multiprocessing
+import queue
+import threading
+import time
+from playwright.async_api import BrowserContext, Page, Route, TimeoutError as PageTimeoutError
+from urllib.parse import urlparse
 from playwright.async_api import async_playwright
 
 
 
 @dataclass(frozen=True)
 class ScreenShotInfo:
-	image: Image.Image
+	"""screenshot encoded as stored with its hashes, the image is decoded only when a comparison needs it"""
+	data: bytes
+	blob: str
+	thumbnail: Optional[bytes]
 	url: Optional[str]
+	dhash: str
+	phash: str
+	fingerprint: Optional[str] = None
+
+	@functools.cached_property
+	def image(self) -> Image.Image:
+		image = Image.open(io.BytesIO(self.data))
+		image.load()
+		return image
+
+@dataclass(frozen=True)
+class UnchangedPage:
+	"""page whose DOM fingerprint matches the last record, its screenshot was not taken"""
+	url: str
+	fingerprint: str
 
 @dataclass(frozen=True)
 class UpdateReport:
 	url: str
 	date: datetime
 	status : WebsiteStatus
+	screenshot_blob: Optional[str] = None
 
 @dataclass(frozen=True)
 class PhishingReport:
@@ -46,12 +75,28 @@ class DomainReport:
 
 
 
+@dataclass(frozen=True)
+class DatabaseClock:
+	"""clock of the database read once, the following dates add the time elapsed since then"""
+	start: datetime
+	started: float
+
+	@classmethod
+	def read(cls) -> "DatabaseClock":
+		return cls(suspicious_domain.database_now(), time.monotonic())
+
+	def now(self) -> datetime:
+		return self.start + timedelta(seconds=time.monotonic() - self.started)
+
+
 class DomainScreenshotBucket:
 
-	def __init__(self, browser: PlayBrowser):
+	def __init__(self, pool: BrowserPool, prober: SchemeProber, executor: Executor):
 		self.images = {}
 		self.locks = {}
-		self.browser = browser
+		self.pool = pool
+		self.prober = prober
+		self.executor = executor
 
 	async def _get_lock(self, key):
 		if key not in self.locks:
@@ -63,28 +108,148 @@ class DomainScreenshotBucket:
 		async with lock:
 			image = self.images.get(domain)
 			if image is None:
-				image = await screenshot_page(self.browser, domain)
+				image = await screenshot_page(self.pool, self.prober, self.executor, domain)
 				self.images[domain] = image
 			return image        
 
-def save_screenshot(suspicious_domain: SuspiciousDomainDTO, date: datetime, screenshot: ScreenShotInfo) -> Path:
+# Attempts made to write a batch of inspection results before writing its items one by one
+WRITE_ATTEMPTS = 3
+WRITE_RETRY_SECONDS = 1
 
 
-	image_file_path = website_record.get_screenshot(suspicious_domain=suspicious_domain, date=date)
+@dataclass(frozen=True)
+class PendingRecord:
+	domain: SuspiciousDomainDTO
+	record: WebsiteRecord
+	screenshot: Optional[ScreenShotInfo]
 
-	expand_and_create_dir(image_file_path.parent)
+@dataclass(frozen=True)
+class RecordFingerprint:
+	"""DOM fingerprint of an unchanged website, stored on its last record so the next inspection can skip the screenshot"""
+	record_id: int
+	dom_fingerprint: str
 
-	screenshot.image.save(image_file_path, 'png')
-	
-	return image_file_path 
+@dataclass(frozen=True)
+class ScheduledInspection:
+	domain_id: int
+	last_inspected: datetime
+	next_inspection: datetime
 
 
-def compare_records(last_record: Optional[WebsiteRecord], new_record: WebsiteRecord) -> Optional[WebsiteStatus]:
+class RecordWriter:
+	"""
+	Dedicated thread persisting the inspection results, so the event loop never waits for the database or the disk.
+
+	Records and inspection schedules are collected in batches and written in a single transaction together with
+	the screenshots, a batch is written when it reaches batch_size items or after flush_interval seconds.
+	A batch that keeps failing is written one item at a time, so only the failing items are lost.
+	"""
+
+	def __init__(self, batch_size: int = 100, flush_interval: float = 1.0):
+		self.batch_size = batch_size
+		self.flush_interval = flush_interval
+		self.queue: queue.Queue[Optional[PendingRecord | RecordFingerprint | ScheduledInspection]] = queue.Queue()
+		self.thread = threading.Thread(target=self._run, name="record-writer", daemon=True)
+
+	def __enter__(self):
+		self.thread.start()
+		return self
+
+	def __exit__(self, *args):
+		self.close()
+
+	def submit(self, pending: PendingRecord | RecordFingerprint | ScheduledInspection):
+		self.queue.put(pending)
+
+	def close(self):
+		"""write the pending records and stop the thread"""
+		self.queue.put(None)
+		self.thread.join()
+
+	def _run(self):
+		closed = False
+		while not closed:
+			batch: list[PendingRecord | RecordFingerprint | ScheduledInspection] = []
+			item = self.queue.get()
+			while item is not None:
+				batch.append(item)
+				if len(batch) >= self.batch_size:
+					break
+				try:
+					item = self.queue.get(timeout=self.flush_interval)
+				except queue.Empty:
+					break
+			closed = item is None
+			if batch:
+				self._write(batch)
+
+	def _write(self, batch: list[PendingRecord | RecordFingerprint | ScheduledInspection]):
+		for attempt in range(1, WRITE_ATTEMPTS + 1):
+			try:
+				self._persist(batch)
+				return
+			except Exception as e:
+				log.warning(f"Failed to persist {len(batch)} inspection results (attempt {attempt}/{WRITE_ATTEMPTS}): {e}")
+				if attempt < WRITE_ATTEMPTS:
+					time.sleep(WRITE_RETRY_SECONDS * attempt)
+
+		#isolate the failing items, the others are still written
+		for pending in batch:
+			try:
+				self._persist([pending])
+			except Exception as e:
+				console.print_error(f"Failed to persist {_describe(pending)}: {e}")
+				log.error("Failed to persist inspection result", exc_info=True)
+
+	def _persist(self, batch: list[PendingRecord | RecordFingerprint | ScheduledInspection]):
+		records = [pending for pending in batch if isinstance(pending, PendingRecord)]
+		fingerprints = [(pending.record_id, pending.dom_fingerprint) for pending in batch if isinstance(pending, RecordFingerprint)]
+		schedules = [(pending.domain_id, pending.last_inspected, pending.next_inspection) for pending in batch if isinstance(pending, ScheduledInspection)]
+		for pending in records:
+			if pending.screenshot:
+				save_screenshot(pending.screenshot)
+		with DB.get_session() as session, session.begin():
+			if records:
+				#a copy of each record, the objects of a rolled back attempt keep the state of its session
+				website_record.add_records(session, [_copy_record(pending.record) for pending in records])
+			if fingerprints:
+				website_record.set_dom_fingerprints(session, fingerprints)
+			if schedules:
+				suspicious_domain.schedule_inspections(session, schedules)
+		log.debug(f"Persisted {len(records)} website records and {len(schedules)} inspection schedules")
+
+
+def _describe(pending: PendingRecord | RecordFingerprint | ScheduledInspection) -> str:
+	if isinstance(pending, PendingRecord):
+		return f"the website record of {pending.domain.name}"
+	if isinstance(pending, RecordFingerprint):
+		return f"the DOM fingerprint of record {pending.record_id}"
+	return f"the inspection schedule of suspicious domain {pending.domain_id}"
+
+
+def _copy_record(record: WebsiteRecord) -> WebsiteRecord:
+	return WebsiteRecord(
+		website_url = record.website_url,
+		screenshot_hash = record.screenshot_hash,
+		screenshot_blob = record.screenshot_blob,
+		dom_fingerprint = record.dom_fingerprint,
+		creation_date = record.creation_date,
+		status = record.status,
+		suspicious_domain_id = record.suspicious_domain_id
+	)
+
+
+def save_screenshot(screenshot: ScreenShotInfo) -> Path:
+
+	return website_record.store_screenshot(screenshot.blob, screenshot.data, screenshot.thumbnail)
+
+
+def compare_records(last_record: Optional[WebsiteRecordDTO], new_record: WebsiteRecord) -> Optional[WebsiteStatus]:
 	"""
 	Compares the previous website record with the new one to determine the website's current status.
 
 	Args:
-		last_record (Optional[WebsiteRecord]): The last recorded state of the website.
+		last_record (Optional[WebsiteRecordDTO]): The last recorded state of the website.
 		new_record (WebsiteRecord): The latest recorded state of the website.
 
 	Returns:
@@ -128,32 +293,35 @@ def compare_records(last_record: Optional[WebsiteRecord], new_record: WebsiteRec
 	return status
 
 
-def check_domain_updated(screenshot: Optional[ScreenShotInfo], domain: SuspiciousDomainDTO) -> Optional[UpdateReport]:
+async def check_domain_updated(screenshot: Optional[ScreenShotInfo], domain: SuspiciousDomainDTO, writer: RecordWriter) -> Optional[UpdateReport]:
 	
 
 	now_website_exists = screenshot is not None
-	screenshot_hash = imagehash.dhash(screenshot.image) if now_website_exists else None 
 
-	with DB.get_session() as session, session.begin():
+	#the last record is loaded together with the suspicious domain
+	last_record = domain.last_record
+
+	date = datetime.now()
 
-		last_record = website_record.get_last_record_of_domain(session, domain)
+	new_record = WebsiteRecord(
+		website_url = screenshot.url if now_website_exists else None,
+		screenshot_hash = screenshot.dhash if now_website_exists else None,
+		screenshot_blob = screenshot.blob if now_website_exists else None,
+		dom_fingerprint = screenshot.fingerprint if now_website_exists else None,
+		creation_date = date,
+		suspicious_domain_id = domain.id
+	)
 	
-		date = datetime.now()
+	new_status = compare_records(last_record, new_record)
+	if new_status:
+		new_record.status = new_status
+		#the record and its screenshot are persisted by the writer thread
+		writer.submit(PendingRecord(domain, new_record, screenshot))
+		return UpdateReport(date=date, url=new_record.website_url, status=new_status, screenshot_blob=new_record.screenshot_blob)
 
-		new_record = WebsiteRecord(
-			website_url = screenshot.url if now_website_exists else None,
-			screenshot_hash = str(screenshot_hash) if now_website_exists else None,
-			creation_date = date,
-			suspicious_domain_id = domain.id
-		)
-		
-		new_status = compare_records(last_record, new_record)
-		if new_status:
-			new_record.status = new_status
-			session.add(new_record)
-			if now_website_exists:
-				save_screenshot(domain, date, screenshot)
-			return UpdateReport(date=date, url=new_record.website_url, status=new_status)
+	if now_website_exists and last_record is not None and screenshot.fingerprint is not None and last_record.dom_fingerprint != screenshot.fingerprint:
+		#the website did not change, its current fingerprint lets the next inspections skip the screenshot
+		writer.submit(RecordFingerprint(last_record.id, screenshot.fingerprint))
 
 	return None
 
@@ -164,8 +332,8 @@ def check_domain_phishing(real_screenshot: Optional[ScreenShotInfo], phish_scree
 	if real_screenshot and phish_screenshot:
 	
 		#method that compares sus domain to real domain screenshot 
-		real_hash = imagehash.phash(real_screenshot.image)
-		phish_hash = imagehash.phash(phish_screenshot.image)
+		real_hash = imagehash.hex_to_hash(real_screenshot.phash)
+		phish_hash = imagehash.hex_to_hash(phish_screenshot.phash)
 		hash_similarity = (real_hash - phish_hash) / 64
 		cnn_similarity = image_comparator.get_similarity(real_screenshot.image, phish_screenshot.image)
 
@@ -173,21 +341,30 @@ def check_domain_phishing(real_screenshot: Optional[ScreenShotInfo], phish_scree
 	return None
 
 
-async def scan_domain(browser: PlayBrowser, domain: SuspiciousDomainDTO, screenshot_data: DomainScreenshotBucket, image_comparator: cnn.ImageComparator, semaphore: asyncio.Semaphore) -> DomainReport:
+async def scan_domain(pool: BrowserPool, prober: SchemeProber, executor: Executor, domain: SuspiciousDomainDTO, screenshot_data: DomainScreenshotBucket, image_comparator: cnn.ImageComparator, semaphore: asyncio.Semaphore, writer: RecordWriter, clock: DatabaseClock) -> DomainReport:
 
 	async with semaphore:
-		await asyncio.to_thread(utility.check_internet, throw=True)
+		await connectivity.wait_online_async()
 
 		console.print_info(f'Inspecting {domain.name}')
 
-		phish_screenshot = await screenshot_page(browser, domain.name)
-		update_report = check_domain_updated(phish_screenshot, domain)
+		#the schedule is kept on the database clock shared by all the workers
+		inspection_date = clock.now()
+		phish_screenshot = await screenshot_page(pool, prober, executor, domain.name, domain.last_record)
+		update_report = None
 		phish_report = None
-		if update_report is not None:
-			real_screenshot = await screenshot_data.get(domain.original_domain.name)
-			phish_report = check_domain_phishing(real_screenshot, phish_screenshot, image_comparator)
+		if isinstance(phish_screenshot, UnchangedPage):
+			log.debug(f"DOM of {domain.name} unchanged, screenshot skipped")
+		else:
+			update_report = await check_domain_updated(phish_screenshot, domain, writer)
+			if update_report is not None:
+				real_screenshot = await screenshot_data.get(domain.original_domain.name)
+				phish_report = await asyncio.to_thread(check_domain_phishing, real_screenshot, phish_screenshot, image_comparator)
+
+		#active domains are inspected again soon, stable and dead ones back off
+		next_date = scheduler.next_inspection(domain, update_report is not None, inspection_date, get_config().inspection.schedule)
+		writer.submit(ScheduledInspection(domain.id, inspection_date, next_date))
 
-		
 		return DomainReport(
 			suspicious_domain = domain,
 			update_report = update_report,
@@ -195,61 +372,233 @@ async def scan_domain(browser: PlayBrowser, domain: SuspiciousDomainDTO, screens
 		)
 
 
-def inspect_domains(domains: list[SuspiciousDomainDTO], max_workers: int = 4) -> list[DomainReport]:
+def inspect_domains(domains: Iterable[SuspiciousDomainDTO], max_workers: int = 4) -> list[DomainReport]:
 
 	reports = asyncio.run(new_monitor(domains, max_workers))
 	
 	return reports
 
-async def new_monitor(domains: list[SuspiciousDomainDTO], max_workers: int = 4) -> list[DomainReport]:
+async def new_monitor(domains: Iterable[SuspiciousDomainDTO], max_workers: int = 4) -> list[DomainReport]:
+	"""
+	Inspect the given domains, they are consumed lazily so inspection starts while the next domains are still being fetched.
+	At most max_workers domains are inspected at the same time and a few more are kept ready.
+	"""
+
+	domain_iterator = iter(domains)
+
+	#fetching the next domain may query the database, keep it off the event loop
+	first_domain = await asyncio.to_thread(next, domain_iterator, None)
+	if first_domain is None:
+		return []
+	domain_iterator = itertools.chain([first_domain], domain_iterator)
 
 	semaphore = asyncio.Semaphore(max_workers)
-	image_comparator = cnn.ImageComparator()
+	#the database clock is read once per run, not once per domain
+	clock = await asyncio.to_thread(DatabaseClock.read)
+	#shared by the scheduled runs of the daemon, the model is loaded only once a screenshot changed
+	image_comparator = cnn.get_image_comparator()
 
-	async with async_playwright() as p:
-		browser = await p.chromium.launch(headless=True)
-		bucket = DomainScreenshotBucket(browser)
+	cfg = get_config().inspection
+	profile = cfg.get_capture_profile()
+
+	#decoding, hashing and encoding screenshots is CPU bound, it runs in worker processes while pages keep loading.
+	#Workers are not forked from this process: a fork taken while the inference, writer or connectivity threads
+	#hold a lock would deadlock, they are started by a forkserver (spawn where it is not available)
+	start_method = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+	executor = ProcessPoolExecutor(max_workers=cfg.image_workers, mp_context=multiprocessing.get_context(start_method))
+
+	async with SchemeProber() as prober, async_playwright() as p, BrowserPool(
+		p,
+		browsers=cfg.browsers,
+		pages=max_workers,
+		recycle_after=cfg.browser_recycle_pages,
+		launch_options={'headless': True, 'args': list(request.WEBDRIVER_ARGUMENTS)},
+		context_options={
+			'user_agent': request.USER_AGENT,
+			'viewport': {'width': profile.viewport_width, 'height': profile.viewport_height}
+		},
+		setup_context=functools.partial(setup_capture_context, profile)
+	) as pool:
+		bucket = DomainScreenshotBucket(pool, prober, executor)
 		
-		tasks = [scan_domain(browser, domain, bucket, image_comparator, semaphore) for i, domain in enumerate(domains)]
-		reports = await asyncio.gather(*tasks)
-		await browser.close()
-		return reports
+		with executor, RecordWriter() as writer:
+			tasks = []
+			pending = set()
+			while True:
+				domain = await asyncio.to_thread(next, domain_iterator, None)
+				if domain is None:
+					break
+				task = asyncio.create_task(scan_domain(pool, prober, executor, domain, bucket, image_comparator, semaphore, writer, clock))
+				tasks.append(task)
+				pending.add(task)
+				if len(pending) >= max_workers * 2:
+					_, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+			reports = await asyncio.gather(*tasks)
 
+	await asyncio.to_thread(image_comparator.prune_cache)
+	return list(reports)
 
-async def screenshot_page(browser : PlayBrowser, domain: str) -> Optional[ScreenShotInfo]:
-	
-	#resolve url first
-	url = await asyncio.to_thread(request.resolve_url, domain)
 
-	#respect the maximum number of pages at the same time
-	timeout_ms = get_config().inspection.page_load_timeout * 1000
-	
-	context: BrowserContext = await browser.new_context(user_agent=request.USER_AGENT)
-	page: Page = await context.new_page()
-	try:
-		try:
-			await page.goto(url, timeout=timeout_ms, wait_until='networkidle')
-		except PageTimeoutError:
-			console.print_error(f'Failed to screenshot {domain} page: try with wait')
-			await page.goto(url, timeout=timeout_ms)
-			await page.wait_for_timeout(2000)
-		screenshot_bytes = await page.screenshot(full_page=True)
-		
-		image = await asyncio.to_thread(lambda: Image.open(io.BytesIO(screenshot_bytes)))
-		url = page.url
+def is_blocked_request(profile: CaptureProfile, resource_type: str, url: str) -> bool:
+	"""check if a request is skipped by the capture profile, blocked domains match their subdomains too"""
+
+	if resource_type in profile.blocked_resources:
+		return True
+
+	host = urlparse(url).hostname or ''
+	return any(host == domain or host.endswith('.' + domain) for domain in profile.blocked_domains)
+
 
-		return ScreenShotInfo(image, url)
-	except PageTimeoutError:
-		console.print_error(f'Failed to screenshot {domain} page: timeout failed fallbacks')
+async def setup_capture_context(profile: CaptureProfile, context: BrowserContext):
+	"""install the request interception of the capture profile, nothing is intercepted if the profile blocks nothing"""
+
+	if not profile.blocked_resources and not profile.blocked_domains:
+		return
+
+	async def route_request(route: Route):
+		if is_blocked_request(profile, route.request.resource_type, route.request.url):
+			await route.abort()
+		else:
+			await route.continue_()
+
+	await context.route("**/*", route_request)
+
+
+def decode_screenshot(screenshot_bytes: bytes, max_width: Optional[int]) -> Image.Image:
+	"""decode a screenshot, downscaling it to max_width keeping the aspect ratio"""
+
+	image = Image.open(io.BytesIO(screenshot_bytes))
+	if max_width is not None and image.width > max_width:
+		height = max(1, round(image.height * max_width / image.width))
+		image = image.resize((max_width, height), Image.Resampling.LANCZOS)
+	return image
+
+
+def is_dom_unchanged(last_record: Optional[WebsiteRecordDTO], url: str, dom_fingerprint: str, threshold: int) -> bool:
+	"""check if the page is still the website of the last record: same url and a DOM fingerprint at most threshold bits away"""
+
+	if last_record is None or not last_record.status.is_website_up() or last_record.dom_fingerprint is None:
+		return False
+	return last_record.website_url == url and fingerprint.fingerprint_distance(last_record.dom_fingerprint, dom_fingerprint) <= threshold
+
+
+async def get_dom_fingerprint(page: Page, executor: Executor) -> Optional[str]:
+	"""fingerprint of the loaded page, None if the DOM could not be read"""
+
+	try:
+		text, tags = await page.evaluate(fingerprint.DOM_SCRIPT)
 	except Exception as e:
-		if "ERR_NAME_NOT_RESOLVED" in str(e):
-			console.print_error(f'Failed to screenshot {domain} page: not resolved')
+		log.debug(f"Failed to read the DOM of {page.url}: {e}")
+		return None
+	return await asyncio.get_running_loop().run_in_executor(executor, fingerprint.dom_fingerprint, text, tags)
+
+
+def encode_thumbnail(image: Image.Image, width: int) -> bytes:
+	"""lossy webp of the top of the page, at most 4:3 so long pages stay readable"""
+
+	thumbnail = image.crop((0, 0, image.width, min(image.height, image.width * 3 // 4)))
+	if thumbnail.width > width:
+		thumbnail = thumbnail.resize((width, max(1, round(thumbnail.height * width / thumbnail.width))), Image.Resampling.LANCZOS)
+	buffer = io.BytesIO()
+	thumbnail.save(buffer, 'webp', quality=80)
+	return buffer.getvalue()
+
+
+def process_screenshot(screenshot_bytes: bytes, url: str, max_width: Optional[int], format: str, thumbnail_width: Optional[int], dom_fingerprint: Optional[str] = None) -> ScreenShotInfo:
+	"""
+	Decode a screenshot, compute its hashes and encode it in the store format with its thumbnail.
+	Runs in the image process pool, so only bytes and strings cross the process boundary.
+	"""
+
+	image = decode_screenshot(screenshot_bytes, max_width)
+	blob = f"{cnn.image_key(image)}.{format}"
+	if format == 'png' and image.format == 'PNG':
+		#not downscaled, the png taken by the browser is stored as is
+		data = screenshot_bytes
+	else:
+		buffer = io.BytesIO()
+		if format == 'webp':
+			image.save(buffer, 'webp', lossless=True)
 		else:
-			console.print_error(f'Failed to screenshot {domain} page: {e}')
-			log.error(f"Screenshot error for {domain}", exc_info=True)
-	finally:
-		await context.close()
-	return None
+			image.save(buffer, 'png')
+		data = buffer.getvalue()
+	thumbnail = encode_thumbnail(image, thumbnail_width) if thumbnail_width is not None else None
+	return ScreenShotInfo(data, blob, thumbnail, url, str(imagehash.dhash(image)), str(imagehash.phash(image)), dom_fingerprint)
+
+
+async def capture_page(page: Page, profile: CaptureProfile) -> bytes:
+	"""take the screenshot of a loaded page as described by the capture profile"""
+
+	if not profile.full_page:
+		return await page.screenshot()
+
+	if profile.max_height is not None:
+		width, height = await page.evaluate("() => [document.documentElement.scrollWidth, document.documentElement.scrollHeight]")
+		if height > profile.max_height:
+			clip = {'x': 0, 'y': 0, 'width': min(width, profile.viewport_width), 'height': profile.max_height}
+			return await page.screenshot(full_page=True, clip=clip)
 
+	return await page.screenshot(full_page=True)
 
-	
\ No newline at end of file
+
+async def screenshot_page(pool: BrowserPool, prober: SchemeProber, executor: Executor, domain: str, last_record: Optional[WebsiteRecordDTO] = None) -> Optional[ScreenShotInfo | UnchangedPage]:
+	"""
+	Load the website of a domain and take its screenshot. The DOM is fingerprinted first, if it did not change
+	since last_record the screenshot is skipped and an UnchangedPage is returned.
+	"""
+	
+	#resolve the scheme first, the navigation follows the redirects of the website
+	probe = await prober.probe(domain)
+	if not probe.reachable:
+		console.print_error(f'Failed to screenshot {domain} page: not reachable')
+		return None
+	url = probe.url
+
+	cfg = get_config().inspection
+	profile = cfg.get_capture_profile()
+	timeout_ms = cfg.page_load_timeout * 1000
+
+	#a page borrowed from a crashed browser is retried once on a new one
+	for attempt in range(2):
+		async with pool.lease() as lease:
+			page = lease.page
+			try:
+				try:
+					await page.goto(url, timeout=timeout_ms, wait_until=profile.wait_until)
+				except PageTimeoutError:
+					console.print_error(f'Failed to screenshot {domain} page: try with wait')
+					await page.goto(url, timeout=timeout_ms)
+					await page.wait_for_timeout(2000)
+				url = page.url
+				dom_fingerprint = None
+				if cfg.dom_threshold is not None:
+					dom_fingerprint = await get_dom_fingerprint(page, executor)
+					if dom_fingerprint is not None and is_dom_unchanged(last_record, url, dom_fingerprint, cfg.dom_threshold):
+						return UnchangedPage(url, dom_fingerprint)
+				screenshot_bytes = await capture_page(page, profile)
+			except PageTimeoutError:
+				console.print_error(f'Failed to screenshot {domain} page: timeout failed fallbacks')
+				prober.forget(domain)
+				return None
+			except Exception as e:
+				if not lease.is_alive() and attempt == 0:
+					log.warning(f"Browser crashed while taking a screenshot of {domain}, retrying")
+					continue
+				prober.forget(domain)
+				if "ERR_NAME_NOT_RESOLVED" in str(e):
+					console.print_error(f'Failed to screenshot {domain} page: not resolved')
+				else:
+					console.print_error(f'Failed to screenshot {domain} page: {e}')
+					log.error(f"Screenshot error for {domain}", exc_info=True)
+				return None
+
+		#the page is returned to the pool before the screenshot is processed
+		try:
+			return await asyncio.get_running_loop().run_in_executor(
+				executor, process_screenshot, screenshot_bytes, url, profile.max_width, cfg.screenshot_format, cfg.thumbnail_width, dom_fingerprint
+			)
+		except Exception as e:
+			console.print_error(f'Failed to process {domain} screenshot: {e}')
+			log.error(f"Screenshot processing error for {domain}", exc_info=True)
+			return None
+	return None
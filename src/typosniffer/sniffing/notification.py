@@ -64,7 +64,7 @@ def notify_inspection_suspicious_domains(inspection_date: datetime, suspicious_d
         similarity = report.phishing_report.cnn_similarity if report.phishing_report else -1
 
         if upload_screenshots:
-            screenshot_url = await asyncio.to_thread(imgbb.upload_screenshot, report.suspicious_domain, report.update_report.date, upload_config)
+            screenshot_url = await asyncio.to_thread(imgbb.upload_screenshot, report.suspicious_domain, report.update_report.date, report.update_report.screenshot_blob, upload_config)
             return [name, website_url, status, screenshot_url, f"{similarity:.1f}"]
         return [name, website_url, status, f"{similarity:.1f}"]
 
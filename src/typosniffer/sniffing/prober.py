@@ -0,0 +1,149 @@
+import asyncio
+import datetime
+import json
+import os
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Optional
+import httpx
+import typosniffer
+from typosniffer.utils.connectivity import connectivity
+from typosniffer.utils.logger import log
+from typosniffer.utils.request import USER_AGENT
+
+
+CACHE_FILE = typosniffer.FOLDER / "scheme_cache.json"
+# Days a scheme decision is reused before the domain is probed again
+CACHE_MAX_DAYS = 7
+
+PROBE_TIMEOUT = 3
+# The http probe starts only if https did not answer within this delay, https is preferred
+HTTP_PROBE_DELAY = 0.3
+MAX_CONNECTIONS = 100
+
+SCHEMES = ("https", "http")
+
+
+@dataclass(frozen=True)
+class ProbeResult:
+    """url to load for a domain (scheme://domain), reachable is False if neither https nor http answered"""
+    url: str
+    reachable: bool
+    cached: bool = False
+
+
+class SchemeProber:
+    """
+        Asyncio prober choosing the scheme used to load the website of a domain.
+
+        https and http are raced happy-eyeballs style using a shared pool of connections, the first
+        one that answers wins. The chosen scheme is cached on disk between runs, a cached domain is
+        not probed again until it expires or it is forgotten after a failed page load.
+        Redirects are not followed by the probe, they are followed by the page navigation.
+    """
+
+    def __init__(
+        self,
+        cache_file: Path = CACHE_FILE,
+        cache_days: int = CACHE_MAX_DAYS,
+        timeout: float = PROBE_TIMEOUT,
+        max_connections: int = MAX_CONNECTIONS
+    ):
+        self.cache_file = cache_file
+        self.cache_days = cache_days
+        self.client = httpx.AsyncClient(
+            limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections),
+            headers={"User-Agent": USER_AGENT},
+            #pages with invalid certificates are loaded anyway by the browser
+            verify=False,
+            timeout=timeout,
+        )
+        self.cache = self._load_cache()
+
+    def _load_cache(self) -> dict[str, tuple[str, datetime.datetime]]:
+        cache = {}
+        if not self.cache_file.exists():
+            return cache
+
+        oldest_date = datetime.datetime.now() - datetime.timedelta(days=self.cache_days)
+        try:
+            for domain, (scheme, date) in json.loads(self.cache_file.read_text()).items():
+                date = datetime.datetime.fromisoformat(date)
+                if scheme in SCHEMES and date >= oldest_date:
+                    cache[domain] = (scheme, date)
+        except (ValueError, TypeError):
+            log.warning(f"Invalid scheme cache {self.cache_file}, ignoring it", exc_info=True)
+        return cache
+
+    def _save_cache(self):
+        os.makedirs(self.cache_file.parent, exist_ok=True)
+        tmp_file = self.cache_file.with_suffix(".tmp")
+        tmp_file.write_text(json.dumps({domain: (scheme, date.isoformat()) for domain, (scheme, date) in self.cache.items()}))
+        os.replace(tmp_file, self.cache_file)
+
+    async def _probe(self, scheme: str, domain: str) -> str:
+        """returns the scheme, any http response (redirects included) means the website is reachable"""
+        await self.client.head(f"{scheme}://{domain}")
+        return scheme
+
+    async def _race(self, domain: str) -> Optional[str]:
+
+        https = asyncio.create_task(self._probe("https", domain))
+        try:
+            return await asyncio.wait_for(asyncio.shield(https), HTTP_PROBE_DELAY)
+        except TimeoutError:
+            pending = {https}
+        except Exception as e:
+            log.debug(f"https probe of {domain} failed: {e}")
+            pending = set()
+
+        pending.add(asyncio.create_task(self._probe("http", domain)))
+
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    for other in pending:
+                        other.cancel()
+                    return task.result()
+                log.debug(f"Probe of {domain} failed: {task.exception()}")
+
+        return None
+
+    async def probe(self, domain: str) -> ProbeResult:
+
+        # If user already gave scheme, just return it
+        if domain.startswith(("http://", "https://")):
+            return ProbeResult(domain, True)
+
+        cached = self.cache.get(domain)
+        if cached is not None:
+            return ProbeResult(f"{cached[0]}://{domain}", True, cached=True)
+
+        scheme = await self._race(domain)
+        if scheme is None and not await asyncio.to_thread(connectivity.check):
+            #the connection is down, not the website: probe again once it is back
+            await connectivity.wait_online_async()
+            scheme = await self._race(domain)
+        if scheme is None:
+            return ProbeResult(f"http://{domain}", False)
+
+        self.cache[domain] = (scheme, datetime.datetime.now())
+        return ProbeResult(f"{scheme}://{domain}", True)
+
+    def forget(self, domain: str):
+        """drop the cached scheme of a domain, e.g. after its page failed to load"""
+        self.cache.pop(domain, None)
+
+    async def close(self):
+        await self.client.aclose()
+        try:
+            self._save_cache()
+        except OSError:
+            log.warning(f"Failed to save scheme cache {self.cache_file}", exc_info=True)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        await self.close()
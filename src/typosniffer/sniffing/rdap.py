@@ -0,0 +1,223 @@
+import datetime
+from email.utils import parsedate_to_datetime
+import os
+from typing import Callable, Optional
+from urllib.parse import urlsplit
+import httpx
+import whoisit
+from whoisit.bootstrap import BaseBootstrap
+from whoisit.errors import BootstrapError, QueryError, RateLimitedError, ResourceDoesNotExist, WhoisItError
+from whoisit.utils import recursive_merge, user_agent
+from whoisit.version import version as whoisit_version
+import typosniffer
+from typosniffer.utils.logger import log
+
+
+BOOTSTRAP_FILE = typosniffer.FOLDER / "rdap_bootstrap.json"
+# Days after which the bootstrap snapshot is downloaded again
+BOOTSTRAP_MAX_DAYS = 7
+
+# Keep-alive connections pooled for each rdap server
+MAX_CONNECTIONS_PER_SERVER = 10
+REQUEST_TIMEOUT = 10
+
+# Parse the raw rdap response of a domain
+RdapParser = Callable[[str, dict], dict]
+
+
+class RdapRateLimitedError(RateLimitedError):
+    """Rate limited rdap response, it carries the server and the Retry-After delay if sent"""
+
+    def __init__(self, message: str, server: str, retry_after: Optional[float], response: str = ''):
+        super().__init__(message, status_code=429, response=response)
+        self.server = server
+        self.retry_after = retry_after
+
+
+def _retry_after(value: Optional[str]) -> Optional[float]:
+    """parse a Retry-After header, given in seconds or as an http date"""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        date = parsedate_to_datetime(value)
+        return max(0.0, (date - datetime.datetime.now(datetime.timezone.utc)).total_seconds())
+    except (TypeError, ValueError):
+        return None
+
+
+class ParserBootstrap:
+    """
+        What whoisit.parse reads from the bootstrap data: whether the IANA overrides are enabled, a response without
+        handle is accepted only with overrides, and the name of the RIR of an endpoint url.
+    """
+
+    rir_endpoints = {urlsplit(url).netloc: name for name, url in BaseBootstrap.RIR_RDAP_ENDPOINTS.items()}
+
+    def __init__(self, overrides: bool = True):
+        self.overrides = overrides
+
+    def is_using_overrides(self) -> bool:
+        return self.overrides
+
+    def get_rir_name_by_endpoint_url(self, url: str) -> str:
+        try:
+            return self.rir_endpoints[urlsplit(url).netloc]
+        except KeyError as e:
+            raise BootstrapError(f"Unknown endpoint URL: {url}") from e
+
+
+# Bootstrap given to the parser, updated by load_bootstrap
+_parser_bootstrap = ParserBootstrap()
+
+
+def _save_bootstrap():
+    os.makedirs(typosniffer.FOLDER, exist_ok=True)
+    tmp_file = BOOTSTRAP_FILE.with_suffix(".tmp")
+    tmp_file.write_text(whoisit.save_bootstrap_data())
+    os.replace(tmp_file, BOOTSTRAP_FILE)
+
+
+def load_bootstrap(max_days: int = BOOTSTRAP_MAX_DAYS, overrides: bool = True):
+    """
+        Bootstrap whoisit from the snapshot saved on disk. The IANA bootstrap registry is downloaded
+        only when the snapshot is missing or older than max_days days, if the download fails a stale
+        snapshot is used anyway.
+    """
+
+    _parser_bootstrap.overrides = overrides
+
+    if whoisit.is_bootstrapped() and not whoisit.bootstrap_is_older_than(max_days):
+        return
+
+    whoisit.clear_bootstrapping()
+
+    stale_snapshot = None
+
+    if BOOTSTRAP_FILE.exists():
+        try:
+            whoisit.load_bootstrap_data(BOOTSTRAP_FILE.read_text(), overrides=overrides)
+            if not whoisit.bootstrap_is_older_than(max_days):
+                log.debug(f"Loaded rdap bootstrap snapshot from {BOOTSTRAP_FILE}")
+                return
+            stale_snapshot = whoisit.save_bootstrap_data()
+            whoisit.clear_bootstrapping()
+        except WhoisItError:
+            log.warning(f"Invalid rdap bootstrap snapshot {BOOTSTRAP_FILE}", exc_info=True)
+            whoisit.clear_bootstrapping()
+
+    log.info("Downloading rdap bootstrap data")
+
+    try:
+        whoisit.bootstrap(overrides=overrides)
+    except WhoisItError:
+        if stale_snapshot is None:
+            raise
+        log.warning("Failed to download rdap bootstrap data, using the stale snapshot", exc_info=True)
+        whoisit.clear_bootstrapping()
+        whoisit.load_bootstrap_data(stale_snapshot, overrides=overrides)
+        return
+
+    _save_bootstrap()
+
+
+def parse_domain(domain: str, raw_data: dict) -> dict:
+    """default parser, the dictionary returned by whoisit for a domain"""
+    return whoisit.parse(_parser_bootstrap, 'domain', domain, raw_data)
+
+
+class AsyncRdapClient:
+    """
+        Asyncio rdap client keeping a pool of keep-alive connections for each rdap server.
+
+        Queries are built using the whoisit bootstrap data, so load_bootstrap must be called first.
+        The raw responses are converted using the given parser.
+    """
+
+    def __init__(
+        self,
+        parser: RdapParser = parse_domain,
+        max_connections_per_server: int = MAX_CONNECTIONS_PER_SERVER,
+        allow_insecure_ssl: bool = True,
+        timeout: float = REQUEST_TIMEOUT
+    ):
+        self.parser = parser
+        self.max_connections_per_server = max_connections_per_server
+        self.allow_insecure_ssl = allow_insecure_ssl
+        self.timeout = timeout
+        self.clients: dict[str, httpx.AsyncClient] = {}
+
+    def _client(self, server: str) -> httpx.AsyncClient:
+        client = self.clients.get(server)
+        if client is None:
+            client = httpx.AsyncClient(
+                limits=httpx.Limits(
+                    max_connections=self.max_connections_per_server,
+                    max_keepalive_connections=self.max_connections_per_server
+                ),
+                headers={
+                    "User-Agent": user_agent.format(version=whoisit_version),
+                    "Accept": "application/rdap+json, application/json"
+                },
+                verify=not self.allow_insecure_ssl,
+                timeout=self.timeout,
+                follow_redirects=True,
+            )
+            self.clients[server] = client
+        return client
+
+    async def get(self, url: str) -> dict:
+        """get the raw rdap response of an url"""
+
+        server = urlsplit(url).netloc
+
+        try:
+            response = await self._client(server).get(url)
+        except httpx.HTTPError as e:
+            raise QueryError(f"Failed rdap request to {url}: {e}") from e
+
+        if response.status_code == 429:
+            retry_after = _retry_after(response.headers.get("Retry-After"))
+            log.info(f"Rate limited by {server}, retry after: {retry_after}")
+            raise RdapRateLimitedError(f"rdap request to {url} has been rate limited", server, retry_after, response.text)
+        if response.status_code == 404:
+            raise ResourceDoesNotExist(f"rdap request to {url} returned 404, the resource does not exist", status_code=404, response=response.text)
+        if response.status_code != 200:
+            raise QueryError(f"rdap request to {url} returned status code {response.status_code}", status_code=response.status_code, response=response.text)
+
+        try:
+            return response.json()
+        except ValueError as e:
+            raise QueryError(f"Failed to parse rdap response of {url} as json: {e}", response=response.text) from e
+
+    async def domain(self, domain: str, follow_related: bool = False, raw: bool = False) -> dict:
+        """
+            Query the rdap data of a domain, when follow_related is set the registrar rdap server
+            linked in the response is queried as well and its data merged.
+        """
+
+        _, url, _ = whoisit.build_query(query_type='domain', query_value=domain)
+
+        response = await self.get(url)
+
+        if follow_related:
+            for link in response.get('links', []):
+                if link.get('rel', '') in ('related', 'registration') and link.get('href'):
+                    recursive_merge(response, await self.get(link['href']))
+                    break
+
+        return response if raw else self.parser(domain, response)
+
+    async def close(self):
+        for client in self.clients.values():
+            await client.aclose()
+        self.clients.clear()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        await self.close()
@@ -0,0 +1,28 @@
+import datetime
+from typosniffer.config.config import ScheduleSettings
+from typosniffer.data.dto import SuspiciousDomainDTO
+
+
+def next_inspection(domain: SuspiciousDomainDTO, changed: bool, now: datetime.datetime, settings: ScheduleSettings) -> datetime.datetime:
+    """
+    Date of the next inspection of a domain inspected at now.
+
+    The interval is reset to min_hours when the website changed, when the domain was never inspected and while the
+    domain is newly added, otherwise it doubles the previous one. It is capped by max_up_days if the website is up
+    and by max_down_days if it is not, so long dead and long stable domains are checked rarely but never forgotten.
+    """
+
+    min_interval = datetime.timedelta(hours=settings.min_hours)
+
+    new_domain = domain.added_date is not None and now - domain.added_date < datetime.timedelta(days=settings.new_domain_days)
+
+    if changed or new_domain or domain.last_inspected is None or domain.next_inspection is None:
+        interval = min_interval
+    else:
+        interval = max(min_interval, (domain.next_inspection - domain.last_inspected) * 2)
+
+    #without a change the website is still in the state of the last record
+    website_up = domain.last_record is not None and domain.last_record.status.is_website_up()
+    max_interval = datetime.timedelta(days=settings.max_up_days if website_up else settings.max_down_days)
+
+    return now + min(interval, max_interval)
@@ -1,9 +1,9 @@
-from concurrent.futures import ThreadPoolExecutor, as_completed
-from dataclasses import dataclass
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from dataclasses import dataclass, fields
 from multiprocessing import Process, Queue
 from itertools import cycle
 from pathlib import Path
-from typing import Optional
+from typing import Generator, Optional
 import dns
 from dns import exception
 from dnstwist import Fuzzer
@@ -12,6 +12,8 @@ from typosniffer.data.dto import SniffCriteria
 from typosniffer.sniffing import fuzzer
 from typosniffer.sniffing import tf_idf
 from typosniffer.utils import console
+from typosniffer.utils.connectivity import connectivity
+from typosniffer.utils.exceptions import InternetMissing
 from typosniffer.utils.logger import log
 from dns import resolver
 from rich.progress import Progress, SpinnerColumn, BarColumn, TextColumn
@@ -32,6 +34,15 @@ class SniffResult:
 	levenshtein: Optional[int] = None
 	tf_idf: Optional[float] = None
 
+@dataclass(frozen=True)
+class DnsResult:
+	domain: str
+	ips: list[str]
+
+# Fields written when exporting sniff and dns results
+SNIFF_RESULT_FIELDS = tuple(field.name for field in fields(SniffResult))
+DNS_RESULT_FIELDS = tuple(field.name for field in fields(DnsResult))
+
 @dataclass(frozen=True)
 class SuspiciousDomainWhoIs:
 	name: str
@@ -105,7 +116,8 @@ def compare_domain(original_domain: str, domain: str, criteria: SniffCriteria, s
 
 
 def resolve_domain(domain, nameserver):
-	"""Resolve using a specific DNS server."""
+	"""Resolve using a specific DNS server, waits while the internet connection is down."""
+	connectivity.wait_online()
 	resolver = dns.resolver.Resolver()
 	resolver.nameservers = [nameserver]
 	resolver.lifetime = 4
@@ -113,44 +125,94 @@ def resolve_domain(domain, nameserver):
 	answer = resolver.resolve(domain, "A")
 	return [rdata.to_text() for rdata in answer]
 
-def search_dns(
-	domain: DomainDTO,
+# Times a dns query that timed out while the internet connection was down is retried
+MAX_OFFLINE_RETRIES = 3
+
+class RetryQuery(Exception):
+	"""the dns query timed out because the internet connection is down, it must be retried"""
+
+def _dns_result(future: Future, domain_name: str) -> Optional[DnsResult]:
+	"""Retrieve the result of a dns query, returns None if the domain was not resolved, raises RetryQuery if it timed out while offline"""
+	try:
+		# Get the resolved IPs from the future
+		ips = future.result()
+		if ips:
+			return DnsResult(domain_name, ips)
+	except resolver.NXDOMAIN:
+		pass
+	except exception.Timeout as e:
+		if not connectivity.check():
+			raise RetryQuery() from e
+		console.print_error(f"[bold red]Timeout with dns query: {domain_name}, {e}[/bold red]")
+	except InternetMissing:
+		console.print_error(f"[bold red]Internet connection missing, dns query skipped: {domain_name}[/bold red]")
+	except exception.DNSException as e:
+		console.print_error(f"[bold red]Something went wrong with dns query: {domain_name}, {e}[/bold red]")
+		log.error(f"Dns Query Exception: {domain_name}", exc_info=True)
+	return None
+
+def iter_dns(
+	domains: list[DomainDTO],
 	tld_dictionary: list[str],
 	word_dictionary: list[str],
 	nameservers: list[str],
-	max_workers=30
-):
+	max_workers=30,
+	fuzzing_workers: int = 1,
+	all_tlds: bool = False
+) -> Generator[DnsResult, None, None]:
 	"""
-	Perform DNS resolution for a list of domain permutations generated from a base domain.
+	Perform DNS resolution for a list of domain permutations generated from one or more base domains.
 	
 	Parameters:
-	- domain: DomainDTO object representing the base domain to fuzz.
+	- domains: List of DomainDTO objects representing the base domains to fuzz.
 	- tld_dictionary: List of top-level domains to try (e.g., ['com', 'net']).
 	- word_dictionary: List of words to insert into the domain permutations.
 	- nameservers: List of DNS servers to use for resolution.
 	- max_workers: Maximum number of threads for concurrent DNS resolution.
+	- fuzzing_workers: Maximum number of processes used to fuzz the base domains.
+	- all_tlds: Combine every permutation with every top-level domain.
 
-	Returns:
-	- A dictionary mapping domain names to a list of resolved IP addresses.
+	Yields:
+	- A DnsResult for every permutation that resolved, as soon as it is resolved.
 	"""
 
 	# Rotate through the given nameservers to distribute DNS queries evenly
 	nameserver_cycle = cycle(nameservers)
 
-	# Store successful DNS resolution results
-	results = {}
+	# Limit the queries waiting in the executor, permutations are consumed only when workers are free
+	max_pending = max_workers * 4
 
-	# Generate all domain permutations using the fuzzer
-	permutations = list(fuzzer.fuzz(
-		domain, 
-		tld_dictionary=tld_dictionary, 
-		word_dictionary=word_dictionary
-	))
-	total_tasks = len(permutations)  # total number of DNS queries to perform
+	# Generate the merged domain permutations using the fuzzer, they are streamed
+	# into the resolver while the remaining base domains are still being fuzzed
+	permutations = fuzzer.fuzz_many(
+		domains,
+		tld_dictionary=tld_dictionary,
+		word_dictionary=word_dictionary,
+		max_workers=fuzzing_workers,
+		all_tlds=all_tlds
+	)
 
 	# Use a ThreadPoolExecutor for concurrent DNS queries
 	with ThreadPoolExecutor(max_workers=max_workers) as executor:
-		future_to_domain = {}  # map futures to domain names for later retrieval
+		future_to_domain = {}  # map pending futures to domain names for later retrieval
+		offline_retries = {}  # times each domain was retried after timing out offline
+
+		def collect(future: Future) -> Optional[DnsResult]:
+			nonlocal total_tasks
+			domain_name = future_to_domain.pop(future)
+			try:
+				return _dns_result(future, domain_name)
+			except RetryQuery:
+				retries = offline_retries.get(domain_name, 0)
+				if retries >= MAX_OFFLINE_RETRIES:
+					console.print_error(f"[bold red]Timeout with dns query: {domain_name}, internet connection lost[/bold red]")
+					return None
+				offline_retries[domain_name] = retries + 1
+				#the query waits for the connection to be back before being sent again
+				future_to_domain[executor.submit(resolve_domain, domain_name, next(nameserver_cycle))] = domain_name
+				total_tasks += 1
+				progress.update(task, total=total_tasks)
+				return None
 
 		with Progress(
 			SpinnerColumn(),
@@ -161,31 +223,59 @@ def search_dns(
 			console=console.console
 		) as progress:
 
-			task = progress.add_task("[green]Resolving domains...", total=total_tasks)
+			# the total number of DNS queries grows while permutations are generated
+			task = progress.add_task("[green]Resolving domains...", total=0)
+			total_tasks = 0
 
 			for permutation in permutations:
 				domain_name = permutation.domain
 				future = executor.submit(resolve_domain, domain_name, next(nameserver_cycle))
 				future_to_domain[future] = domain_name 
-				
-			for future in as_completed(future_to_domain):
-				domain_name = future_to_domain[future]
-				try:
-					# Get the resolved IPs from the future
-					ips = future.result()
-					if ips:
-						results[domain_name] = ips 
-				except resolver.NXDOMAIN:
-					pass
-				except exception.Timeout as e:
-					console.print_error(f"[bold red]Timeout with dns query: {domain_name}, {e}[/bold red]")
-				except exception.DNSException as e:
-					console.print_error(f"[bold red]Something went wrong with dns query: {domain_name}, {e}[/bold red]")
-					log.error(f"Dns Query Exception: {domain_name}", exc_info=True)
-				finally:
+				total_tasks += 1
+				progress.update(task, total=total_tasks)
+
+				if len(future_to_domain) >= max_pending:
+					done, _ = wait(future_to_domain, return_when=FIRST_COMPLETED)
+					for future in done:
+						result = collect(future)
+						progress.update(task, advance=1)
+						if result:
+							yield result
+
+			#retried queries are added while the last ones are collected
+			while future_to_domain:
+				done, _ = wait(future_to_domain, return_when=FIRST_COMPLETED)
+				for future in done:
+					result = collect(future)
 					progress.update(task, advance=1)
-				
-	return results
+					if result:
+						yield result
+
+def search_dns(
+	domains: list[DomainDTO],
+	tld_dictionary: list[str],
+	word_dictionary: list[str],
+	nameservers: list[str],
+	max_workers=30,
+	fuzzing_workers: int = 1,
+	all_tlds: bool = False
+) -> dict[str, list[str]]:
+	"""
+	Same as iter_dns but collects the results.
+
+	Returns:
+	- A dictionary mapping domain names to a list of resolved IP addresses.
+	"""
+	results = iter_dns(
+		domains,
+		tld_dictionary=tld_dictionary,
+		word_dictionary=word_dictionary,
+		nameservers=nameservers,
+		max_workers=max_workers,
+		fuzzing_workers=fuzzing_workers,
+		all_tlds=all_tlds
+	)
+	return {result.domain: result.ips for result in results}
 
 
 def _scan_domains(
@@ -6,6 +6,7 @@ from pathlib import Path
 import typosniffer
 from typosniffer.data.dto import DomainDTO
 from typosniffer.utils import request
+from typosniffer.utils.connectivity import connectivity
 from typosniffer.utils.logger import log
 from typosniffer.utils.console import console
 from typosniffer.sniffing import sniffer
@@ -47,6 +48,7 @@ def _get_whoisds_zip(file: WhoIsDsFile) -> bool:
 
     log.info(f"Downloading domain file {url}")
 
+    connectivity.wait_online()
     response = request.get(url)
 
     zip_file = ZipFile(BytesIO(response.content))
@@ -134,6 +136,7 @@ def update_domains(update_days : int = 10, max_workers: int = 10) -> list[WhoIsD
                     if updated:
                         total_updated.append(file)
                 except Exception as e:
+                    connectivity.report_failure()
                     log.error(f"Failed to retrieve file {file.path}", exc_info=True)
                     console.print(f"[bold red]Failed to retrieve domain file: {date}, {e}[/bold red]") 
                 finally:
@@ -1,30 +1,128 @@
-from collections import defaultdict
-from concurrent.futures import ThreadPoolExecutor, as_completed
+import asyncio
+from collections import defaultdict, deque
 import datetime
+import threading
+from typing import Optional
+from urllib.parse import urlsplit
 import whois
 import whoisit
-from whoisit.errors import RateLimitedError, UnsupportedError, ResourceDoesNotExist
+from whoisit.errors import RateLimitedError, UnsupportedError, ResourceDoesNotExist, WhoisItError
+from typosniffer.data.dto import EntityType
+from typosniffer.service import whois_cache
+from typosniffer.sniffing import rdap
 from typosniffer.utils import console
+from typosniffer.utils.connectivity import connectivity
 from typosniffer.utils.logger import log
 import tldextract
 import time
 
-def _collect_whois_domains(domains, requests_per_minute: int):
-        """
-            given a list of domains get the first "requests_per_minute" domains for each tld
-        """
-        queries_per_tld = defaultdict(list)
 
-        remaining_domains = []
+# Backoff applied to a rate limited bucket when the server does not send a Retry-After header
+BACKOFF_BASE_SECONDS = 5
+BACKOFF_MAX_SECONDS = 300
+# Number of times a rate limited domain is retried before giving up
+MAX_RATE_LIMITED_RETRIES = 5
 
-        for domain in domains:
-            tld = tldextract.extract(domain).suffix
-            if len(queries_per_tld[tld]) < requests_per_minute:
-                queries_per_tld[tld].append(domain)
-            else:
-                remaining_domains.append(domain)  # keep domains that couldn't be added
+# Fields of the normalized whois data, the same consumed when persisting a suspicious domain
+WHOIS_FIELDS = (
+    'nameservers', 'url', 'dnssec', 'whois_server', 'last_changed_date',
+    'registration_date', 'expiration_date', 'status', 'entities',
+)
+# whois fallback fields renamed to their rdap equivalent
+WHOIS_FIELD_ALIASES = {'creation_date': 'registration_date', 'updated_date': 'last_changed_date'}
 
-        return dict(queries_per_tld), remaining_domains
+
+class TokenBucket:
+    """
+        Token bucket refilled continuously at 'requests_per_minute' tokens per minute,
+        holding at most 'requests_per_minute' tokens so a full minute can be used in a single burst.
+    """
+
+    def __init__(self, requests_per_minute: int):
+        self.rate = requests_per_minute / 60
+        self.capacity = requests_per_minute
+        self.tokens = float(requests_per_minute)
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+        self.failures = 0
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self, now: float) -> float:
+        """seconds to wait before a token is available"""
+        self._refill(now)
+        if now < self.blocked_until:
+            return self.blocked_until - now
+        if self.tokens >= 1:
+            return 0
+        return (1 - self.tokens) / self.rate
+
+    def take(self):
+        self.tokens -= 1
+
+    def backoff(self, now: float, seconds: Optional[float] = None):
+        """block the bucket for 'seconds' or using an exponential backoff if not given"""
+        self.failures += 1
+        if seconds is None:
+            seconds = min(BACKOFF_MAX_SECONDS, BACKOFF_BASE_SECONDS * 2 ** (self.failures - 1))
+        self.tokens = 0
+        self.blocked_until = max(self.blocked_until, now + seconds)
+
+    def success(self):
+        self.failures = 0
+
+
+class RateLimiter:
+    """
+        Thread safe collection of token buckets: a request acquires a token from each of its keys,
+        for example its top level domain and the rdap/whois server that answers it.
+    """
+
+    def __init__(self, requests_per_minute: dict[str, int]):
+        """requests_per_minute maps a key prefix (e.g. 'tld') to the rate of its buckets"""
+        self.requests_per_minute = requests_per_minute
+        self.buckets: dict[str, TokenBucket] = {}
+        self.lock = threading.Lock()
+
+    def _bucket(self, key: str) -> TokenBucket:
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            bucket = TokenBucket(self.requests_per_minute[key.split(':', 1)[0]])
+            self.buckets[key] = bucket
+        return bucket
+
+    def acquire(self, keys: tuple[str, ...]) -> float:
+        """take a token from every bucket and return 0, otherwise return the seconds to wait without taking any"""
+        with self.lock:
+            now = time.monotonic()
+            buckets = [self._bucket(key) for key in keys]
+            delay = max(bucket.delay(now) for bucket in buckets)
+            if delay == 0:
+                for bucket in buckets:
+                    bucket.take()
+            return delay
+
+    def backoff(self, key: str, seconds: Optional[float] = None):
+        with self.lock:
+            self._bucket(key).backoff(time.monotonic(), seconds)
+
+    def success(self, keys: tuple[str, ...]):
+        with self.lock:
+            for key in keys:
+                self._bucket(key).success()
+
+
+def _rate_limit_keys(domain: str, tld: str) -> tuple[str, ...]:
+    """keys of the buckets used by a domain: its top level domain and the server answering it"""
+    try:
+        _, url, _ = whoisit.build_query(query_type='domain', query_value=domain)
+        server = urlsplit(url).netloc
+    except WhoisItError:
+        # no rdap server, whois is used instead
+        server = f"whois.{tld}"
+    return (f"tld:{tld}", f"server:{server}")
 
 def _whois(domain: str):
         
@@ -65,83 +163,176 @@ def _whois(domain: str):
         "dnssec": dnssec,
     }
 
-def get_whois(domain: str):
+async def get_whois(domain: str, client: rdap.AsyncRdapClient) -> dict:
 
     log.debug(f"Retrive whois data of {domain} domain")
 
     try:
-        try:
-            log.debug(f"use rdap protocol on {domain} with follow related disabled")
-            return whoisit.domain(domain, allow_insecure_ssl=True, follow_related=False)
-        except RateLimitedError:
-            log.debug(f"use rdap protocol on {domain} with follow related enabled")
-            return whoisit.domain(domain, allow_insecure_ssl=True, follow_related=True)
+        log.debug(f"use rdap protocol on {domain} with follow related disabled")
+        return await client.domain(domain, follow_related=False)
     except (UnsupportedError, ResourceDoesNotExist):
         log.debug(f"Fallback to whois domain {domain}")
-        return _whois(domain)
-        
+        return await asyncio.to_thread(_whois, domain)
 
-def find_whois(domains: list[str], requests_per_minute: int, max_workers: int):
 
-    log.info(f"Finding whois/rdap data: request per minute {requests_per_minute} and max workers: {max_workers}")
+def parse_rdap(domain: str, raw_data: dict) -> dict:
+    """rdap parser returning the normalized whois data"""
+    return normalize_whois(rdap.parse_domain(domain, raw_data))
 
-    whoisit.bootstrap(overrides=True)
 
-    #domains that need to be processed this list will reduce over time    
-    domains_to_process = list(domains)
+def normalize_whois(data: dict) -> dict:
+    """
+        Normalize rdap and whois data to the same shape, keeping only the fields that are persisted
+        and the entities whose role is a known EntityType.
+    """
 
-    results = {}
-    
-    #keep processing until we got a result for each domain
-    while (len(domains_to_process) > 0):
+    data = {WHOIS_FIELD_ALIASES.get(key, key): value for key, value in data.items()}
 
-        #collect the first requests_per_minute domains for each tld
-        queries, domains_to_process = _collect_whois_domains(domains_to_process, requests_per_minute)
-        
-        future_to_query = {}
+    normalized = {field: data.get(field) for field in WHOIS_FIELDS}
 
-        processed = 0
+    normalized['entities'] = {
+        role: entities
+        for role, entities in (data.get('entities') or {}).items()
+        if entities and role.upper() in EntityType.__members__
+    }
 
-        #process first 10 queries for each tld
-        with ThreadPoolExecutor(max_workers=max_workers) as executor:
-            
-            for domains_per_tdl in queries.values():
-                for domain in domains_per_tdl:
-                    future_to_query[executor.submit(get_whois, domain)] = domain
+    return normalized
 
-            for future in as_completed(future_to_query):
-                try:
-                    domain = future_to_query[future]
-                    whois_result = future.result()
-                    results[domain] = whois_result
-                    processed += 1
-                except RateLimitedError as e:
-                    console.print_error(f"Failed to whois domain: {domain}, {e} retrying in the next batch")
-                    domains_to_process.append(domain)
-                    log.error("Rate limited whois query", exc_info=True)
-                except Exception as e:
-                    console.print_error(f"Failed query to whois domain: {domain} retry later, {e}")
-                    log.error("Failed query to whois query", exc_info=True)
 
-        
-        console.print_info(f"retrieved {processed} whois data")
-        #wait for one minute if there are still domains to be processed
-        if len(domains_to_process) > 0:
-            log.info(f"Waiting 60 seconds for next batch")
-            with console.status("Waiting for next batch of whoip"):
-                time.sleep(60)
-        
-        log.info(f"whois complete")
-        
-    return results
+def find_whois(
+    domains: list[str],
+    requests_per_minute: int,
+    max_workers: int,
+    server_requests_per_minute: Optional[int] = None,
+    cache_days: int = 0,
+    bootstrap_days: int = rdap.BOOTSTRAP_MAX_DAYS
+):
+    """
+        Retrieve the normalized whois/rdap data of the given domains.
 
-        
+        When cache_days is set, domains whose data was retrieved in the last cache_days days are read from the
+        whois cache and only new or stale domains are queried, the retrieved data is then stored in the cache.
+    """
 
+    cached = whois_cache.get_fresh_whois(domains, cache_days) if cache_days > 0 else {}
 
+    to_query = [domain for domain in dict.fromkeys(domains) if domain not in cached]
 
+    log.info(f"Whois data of {len(cached)} domains found in cache, {len(to_query)} domains to query")
 
-        
-    
+    results = {domain: normalize_whois(data) for domain, data in _query_whois(to_query, requests_per_minute, max_workers, server_requests_per_minute, bootstrap_days).items()}
+
+    if cache_days > 0 and results:
+        whois_cache.save_whois(results)
+
+    console.print_info(f"retrieved {len(results)} whois data, {len(cached)} from cache")
+
+    return cached | results
+
+
+def _query_whois(
+    domains: list[str],
+    requests_per_minute: int,
+    max_workers: int,
+    server_requests_per_minute: Optional[int] = None,
+    bootstrap_days: int = rdap.BOOTSTRAP_MAX_DAYS
+):
+    """
+        Query the whois/rdap data of the given domains.
+
+        Requests are scheduled continuously using a token bucket per top level domain and one per rdap/whois server,
+        a domain is dispatched as soon as both buckets have a token. Rate limited responses block the buckets
+        for the time given in the Retry-After header or using an exponential backoff, and the domain is retried.
+    """
+
+    if not domains:
+        return {}
+
+    server_requests_per_minute = server_requests_per_minute or requests_per_minute
+
+    log.info(f"Finding whois/rdap data: request per minute {requests_per_minute}, per server {server_requests_per_minute} and max workers: {max_workers}")
+
+    rdap.load_bootstrap(bootstrap_days)
+
+    return asyncio.run(_query_whois_async(domains, requests_per_minute, max_workers, server_requests_per_minute))
+
+
+async def _query_whois_async(domains: list[str], requests_per_minute: int, max_workers: int, server_requests_per_minute: int):
+
+    limiter = RateLimiter({"tld": requests_per_minute, "server": server_requests_per_minute})
+
+    #domains waiting to be dispatched grouped by tld, domains of the same tld share the same buckets
+    pending_per_tld: dict[str, deque[str]] = defaultdict(deque)
+    for domain in domains:
+        pending_per_tld[tldextract.extract(domain).suffix].append(domain)
 
+    keys_per_tld = {tld: _rate_limit_keys(queue[0], tld) for tld, queue in pending_per_tld.items()}
 
+    rate_limited = defaultdict(int)
+    results = {}
+
+    async with rdap.AsyncRdapClient(parser=parse_rdap, max_connections_per_server=max_workers) as client:
+
+        task_to_query: dict[asyncio.Task, tuple[str, str]] = {}
+
+        #keep processing until we got a result for each domain
+        while pending_per_tld or task_to_query:
+
+            #pause dispatching while the internet connection is down
+            await connectivity.wait_online_async()
+
+            #dispatch every domain whose buckets have a token, otherwise compute how long to wait
+            wait_time = None
+            for tld in list(pending_per_tld):
+                queue = pending_per_tld[tld]
+                keys = keys_per_tld[tld]
+                while queue and len(task_to_query) < max_workers:
+                    delay = limiter.acquire(keys)
+                    if delay > 0:
+                        wait_time = delay if wait_time is None else min(wait_time, delay)
+                        break
+                    domain = queue.popleft()
+                    task_to_query[asyncio.create_task(get_whois(domain, client))] = (domain, tld)
+                if not queue:
+                    del pending_per_tld[tld]
+
+            if not task_to_query:
+                log.debug(f"Waiting {wait_time:.1f} seconds for the next whois token")
+                await asyncio.sleep(wait_time)
+                continue
+
+            #wait for a query to complete or for the next token to be available
+            done, _ = await asyncio.wait(task_to_query, timeout=wait_time, return_when=asyncio.FIRST_COMPLETED)
 
+            for task in done:
+                domain, tld = task_to_query.pop(task)
+                keys = keys_per_tld[tld]
+                try:
+                    results[domain] = task.result()
+                    limiter.success(keys)
+                except RateLimitedError as e:
+                    rate_limited[domain] += 1
+                    #without a Retry-After header both buckets use the exponential backoff
+                    retry_after = None
+                    if isinstance(e, rdap.RdapRateLimitedError):
+                        retry_after = e.retry_after
+                        limiter.backoff(f"server:{e.server}", retry_after)
+                    limiter.backoff(keys[0], retry_after)
+                    if rate_limited[domain] > MAX_RATE_LIMITED_RETRIES:
+                        console.print_error(f"Failed to whois domain: {domain}, {e} too many retries")
+                        log.error("Rate limited whois query", exc_info=True)
+                    else:
+                        log.info(f"Rate limited whois query {domain}, retrying later")
+                        pending_per_tld[tld].append(domain)
+                except Exception as e:
+                    #probe now, the cached state may not know about the outage yet
+                    if not await asyncio.to_thread(connectivity.check):
+                        log.info(f"Whois query {domain} failed while offline, retrying later")
+                        pending_per_tld[tld].append(domain)
+                        continue
+                    console.print_error(f"Failed query to whois domain: {domain} retry later, {e}")
+                    log.error("Failed query to whois query", exc_info=True)
+
+    log.info(f"whois complete")
+
+    return results
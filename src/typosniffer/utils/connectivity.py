@@ -0,0 +1,129 @@
+import asyncio
+import socket
+import threading
+import time
+from typing import Optional
+from typosniffer.utils import console
+from typosniffer.utils.exceptions import InternetMissing
+from typosniffer.utils.logger import log
+
+
+# Servers probed to check the internet connection, any of them answering is enough
+PROBE_TARGETS = (("1.1.1.1", 53), ("8.8.8.8", 53))
+PROBE_TIMEOUT = 3
+
+# Seconds between background probes while online and while offline
+ONLINE_INTERVAL = 30
+OFFLINE_INTERVAL = 5
+
+# Seconds work waits for the connection to come back before failing
+MAX_OFFLINE = 600
+
+
+class ConnectivityMonitor:
+    """
+    Process wide circuit breaker on the internet connection.
+
+    The connection state is cached and refreshed by a background thread, so callers never pay a network probe:
+    network work calls wait_online (or wait_online_async) before each item, which returns immediately while online
+    and pauses while the connection is down. Callers that hit a network failure call report_failure to have the
+    connection probed again right away.
+    """
+
+    def __init__(
+        self,
+        targets: tuple[tuple[str, int], ...] = PROBE_TARGETS,
+        online_interval: float = ONLINE_INTERVAL,
+        offline_interval: float = OFFLINE_INTERVAL,
+        max_offline: float = MAX_OFFLINE
+    ):
+        self.targets = targets
+        self.online_interval = online_interval
+        self.offline_interval = offline_interval
+        self.max_offline = max_offline
+        self._online = threading.Event()
+        self._wakeup = threading.Event()
+        self._lock = threading.Lock()
+        self._probe_lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._last_probe = 0.0
+
+    def _probe(self) -> bool:
+        with self._probe_lock:
+            self._last_probe = time.monotonic()
+            return self._probe_targets()
+
+    def _probe_targets(self) -> bool:
+        for target in self.targets:
+            try:
+                with socket.create_connection(target, timeout=PROBE_TIMEOUT):
+                    return True
+            except OSError as e:
+                log.debug(f"Connectivity probe to {target} failed: {e}")
+        return False
+
+    def _update(self, online: bool):
+        if online == self._online.is_set():
+            return
+        if online:
+            self._online.set()
+            log.info("Internet connection restored")
+            console.print_info("Internet connection restored, resuming")
+        else:
+            self._online.clear()
+            log.warning("Internet connection lost")
+            console.print_warning("Internet connection lost, pausing until it is restored")
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(self.online_interval if self._online.is_set() else self.offline_interval)
+            self._wakeup.clear()
+            self._update(self._probe())
+
+    def start(self):
+        """probe the connection and start the background thread, called on first use"""
+        with self._lock:
+            if self._thread is None:
+                self._update(self._probe())
+                self._thread = threading.Thread(target=self._run, name="connectivity-monitor", daemon=True)
+                self._thread.start()
+
+    def is_online(self) -> bool:
+        if self._thread is None:
+            self.start()
+        return self._online.is_set()
+
+    def check(self) -> bool:
+        """probe the connection now, unless it was probed very recently, and return its state"""
+        if self._thread is None:
+            self.start()
+        elif time.monotonic() - self._last_probe >= self.offline_interval:
+            self._update(self._probe())
+        return self._online.is_set()
+
+    def report_failure(self):
+        """a network operation failed, probe the connection again unless it was probed very recently"""
+        if time.monotonic() - self._last_probe >= self.offline_interval:
+            self._wakeup.set()
+
+    def wait_online(self, timeout: Optional[float] = None):
+        """block until the connection is up, raises InternetMissing after timeout seconds (default max_offline)"""
+        if self.is_online():
+            return
+        if not self._online.wait(self.max_offline if timeout is None else timeout):
+            raise InternetMissing()
+
+    async def wait_online_async(self, timeout: Optional[float] = None):
+        """asyncio version of wait_online, the event loop is never blocked"""
+        if self._thread is None:
+            await asyncio.to_thread(self.start)
+        if self._online.is_set():
+            return
+        deadline = time.monotonic() + (self.max_offline if timeout is None else timeout)
+        while not self._online.is_set():
+            if time.monotonic() >= deadline:
+                raise InternetMissing()
+            await asyncio.sleep(1)
+
+
+connectivity = ConnectivityMonitor()
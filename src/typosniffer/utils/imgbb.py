@@ -32,12 +32,16 @@ def upload_file(image_path: Path, name: str, config: ImageUploadSettings) -> req
         return response
     
 
-def upload_screenshot(suspicious_domain: SuspiciousDomainDTO, date: datetime, config: ImageUploadSettings) -> Optional[str]:
+def upload_screenshot(suspicious_domain: SuspiciousDomainDTO, date: datetime, blob: Optional[str], config: ImageUploadSettings) -> Optional[str]:
+    """upload the thumbnail of a stored screenshot, nothing is uploaded if the website has no screenshot"""
+    if blob is None:
+        return None
+
     try:
 
-        file = website_record.get_screenshot(suspicious_domain, date)
+        file = website_record.get_screenshot_preview(blob)
 
-        response: requests.Response = upload_file(file, f"{suspicious_domain.name}-{file.stem}", config)
+        response: requests.Response = upload_file(file, f"{suspicious_domain.name}-{date.strftime('%Y%m%d_%H%M%S')}", config)
 
         return response.json()['data']['image']['url']
     
@@ -8,7 +8,7 @@ from PIL import Image
 from typosniffer.service import suspicious_domain
 
 
-USER_AGENT = f"TypoSniffer/{version("typosniffer")}"
+USER_AGENT = f"TypoSniffer/{version('typosniffer')}"
 
 
 WEBDRIVER_ARGUMENTS = (
@@ -4,13 +4,11 @@ from enum import Enum
 from importlib import resources
 import json
 from pathlib import Path
-import socket
-from typing import Any, Callable, List, Generator
+from typing import Any, Callable, Iterable, List, Generator, Sequence
 import click
 from pydantic import BaseModel
 from typosniffer.utils import console
 
-from typosniffer.utils.exceptions import InternetMissing
 
 def read_lines(file: Path) -> list[str]:
     
@@ -95,6 +93,65 @@ def save_as_csv(obj: Any, filepath: Path, print: bool = True) -> None:
         console.print_info(f"File saved at {filepath}")
 
 
+# Formats supported by save_stream
+STREAM_FORMATS = ('csv', 'json', 'ndjson')
+
+def _record_field(record: Any, field: str) -> Any:
+    value = record.get(field) if isinstance(record, dict) else getattr(record, field, None)
+    return to_serializable(value)
+
+def save_stream(records: Iterable[Any], filepath: Path, fields: Sequence[str], format: str = 'csv', flush_every: int = 1000, print: bool = True) -> int:
+    """
+    Write records to a file one at a time using a fixed schema, nothing is kept in memory.
+
+    Args:
+        records (Iterable): Records to write, dicts or objects exposing the schema fields as attributes.
+        filepath (Path): File to write.
+        fields (Sequence[str]): Fields written for each record, in order.
+        format (str): One of csv, json (array of objects) or ndjson (one object per line).
+        flush_every (int): Number of records after which the file is flushed.
+        print (bool): Print where the file has been saved.
+
+    Returns:
+        int: Number of written records.
+    """
+
+    if format not in STREAM_FORMATS:
+        raise ValueError(f"Unknown format: {format}. Supported: {', '.join(STREAM_FORMATS)}")
+
+    total = 0
+
+    with filepath.open("w", newline="", encoding="utf-8") as f:
+
+        if format == 'csv':
+            writer = csv.writer(f)
+            writer.writerow(fields)
+        elif format == 'json':
+            f.write("[")
+
+        for record in records:
+            row = {field: _record_field(record, field) for field in fields}
+
+            if format == 'csv':
+                writer.writerow([" ".join(map(str, v)) if isinstance(v, list) else v for v in row.values()])
+            elif format == 'json':
+                f.write(("," if total else "") + "\n    " + json.dumps(row, ensure_ascii=False, default=str))
+            else:
+                f.write(json.dumps(row, ensure_ascii=False, default=str) + "\n")
+
+            total += 1
+            if total % flush_every == 0:
+                f.flush()
+
+        if format == 'json':
+            f.write("\n]\n" if total else "]\n")
+
+    if print:
+        console.print_info(f"File saved at {filepath}")
+
+    return total
+
+
 def expand_and_create_dir(path_str: str | Path) -> Path:
     """
     Expand ~ and create the directory if it does not exist.
@@ -118,17 +175,3 @@ def add_enum_flags(enum_cls, help: Callable[[Enum], str]):
             )(f)
         return f
     return decorator
-
-def check_internet(throw: bool) -> bool:
-
-    try:
-        socket.create_connection(("1.1.1.1", 53), timeout=3)
-        return True
-    except Exception as e:
-        print(e)
-        if throw:
-            raise InternetMissing()
-
-    return False
-
-
@@ -0,0 +1,135 @@
+import json
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import threading
+import time
+import pytest
+import whoisit
+from typosniffer.config import config
+from typosniffer.config.config import AppSettings
+from typosniffer.data.database import DB
+
+
+@pytest.fixture
+def database(tmp_path, monkeypatch):
+    """sqlite database and screenshot folder in a temporary directory"""
+
+    screenshot_dir = tmp_path / "screenshots"
+    screenshot_dir.mkdir()
+
+    monkeypatch.setattr(config, 'cfg', AppSettings(
+        database={'drivername': 'sqlite', 'database': str(tmp_path / "typosniffer.db")},
+        inspection={'screenshot_dir': str(screenshot_dir)},
+    ), raising=False)
+
+    yield DB
+
+    if DB._engine is not None:
+        DB._session_factory.remove()
+        DB._engine.dispose()
+    DB._engine = None
+    DB._session_factory = None
+
+
+class StandInServer(ThreadingHTTPServer):
+    """
+    Local http server answering GET and HEAD requests with the responses queued for each path,
+    the last response of a path is repeated once the others are consumed.
+    """
+
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), StandInHandler)
+        self.responses: dict[str, list[tuple[int, dict, bytes]]] = {}
+        self.requests: list[tuple[str, float]] = []
+
+    @property
+    def url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/"
+
+    def respond(self, path: str, status: int = 200, body=None, headers: dict = None):
+        data = json.dumps(body).encode() if isinstance(body, dict) else (body or b'')
+        self.responses.setdefault(path, []).append((status, headers or {}, data))
+
+    def count(self, path: str) -> int:
+        return sum(1 for requested, _ in self.requests if requested == path)
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        self.respond()
+
+    def do_HEAD(self):
+        self.respond(body=False)
+
+    def respond(self, body: bool = True):
+        self.server.requests.append((self.path, time.monotonic()))
+        queued = self.server.responses.get(self.path)
+        if queued:
+            status, headers, data = queued.pop(0) if len(queued) > 1 else queued[0]
+        else:
+            status, headers, data = 404, {}, b''
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header('Content-Type', 'application/rdap+json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        if body:
+            self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def stand_in_server():
+    server = StandInServer()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def rdap_bootstrap(stand_in_server):
+    """whoisit bootstrapped so that the domains of the 'test' tld are queried on the stand-in server"""
+
+    services = {
+        'asn': [[["64496-64511"], [stand_in_server.url]]],
+        'dns': [[["test"], [stand_in_server.url]]],
+        'ipv4': [[["192.0.2.0/24"], [stand_in_server.url]]],
+        'ipv6': [[["2001:db8::/32"], [stand_in_server.url]]],
+        'object': [[["test@example.com"], ["TEST"], [stand_in_server.url]]],
+    }
+    data = {'timestamp': int(time.time())} | {name: {'services': service} for name, service in services.items()}
+
+    whoisit.clear_bootstrapping()
+    whoisit.load_bootstrap_data(json.dumps(data), allow_insecure=True)
+    yield stand_in_server
+    whoisit.clear_bootstrapping()
+
+
+def rdap_domain(name: str, registrar: str = "Example Registrar") -> dict:
+    """minimal rdap response of a domain with its registrar"""
+    return {
+        'objectClassName': 'domain',
+        'handle': name.upper(),
+        'ldhName': name,
+        'status': ['active'],
+        'events': [
+            {'eventAction': 'registration', 'eventDate': '2024-01-02T03:04:05Z'},
+            {'eventAction': 'expiration', 'eventDate': '2026-01-02T03:04:05Z'},
+        ],
+        'nameservers': [{'objectClassName': 'nameserver', 'ldhName': 'ns1.example.com'}],
+        'entities': [{
+            'objectClassName': 'entity',
+            'handle': '1',
+            'roles': ['registrar'],
+            'vcardArray': ['vcard', [['version', {}, 'text', '4.0'], ['fn', {}, 'text', registrar]]],
+        }],
+        'links': [{'rel': 'self', 'href': f"https://rdap.example/domain/{name}"}],
+    }
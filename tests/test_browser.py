@@ -0,0 +1,113 @@
+import asyncio
+import pytest
+from playwright.async_api import Browser, BrowserContext, BrowserType, Page, Playwright
+from typosniffer.sniffing import browser
+
+
+class StandInPage(Page):
+    def __init__(self):
+        self.closed = False
+
+    def is_closed(self):
+        return self.closed
+
+    def on(self, event, f):
+        pass
+
+    async def goto(self, url, **kwargs):
+        await asyncio.sleep(0)
+
+
+class StandInContext(BrowserContext):
+    def __init__(self):
+        self.closed = False
+
+    async def new_page(self):
+        return StandInPage()
+
+    async def close(self, **kwargs):
+        self.closed = True
+
+
+class StandInBrowser(Browser):
+    def __init__(self):
+        self.connected = True
+
+    def is_connected(self):
+        return self.connected
+
+    async def new_context(self, **kwargs):
+        return StandInContext()
+
+    async def close(self, **kwargs):
+        self.connected = False
+
+
+class StandInBrowserType(BrowserType):
+    def __init__(self):
+        self.failing = False
+        self.launched = 0
+
+    async def launch(self, **kwargs):
+        if self.failing:
+            raise RuntimeError("browser failed to launch")
+        self.launched += 1
+        return StandInBrowser()
+
+
+class StandInPlaywright(Playwright):
+    chromium = None
+
+    def __init__(self):
+        self.chromium = StandInBrowserType()
+
+
+@pytest.fixture
+def playwright(monkeypatch):
+    monkeypatch.setattr(browser, 'LAUNCH_ATTEMPTS', 1)
+    return StandInPlaywright()
+
+
+async def visit(pool: browser.BrowserPool):
+    async with pool.lease() as lease:
+        await lease.page.goto("http://example.test")
+
+
+def test_browser_is_recycled(playwright):
+    async def run():
+        async with browser.BrowserPool(playwright, pages=2, recycle_after=2) as pool:
+            await asyncio.gather(*(visit(pool) for _ in range(6)))
+
+    asyncio.run(run())
+    assert playwright.chromium.launched == 4
+
+
+def test_failed_restart_is_retried_on_next_lease(playwright):
+    async def run():
+        async with browser.BrowserPool(playwright, pages=2, recycle_after=2) as pool:
+            await asyncio.gather(visit(pool), visit(pool))
+
+            #the leases waiting for the pages of the browser fail instead of waiting forever
+            playwright.chromium.failing = True
+            results = await asyncio.gather(*(visit(pool) for _ in range(4)), return_exceptions=True)
+            assert [isinstance(result, RuntimeError) for result in results] == [False, False, True, True]
+            assert pool.browsers[0].failed
+
+            playwright.chromium.failing = False
+            await asyncio.gather(*(visit(pool) for _ in range(4)))
+            assert not pool.browsers[0].failed
+
+    asyncio.run(run())
+
+
+def test_every_lease_gets_a_new_context(playwright):
+    async def run():
+        async with browser.BrowserPool(playwright, pages=1) as pool:
+            async with pool.lease() as lease:
+                first = lease.context
+            async with pool.lease() as lease:
+                assert lease.context is not first
+            assert first.closed
+
+    asyncio.run(run())
+    assert playwright.chromium.launched == 1
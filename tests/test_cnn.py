@@ -0,0 +1,75 @@
+from concurrent.futures import wait
+import numpy
+import pytest
+from PIL import Image
+from typosniffer.config.config import CnnSettings
+from typosniffer.sniffing import cnn
+
+
+def image(color: int, size=(40, 30)) -> Image.Image:
+    return Image.new("RGB", size, (color, color, color))
+
+
+class StandInBackend(cnn.EmbeddingBackend):
+    """embeds an image as its mean color, recording the size of each batch"""
+
+    def __init__(self):
+        self.name = cnn.embedding_name("resnet50", 256)
+        self.batches = []
+
+    def preprocess(self, image: Image.Image):
+        import torch
+        return torch.tensor(numpy.asarray(image.convert("RGB"), dtype=numpy.float32) / 255).permute(2, 0, 1)
+
+    def embed(self, batch):
+        self.batches.append(len(batch))
+        return batch.flatten(2).mean(2)
+
+
+def test_letterbox_keeps_the_aspect_ratio():
+    #a full page capture, a black page on the white padding
+    page = cnn.letterbox(Image.new("L", (1024, 4096)), 256)
+
+    assert page.size == (256, 256) and page.mode == "RGB"
+    #the bounding box of the dark page, centered and not stretched
+    assert page.convert("L").point(lambda p: 255 - p).getbbox() == (96, 0, 160, 256)
+
+
+def test_embedding_cache_keeps_recent_embeddings_in_memory(tmp_path):
+    cache = cnn.EmbeddingCache(tmp_path, max_entries=2, max_memory_entries=2)
+
+    for i in range(3):
+        cache.put(f"key{i}", numpy.full((1, 4), i, dtype=numpy.float32))
+    assert list(cache.memory) == ["key1", "key2"]
+
+    #evicted from memory, read back from disk
+    assert cache.get("key0")[0, 0] == 0
+    assert list(cache.memory) == ["key2", "key0"]
+    assert cache.get("missing") is None
+
+    cache.prune()
+    assert len(list(tmp_path.glob("*.npy"))) == 2
+
+
+def test_cached_embeddings_need_no_model(tmp_path):
+    key = cnn.image_key(image(10))
+    cnn.EmbeddingCache(tmp_path / cnn.embedding_name("resnet50", 256)).put(key, numpy.ones((1, 4), dtype=numpy.float32))
+
+    with cnn.ImageComparator(CnnSettings(), cache_dir=tmp_path) as comparator:
+        assert comparator.get_similarity(image(10), image(10)) == pytest.approx(1)
+        assert comparator.backend is None and comparator.thread is None
+
+
+def test_images_are_embedded_in_batches(tmp_path):
+    pytest.importorskip("torch")
+    backend = StandInBackend()
+
+    with cnn.ImageComparator(backend=backend, cache_dir=tmp_path, batch_size=4, batch_delay=0.5) as comparator:
+        #the same image queued twice is embedded once
+        futures = [comparator.submit(image(color)) for color in (0, 50, 50, 100, 150, 200, 250)]
+        wait(futures)
+
+    assert sorted(backend.batches) == [2, 4]
+    assert futures[1] is futures[2]
+    assert futures[3].result()[0, 0] == pytest.approx(100 / 255)
+    assert len(list((tmp_path / backend.name).glob("*.npy"))) == 6
@@ -0,0 +1,35 @@
+from typosniffer.config.config import InspectionSettings
+from typosniffer.sniffing.fingerprint import dom_features, dom_fingerprint, fingerprint_distance, simhash
+
+
+TAGS = " ".join(["DIV", "H1", "P", "A", "DIV", "UL"] + ["LI", "A"] * 20 + ["FOOTER", "P"])
+#a page of a few hundred distinct words, the size of a typical landing page
+TEXT = " ".join(f"word{i}" for i in range(400))
+
+
+def test_identical_pages_have_the_same_fingerprint():
+    assert dom_fingerprint(TEXT, TAGS) == dom_fingerprint(TEXT, TAGS)
+    assert fingerprint_distance(dom_fingerprint(TEXT, TAGS), dom_fingerprint(TEXT, TAGS)) == 0
+
+
+def test_small_edit_is_close_and_different_page_is_far():
+    fingerprint = dom_fingerprint(TEXT, TAGS)
+    edited = dom_fingerprint(TEXT.replace("word7 ", "changed "), TAGS)
+    rewritten = dom_fingerprint(" ".join(f"other{i}" for i in range(400)), TAGS)
+    parked = dom_fingerprint("This domain is for sale, make an offer to the owner today.", "DIV H1 P DIV A")
+
+    threshold = InspectionSettings().dom_threshold
+    assert fingerprint_distance(fingerprint, edited) <= threshold
+    assert fingerprint_distance(fingerprint, rewritten) > 3 * threshold
+    assert fingerprint_distance(fingerprint, parked) > 3 * threshold
+
+
+def test_features_ignore_repetitions_and_case():
+    features = dom_features("Hello hello HELLO world", "DIV P DIV P DIV")
+    assert features == {"hello", "world", "<DIV><P><DIV>", "<P><DIV><P>"}
+
+
+def test_fingerprint_format():
+    assert simhash(set()) == "0" * 16
+    assert len(dom_fingerprint(TEXT, TAGS)) == 16
+    assert fingerprint_distance("0" * 16, "f" * 16) == 64
@@ -0,0 +1,56 @@
+from dnstwist import Fuzzer
+import pytest
+from typosniffer.data.dto import DomainDTO
+from typosniffer.sniffing import fuzzer
+
+
+WORDS = ['login', 'secure', 'account']
+DOMAINS = ['example.com', 'paypal.co.uk', 'mail.google.com', 'bücher.de', 'xn--80ak6aa92e.com']
+
+
+@pytest.fixture(scope='module')
+def tlds() -> list[str]:
+    return fuzzer.read_tld_dictionary()
+
+
+def dnstwist_permutations(domain: str, tlds: list[str]) -> set[tuple[str, str]]:
+    f = Fuzzer(domain, tld_dictionary=list(tlds), dictionary=WORDS)
+    f.generate()
+    return {(permutation['domain'], permutation['fuzzer']) for permutation in f.domains}
+
+
+@pytest.mark.parametrize('domain', DOMAINS)
+def test_generate_matches_dnstwist(domain, tlds):
+    permutations = list(fuzzer.generate(domain, tlds, WORDS))
+
+    assert {(p.domain, p.fuzzer) for p in permutations} == dnstwist_permutations(domain, tlds)
+    #permutations are deduplicated while they are generated
+    assert len(permutations) == len({p.domain for p in permutations})
+
+
+def test_all_tlds_combines_every_label_permutation(tlds):
+    tlds = tlds[:20]
+    labels = fuzzer.permutate_labels('example.com', WORDS).labels
+
+    domains = {p.domain for p in fuzzer.generate('example.com', tlds, WORDS, all_tlds=True)}
+
+    assert {p.domain for p in fuzzer.generate('example.com', tlds, WORDS)} < domains
+    assert all(f"{label}.{tld}" in domains for label in labels for tld in tlds)
+
+
+def test_fuzz_many_merges_domains(tlds):
+    domains = ['example.com', 'exampie.com', 'paypal.com']
+
+    permutations = list(fuzzer.fuzz_many([DomainDTO(name=domain) for domain in domains], tlds, WORDS, max_workers=2))
+
+    expected = set().union(*({domain for domain, _ in dnstwist_permutations(domain, tlds)} for domain in domains))
+    assert {p.domain for p in permutations} == expected
+    #domains generated by more than one target are yielded once
+    assert len(permutations) == len(expected)
+
+
+def test_fuzz_unicode(tlds):
+    domains = {p.domain for p in fuzzer.fuzz(DomainDTO(name='bücher.de'), tlds, WORDS, unicode=True)}
+
+    assert 'bücher.de' in domains and 'bücher.com' in domains
+    assert not any(domain.startswith('xn--bcher') for domain in domains)
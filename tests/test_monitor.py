@@ -0,0 +1,38 @@
+import datetime
+import time
+from typosniffer.data.dto import DomainDTO, WebsiteStatus
+from typosniffer.data.tables import SuspiciousDomain, WebsiteRecord
+from typosniffer.service import domain, suspicious_domain
+from typosniffer.sniffing import monitor
+from typosniffer.sniffing.sniffer import SniffResult
+
+
+def test_database_clock_follows_the_database(database):
+    clock = monitor.DatabaseClock.read()
+    time.sleep(0.05)
+
+    now = clock.now()
+    assert now - clock.start >= datetime.timedelta(seconds=0.05)
+    assert abs(suspicious_domain.database_now() - now) < datetime.timedelta(seconds=1)
+
+
+def test_record_writer_drops_only_the_failing_items(database, monkeypatch):
+    monkeypatch.setattr(monitor, 'WRITE_RETRY_SECONDS', 0)
+    domain.add_domains([DomainDTO(name="example.com")])
+    suspicious_domain.add_suspicious_domain({SniffResult("example.com", "examp1e.com", True)}, {})
+    dto = next(iter(suspicious_domain.iter_due_suspicious_domains(suspicious_domain.database_now())))
+    now = datetime.datetime.now()
+
+    def record(domain_id: int) -> WebsiteRecord:
+        return WebsiteRecord(suspicious_domain_id=domain_id, creation_date=now, status=WebsiteStatus.UP)
+
+    with monitor.RecordWriter() as writer:
+        writer.submit(monitor.PendingRecord(dto, record(dto.id), None))
+        #references a suspicious domain that does not exist, the whole batch fails
+        writer.submit(monitor.PendingRecord(dto, record(dto.id + 1), None))
+        writer.submit(monitor.ScheduledInspection(dto.id, now, now + datetime.timedelta(days=1)))
+
+    with database.get_session() as session:
+        assert [r.suspicious_domain_id for r in session.query(WebsiteRecord)] == [dto.id]
+        row = session.get(SuspiciousDomain, dto.id)
+        assert row.last_record_id is not None and row.next_inspection == now + datetime.timedelta(days=1)
@@ -0,0 +1,25 @@
+import asyncio
+from typosniffer.sniffing.prober import SchemeProber
+
+
+def test_probe_returns_the_same_url_when_cached(stand_in_server, tmp_path):
+    host, port = stand_in_server.server_address[:2]
+    domain = f"{host}:{port}"
+    stand_in_server.respond('/', 301, headers={'Location': 'http://elsewhere.test/landing'})
+
+    async def run():
+        async with SchemeProber(cache_file=tmp_path / "scheme_cache.json") as prober:
+            return await prober.probe(domain), await prober.probe(domain)
+
+    probed, cached = asyncio.run(run())
+
+    assert (probed.url, probed.reachable, probed.cached) == (f"http://{domain}", True, False)
+    assert (cached.url, cached.reachable, cached.cached) == (f"http://{domain}", True, True)
+    #the redirect is left to the page navigation
+    assert stand_in_server.count('/') == 1
+
+    async def reload():
+        async with SchemeProber(cache_file=tmp_path / "scheme_cache.json") as prober:
+            return await prober.probe(domain)
+
+    assert asyncio.run(reload()).url == f"http://{domain}"
@@ -0,0 +1,94 @@
+import asyncio
+import datetime
+from email.utils import format_datetime
+import pytest
+from whoisit.errors import QueryError, ResourceDoesNotExist
+from typosniffer.sniffing import rdap
+from tests.conftest import rdap_domain
+
+
+def test_retry_after_seconds_and_http_date():
+    assert rdap._retry_after("7") == 7
+    assert rdap._retry_after("-3") == 0
+    assert rdap._retry_after(None) is None
+    assert rdap._retry_after("soon") is None
+
+    date = datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(seconds=120)
+    assert 110 < rdap._retry_after(format_datetime(date, usegmt=True)) <= 120
+
+
+def test_parse_domain_without_whoisit_bootstrap():
+    parsed = rdap.parse_domain("example.test", rdap_domain("example.test"))
+
+    assert parsed['name'] == "example.test"
+    assert parsed['registration_date'].year == 2024
+    assert parsed['entities']['registrar'][0]['name'] == "Example Registrar"
+    assert parsed['rir'] == ''
+
+
+def test_client_domain(rdap_bootstrap):
+    rdap_bootstrap.respond("/domain/example.test", body=rdap_domain("example.test"))
+
+    async def query():
+        async with rdap.AsyncRdapClient() as client:
+            return await client.domain("example.test"), await client.domain("example.test", raw=True)
+
+    parsed, raw = asyncio.run(query())
+
+    assert parsed['name'] == "example.test"
+    assert raw['handle'] == "EXAMPLE.TEST"
+
+
+def test_client_follows_related_link(rdap_bootstrap):
+    response = rdap_domain("example.test")
+    response['links'].append({'rel': 'related', 'href': f"{rdap_bootstrap.url}registrar/domain/example.test"})
+    rdap_bootstrap.respond("/domain/example.test", body=response)
+    rdap_bootstrap.respond("/registrar/domain/example.test", body={'port43': 'whois.registrar.test'})
+
+    async def query():
+        async with rdap.AsyncRdapClient() as client:
+            return await client.domain("example.test", follow_related=True)
+
+    assert asyncio.run(query())['whois_server'] == "whois.registrar.test"
+
+
+def test_client_errors(stand_in_server):
+    stand_in_server.respond("/limited", status=429, headers={'Retry-After': '12'})
+    stand_in_server.respond("/limited-no-header", status=429)
+    stand_in_server.respond("/broken", status=500)
+    stand_in_server.respond("/not-json", body=b"<html>")
+
+    async def get(path):
+        async with rdap.AsyncRdapClient() as client:
+            return await client.get(stand_in_server.url + path)
+
+    with pytest.raises(rdap.RdapRateLimitedError) as e:
+        asyncio.run(get("limited"))
+    assert e.value.retry_after == 12
+    assert e.value.server == stand_in_server.url.split('/')[2]
+
+    with pytest.raises(rdap.RdapRateLimitedError) as e:
+        asyncio.run(get("limited-no-header"))
+    assert e.value.retry_after is None
+
+    with pytest.raises(ResourceDoesNotExist):
+        asyncio.run(get("missing"))
+    with pytest.raises(QueryError):
+        asyncio.run(get("broken"))
+    with pytest.raises(QueryError):
+        asyncio.run(get("not-json"))
+
+
+def test_client_reuses_connections(rdap_bootstrap):
+    for i in range(5):
+        rdap_bootstrap.respond(f"/domain/example{i}.test", body=rdap_domain(f"example{i}.test"))
+
+    async def query():
+        async with rdap.AsyncRdapClient() as client:
+            results = await asyncio.gather(*(client.domain(f"example{i}.test") for i in range(5)))
+            return results, len(client.clients)
+
+    results, clients = asyncio.run(query())
+
+    assert [result['name'] for result in results] == [f"example{i}.test" for i in range(5)]
+    assert clients == 1
@@ -0,0 +1,54 @@
+import datetime
+from typosniffer.config.config import ScheduleSettings
+from typosniffer.data.dto import DomainDTO, SuspiciousDomainDTO, WebsiteRecordDTO, WebsiteStatus
+from typosniffer.sniffing.scheduler import next_inspection
+
+
+NOW = datetime.datetime(2025, 6, 1, 12, 0)
+SETTINGS = ScheduleSettings(min_hours=20, max_up_days=7, max_down_days=60, new_domain_days=7)
+
+
+def suspicious_domain(status=WebsiteStatus.UP, added_days=30, interval=None) -> SuspiciousDomainDTO:
+    last_inspected = NOW - datetime.timedelta(days=1) if interval is not None else None
+    return SuspiciousDomainDTO(
+        id=1,
+        name="examp1e.com",
+        original_domain=DomainDTO(name="example.com"),
+        last_record=WebsiteRecordDTO(id=1, creation_date=NOW, status=status) if status is not None else None,
+        added_date=NOW - datetime.timedelta(days=added_days),
+        last_inspected=last_inspected,
+        next_inspection=last_inspected + interval if interval is not None else None,
+    )
+
+
+def test_never_inspected_domain_uses_min_interval():
+    assert next_inspection(suspicious_domain(), False, NOW, SETTINGS) == NOW + datetime.timedelta(hours=20)
+
+
+def test_unchanged_domain_doubles_interval():
+    domain = suspicious_domain(interval=datetime.timedelta(days=2))
+    assert next_inspection(domain, False, NOW, SETTINGS) == NOW + datetime.timedelta(days=4)
+
+
+def test_changed_domain_resets_interval():
+    domain = suspicious_domain(interval=datetime.timedelta(days=5))
+    assert next_inspection(domain, True, NOW, SETTINGS) == NOW + datetime.timedelta(hours=20)
+
+
+def test_new_domain_uses_min_interval():
+    domain = suspicious_domain(added_days=2, interval=datetime.timedelta(days=5))
+    assert next_inspection(domain, False, NOW, SETTINGS) == NOW + datetime.timedelta(hours=20)
+
+
+def test_interval_is_capped_by_website_state():
+    up = suspicious_domain(status=WebsiteStatus.CHANGED, interval=datetime.timedelta(days=6))
+    assert next_inspection(up, False, NOW, SETTINGS) == NOW + datetime.timedelta(days=7)
+
+    down = suspicious_domain(status=WebsiteStatus.DOWN, interval=datetime.timedelta(days=6))
+    assert next_inspection(down, False, NOW, SETTINGS) == NOW + datetime.timedelta(days=12)
+
+    down = suspicious_domain(status=WebsiteStatus.DOWN, interval=datetime.timedelta(days=50))
+    assert next_inspection(down, False, NOW, SETTINGS) == NOW + datetime.timedelta(days=60)
+
+    never_up = suspicious_domain(status=None, interval=datetime.timedelta(days=50))
+    assert next_inspection(never_up, False, NOW, SETTINGS) == NOW + datetime.timedelta(days=60)
@@ -0,0 +1,168 @@
+import datetime
+import sqlite3
+import pytest
+from sqlalchemy import event, update
+from sqlalchemy.engine import Engine
+from typosniffer.config.config import WorkerSettings
+from typosniffer.data.dto import DomainDTO
+from typosniffer.data.tables import Entity, SuspiciousDomain, suspicious_domain_entity
+from typosniffer.service import domain, suspicious_domain
+from typosniffer.sniffing.sniffer import SniffResult
+
+
+NAMES = [f"examp{i}e.com" for i in range(25)]
+
+WHOIS_DATA = {
+    name: {
+        'registration_date': datetime.datetime(2025, 1, 1),
+        'entities': {'registrar': [{'name': 'Example Registrar', 'url': 'https://registrar.example'}]},
+    }
+    for name in NAMES[:10]
+}
+
+
+@pytest.fixture
+def suspicious_domains(database):
+    domain.add_domains([DomainDTO(name="example.com")])
+    suspicious_domain.add_suspicious_domain({SniffResult("example.com", name, True) for name in NAMES}, WHOIS_DATA)
+    return database
+
+
+def expire_leases(db):
+    with db.get_session() as session, session.begin():
+        session.execute(
+            update(SuspiciousDomain)
+            .where(SuspiciousDomain.lease_owner.is_not(None))
+            .values(lease_until=datetime.datetime(2000, 1, 1))
+        )
+
+
+def test_add_suspicious_domain_is_idempotent(suspicious_domains, monkeypatch):
+    monkeypatch.setattr(suspicious_domain, 'BATCH_SIZE', 7)
+    suspicious_domain.add_suspicious_domain({SniffResult("example.com", name, True) for name in NAMES}, WHOIS_DATA)
+
+    with suspicious_domains.get_session() as session:
+        assert session.query(SuspiciousDomain).count() == len(NAMES)
+        assert session.query(Entity).count() == 1
+        assert session.query(suspicious_domain_entity).count() == len(WHOIS_DATA)
+        assert session.query(SuspiciousDomain).filter_by(name=NAMES[0]).one().creation_date == datetime.datetime(2025, 1, 1)
+
+
+def test_add_suspicious_domain_merges_with_persisted_rows(suspicious_domains):
+    domain.add_domains([DomainDTO(name="exampie.com")])
+    whois_data = {
+        #a persisted domain is left untouched, its new entities are linked to it
+        NAMES[0]: {
+            'registration_date': datetime.datetime(2020, 1, 1),
+            'entities': {'registrar': [{'name': 'Example Registrar', 'url': 'https://registrar.example'}], 'registrant': [{'name': 'Registrant'}]},
+        },
+        #an entity without url is matched to the persisted one
+        NAMES[20]: {'entities': {'registrant': [{'name': 'Registrant'}]}},
+    }
+    results = {SniffResult("example.com", NAMES[0], True), SniffResult("example.com", NAMES[20], True), SniffResult("exampie.com", NAMES[0], True)}
+
+    suspicious_domain.add_suspicious_domain(results, whois_data)
+
+    with suspicious_domains.get_session() as session:
+        #the same name of another original domain is a new suspicious domain
+        assert session.query(SuspiciousDomain).count() == len(NAMES) + 1
+        rows = session.query(SuspiciousDomain).filter_by(name=NAMES[0]).order_by(SuspiciousDomain.id).all()
+        assert [row.creation_date for row in rows] == [datetime.datetime(2025, 1, 1), datetime.datetime(2020, 1, 1)]
+        assert session.query(Entity).count() == 2
+        assert sorted(entity.name for entity in rows[0].entities) == ['Example Registrar', 'Registrant']
+        assert session.query(suspicious_domain_entity).count() == len(WHOIS_DATA) + 4
+
+
+def test_add_suspicious_domain_below_sqlite_parameters_limit(database):
+    names = [f"example{i}.com" for i in range(1000)]
+    whois_data = {name: {'entities': {'registrar': [{'name': f"Registrar {name}"}]}} for name in names}
+
+    #the default limit of sqlite before 3.32
+    def set_limit(dbapi_connection, connection_record):
+        dbapi_connection.setlimit(sqlite3.SQLITE_LIMIT_VARIABLE_NUMBER, 999)
+
+    event.listen(Engine, "connect", set_limit)
+    try:
+        domain.add_domains([DomainDTO(name="example.com")])
+        suspicious_domain.add_suspicious_domain({SniffResult("example.com", name, True) for name in names}, whois_data)
+    finally:
+        event.remove(Engine, "connect", set_limit)
+
+    with database.get_session() as session:
+        assert session.query(SuspiciousDomain).count() == len(names)
+        assert session.query(Entity).count() == len(names)
+        assert session.query(suspicious_domain_entity).count() == len(names)
+
+
+def test_iter_due_suspicious_domains(suspicious_domains):
+    now = suspicious_domain.database_now()
+
+    assert suspicious_domain.count_due_suspicious_domains(now) == len(NAMES)
+    assert sorted(d.name for d in suspicious_domain.iter_due_suspicious_domains(now, page_size=7)) == sorted(NAMES)
+    assert len(list(suspicious_domain.iter_due_suspicious_domains(now, budget=10, page_size=7))) == 10
+
+    with suspicious_domains.get_session() as session, session.begin():
+        suspicious_domain.schedule_inspections(session, [(1, now, now + datetime.timedelta(days=1))])
+
+    assert suspicious_domain.count_due_suspicious_domains(now) == len(NAMES) - 1
+
+
+def test_claims_are_disjoint(suspicious_domains):
+    settings = WorkerSettings(claim_size=10)
+
+    first = suspicious_domain.claim_suspicious_domains("worker-1", settings)
+    second = suspicious_domain.claim_suspicious_domains("worker-2", settings)
+
+    assert len(first) == len(second) == 10
+    assert not {d.id for d in first} & {d.id for d in second}
+
+    #leased domains are neither due nor claimable
+    now = suspicious_domain.database_now()
+    assert suspicious_domain.count_due_suspicious_domains(now) == len(NAMES) - 20
+    assert len(list(suspicious_domain.iter_due_suspicious_domains(now))) == len(NAMES) - 20
+    assert len(list(suspicious_domain.iter_claimed_suspicious_domains("worker-3", settings))) == len(NAMES) - 20
+
+
+def test_claimed_domains_budget(suspicious_domains):
+    claimed = list(suspicious_domain.iter_claimed_suspicious_domains("worker", WorkerSettings(claim_size=4), budget=9))
+    assert len(claimed) == 9
+
+
+def test_expired_lease_is_claimed_again(suspicious_domains):
+    settings = WorkerSettings(claim_size=5, max_attempts=3)
+    claimed = suspicious_domain.claim_suspicious_domains("worker-1", settings)
+
+    #the first two domains are inspected, the worker dies before inspecting the others
+    now = suspicious_domain.database_now()
+    with suspicious_domains.get_session() as session, session.begin():
+        suspicious_domain.schedule_inspections(session, [(d.id, now, now + datetime.timedelta(days=1)) for d in claimed[:2]])
+    expire_leases(suspicious_domains)
+
+    reclaimed = suspicious_domain.claim_suspicious_domains("worker-2", settings)
+
+    assert {d.id for d in claimed[2:]} <= {d.id for d in reclaimed}
+    assert not {d.id for d in claimed[:2]} & {d.id for d in reclaimed}
+
+    with suspicious_domains.get_session() as session:
+        row = session.get(SuspiciousDomain, claimed[2].id)
+        assert (row.lease_owner, row.inspection_attempts) == ("worker-2", 2)
+        row = session.get(SuspiciousDomain, claimed[0].id)
+        assert (row.lease_owner, row.lease_until, row.inspection_attempts) == (None, None, 0)
+
+
+def test_failing_domain_is_postponed(suspicious_domains):
+    settings = WorkerSettings(claim_size=len(NAMES), max_attempts=2)
+
+    for _ in range(2):
+        assert len(suspicious_domain.claim_suspicious_domains("worker", settings)) == len(NAMES)
+        expire_leases(suspicious_domains)
+
+    #every domain failed max_attempts times, they are postponed instead of claimed
+    assert suspicious_domain.claim_suspicious_domains("worker", settings) == []
+
+    now = suspicious_domain.database_now()
+    assert suspicious_domain.count_due_suspicious_domains(now) == 0
+    with suspicious_domains.get_session() as session:
+        row = session.get(SuspiciousDomain, 1)
+        assert row.lease_owner is None and row.inspection_attempts == 0
+        assert row.next_inspection > now + datetime.timedelta(hours=23)
@@ -0,0 +1,82 @@
+import csv
+from dataclasses import dataclass
+import datetime
+import json
+import pytest
+from typosniffer.utils import utility
+
+
+FIELDS = ('domain', 'fuzzer', 'date')
+
+
+@dataclass
+class Record:
+    domain: str
+    fuzzer: str
+    date: datetime.datetime
+    extra: str = 'not exported'
+
+
+RECORDS = [
+    {'domain': 'examp1e.com', 'fuzzer': 'homoglyph', 'date': datetime.datetime(2025, 1, 2, 3, 4, 5)},
+    Record('exanple.com', 'replacement', datetime.datetime(2025, 1, 3)),
+    {'domain': 'éxample.com', 'fuzzer': None},
+]
+
+
+def test_save_stream_csv(tmp_path):
+    path = tmp_path / "records.csv"
+
+    assert utility.save_stream(iter(RECORDS), path, FIELDS, 'csv', flush_every=1, print=False) == 3
+
+    with path.open(newline='', encoding='utf-8') as f:
+        rows = list(csv.reader(f))
+    assert rows[0] == list(FIELDS)
+    assert rows[1][:2] == ['examp1e.com', 'homoglyph']
+    assert rows[2][:2] == ['exanple.com', 'replacement']
+    assert rows[3] == ['éxample.com', '', '']
+
+
+@pytest.mark.parametrize('format', ['json', 'ndjson'])
+def test_save_stream_json(tmp_path, format):
+    path = tmp_path / f"records.{format}"
+
+    assert utility.save_stream(RECORDS, path, FIELDS, format, print=False) == 3
+
+    text = path.read_text(encoding='utf-8')
+    records = json.loads(text) if format == 'json' else [json.loads(line) for line in text.splitlines()]
+    assert [list(record) for record in records] == [list(FIELDS)] * 3
+    assert [record['domain'] for record in records] == ['examp1e.com', 'exanple.com', 'éxample.com']
+    assert records[2]['fuzzer'] is None and records[2]['date'] is None
+
+
+@pytest.mark.parametrize('format', ['csv', 'json', 'ndjson'])
+def test_save_stream_empty(tmp_path, format):
+    path = tmp_path / f"empty.{format}"
+
+    assert utility.save_stream([], path, FIELDS, format, print=False) == 0
+
+    text = path.read_text(encoding='utf-8')
+    if format == 'json':
+        assert json.loads(text) == []
+    elif format == 'csv':
+        assert text.splitlines() == [",".join(FIELDS)]
+    else:
+        assert text == ''
+
+
+def test_save_stream_is_lazy(tmp_path):
+    path = tmp_path / "records.ndjson"
+
+    def records():
+        for i in range(5):
+            #the records already written are flushed to the file
+            assert len(path.read_text().splitlines()) == i
+            yield {'domain': f'example{i}.com'}
+
+    assert utility.save_stream(records(), path, ('domain',), 'ndjson', flush_every=1, print=False) == 5
+
+
+def test_save_stream_unknown_format(tmp_path):
+    with pytest.raises(ValueError):
+        utility.save_stream([], tmp_path / "records.xml", FIELDS, 'xml', print=False)
@@ -0,0 +1,115 @@
+import datetime
+import pytest
+from typosniffer.data.dto import DomainDTO, WebsiteStatus
+from typosniffer.data.tables import ScreenshotTombstone, SuspiciousDomain, WebsiteRecord
+from typosniffer.service import domain, suspicious_domain, website_record
+from typosniffer.sniffing.sniffer import SniffResult
+
+
+OLD = datetime.datetime.now() - datetime.timedelta(days=100)
+
+
+@pytest.fixture
+def records_db(database, monkeypatch):
+    monkeypatch.setattr(website_record, 'BLOB_GRACE_SECONDS', 0)
+    domain.add_domains([DomainDTO(name="example.com")])
+    suspicious_domain.add_suspicious_domain({SniffResult("example.com", name, True) for name in ("examp1e.com", "exampie.com")}, {})
+    return database
+
+
+def add_records(db, suspicious_domain_id: int, statuses: list[WebsiteStatus], blobs: list[str], last: int = -1) -> list[int]:
+    """add records one day apart starting from OLD, the record at index last is the last record of the domain"""
+    for blob in set(blobs):
+        website_record.store_screenshot(blob, b"png")
+    with db.get_session() as session, session.begin():
+        records = [
+            WebsiteRecord(
+                suspicious_domain_id=suspicious_domain_id,
+                creation_date=OLD + datetime.timedelta(days=i),
+                status=status,
+                screenshot_hash="f" * 16,
+                screenshot_blob=blob
+            )
+            for i, (status, blob) in enumerate(zip(statuses, blobs))
+        ]
+        session.add_all(records)
+        session.flush()
+        session.get(SuspiciousDomain, suspicious_domain_id).last_record_id = records[last].id
+        return [record.id for record in records]
+
+
+def screenshots(db) -> dict[int, tuple]:
+    with db.get_session() as session:
+        return {record.id: (record.screenshot_hash, record.screenshot_blob) for record in session.query(WebsiteRecord)}
+
+
+def test_compaction_keeps_transitions_and_newest_screenshots(records_db):
+    statuses = [WebsiteStatus.UP, WebsiteStatus.CHANGED, WebsiteStatus.DOWN, WebsiteStatus.UP, WebsiteStatus.CHANGED]
+    ids = add_records(records_db, 1, statuses, [f"{i}0.png" for i in range(5)])
+
+    deleted, removed = website_record.compact_records(retention_days=30, keep_screenshots=2)
+
+    assert deleted == 1
+    kept = screenshots(records_db)
+    assert set(kept) == {ids[0], ids[2], ids[3], ids[4]}
+    assert kept[ids[0]] == kept[ids[2]] == (None, None)
+    assert kept[ids[3]] == ("f" * 16, "30.png") and kept[ids[4]] == ("f" * 16, "40.png")
+    assert removed == 3
+    assert not website_record.get_blob_path("00.png").exists()
+    assert website_record.get_blob_path("40.png").exists()
+
+    #compacted records are not compacted again
+    assert website_record.compact_records(retention_days=30, keep_screenshots=2) == (0, 0)
+    with records_db.get_session() as session:
+        assert session.query(ScreenshotTombstone).count() == 0
+
+
+def test_compaction_keeps_last_record(records_db):
+    statuses = [WebsiteStatus.CHANGED] * 4
+    ids = add_records(records_db, 1, statuses, [f"{i}0.png" for i in range(4)], last=0)
+
+    website_record.compact_records(retention_days=30, keep_screenshots=1)
+
+    kept = screenshots(records_db)
+    assert set(kept) == {ids[0], ids[3]}
+    assert kept[ids[0]] == ("f" * 16, "00.png")
+    assert website_record.get_blob_path("00.png").exists()
+
+
+def test_shared_blob_is_kept_while_referenced(records_db):
+    add_records(records_db, 1, [WebsiteStatus.UP, WebsiteStatus.UP], ["parked.png", "10.png"])
+    add_records(records_db, 2, [WebsiteStatus.UP], ["parked.png"])
+
+    website_record.compact_records(retention_days=30, keep_screenshots=1)
+    assert website_record.get_blob_path("parked.png").exists()
+
+    with records_db.get_session() as session:
+        name = session.get(SuspiciousDomain, 2).name
+    suspicious_domain.remove_suspicious_domain([name])
+    website_record.collect_screenshots()
+    assert not website_record.get_blob_path("parked.png").exists()
+    assert website_record.get_blob_path("10.png").exists()
+
+
+def test_collector_drains_tombstones(records_db, monkeypatch):
+    add_records(records_db, 1, [WebsiteStatus.UP], ["recent.png"])
+    with records_db.get_session() as session, session.begin():
+        name = session.get(SuspiciousDomain, 1).name
+        website_record.tombstone_suspicious_domains(session, SuspiciousDomain.id == 1)
+        session.query(SuspiciousDomain).filter_by(id=1).delete()
+    #screenshot saved by domain name and date before the content addressed store
+    legacy = website_record._screenshot_path(name, OLD)
+    legacy.parent.mkdir()
+    legacy.write_bytes(b"png")
+
+    #a blob written during the grace period may belong to a record not committed yet
+    monkeypatch.setattr(website_record, 'BLOB_GRACE_SECONDS', 3600)
+    assert website_record.collect_screenshots(batch_size=1) == 1
+    assert not legacy.parent.exists()
+    assert website_record.get_blob_path("recent.png").exists()
+
+    monkeypatch.setattr(website_record, 'BLOB_GRACE_SECONDS', 0)
+    assert website_record.collect_screenshots() == 1
+    assert not website_record.get_blob_path("recent.png").exists()
+    with records_db.get_session() as session:
+        assert session.query(ScreenshotTombstone).count() == 0
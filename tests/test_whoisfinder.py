@@ -0,0 +1,105 @@
+import asyncio
+import time
+import pytest
+from typosniffer.sniffing import whoisfinder
+from typosniffer.utils.connectivity import ConnectivityMonitor
+from tests.conftest import rdap_domain
+
+
+def test_token_bucket_burst_and_refill():
+    bucket = whoisfinder.TokenBucket(60)
+    now = bucket.updated
+
+    for _ in range(60):
+        assert bucket.delay(now) == 0
+        bucket.take()
+
+    assert bucket.delay(now) == pytest.approx(1)
+    assert bucket.delay(now + 0.5) == pytest.approx(0.5)
+    assert bucket.delay(now + 1) == 0
+    #refill is capped by the capacity
+    assert bucket.delay(now + 3600) == 0
+    assert bucket.tokens == 60
+
+
+def test_token_bucket_backoff():
+    bucket = whoisfinder.TokenBucket(60)
+    now = bucket.updated
+
+    bucket.backoff(now, 30)
+    assert bucket.delay(now) == pytest.approx(30)
+
+    #without a delay the backoff doubles at each failure until a success
+    bucket = whoisfinder.TokenBucket(60)
+    now = bucket.updated
+    bucket.backoff(now)
+    assert bucket.delay(now) == pytest.approx(whoisfinder.BACKOFF_BASE_SECONDS)
+    bucket.backoff(now)
+    assert bucket.delay(now) == pytest.approx(2 * whoisfinder.BACKOFF_BASE_SECONDS)
+    for _ in range(20):
+        bucket.backoff(now)
+    assert bucket.delay(now) == pytest.approx(whoisfinder.BACKOFF_MAX_SECONDS)
+
+    bucket.success()
+    bucket.backoff(now)
+    assert bucket.failures == 1
+
+
+def test_rate_limiter_takes_all_tokens_or_none():
+    limiter = whoisfinder.RateLimiter({'tld': 2, 'server': 3})
+
+    assert limiter.acquire(("tld:com", "server:rdap.test")) == 0
+    assert limiter.acquire(("tld:com", "server:rdap.test")) == 0
+    #the tld bucket is empty, the server token is not taken
+    assert limiter.acquire(("tld:com", "server:rdap.test")) > 0
+    assert limiter.acquire(("tld:net", "server:rdap.test")) == 0
+    assert limiter.acquire(("tld:org", "server:rdap.test")) > 0
+
+    limiter.backoff("tld:net", 60)
+    assert limiter.acquire(("tld:net",)) == pytest.approx(60, abs=1)
+
+
+def test_normalize_whois():
+    data = whoisfinder.normalize_whois({
+        'creation_date': 1,
+        'updated_date': 2,
+        'entities': {'registrar': [{'name': 'registrar'}], 'noc': [{'name': 'unknown role'}], 'abuse': []},
+        'unknown': 3,
+    })
+
+    assert set(data) == set(whoisfinder.WHOIS_FIELDS)
+    assert data['registration_date'] == 1
+    assert data['last_changed_date'] == 2
+    assert data['entities'] == {'registrar': [{'name': 'registrar'}]}
+
+
+@pytest.fixture
+def online(stand_in_server, monkeypatch):
+    #probe the stand-in server instead of the internet
+    monkeypatch.setattr(whoisfinder, 'connectivity', ConnectivityMonitor(targets=(stand_in_server.server_address[:2],)))
+
+
+def test_query_whois_retries_rate_limited_domains(rdap_bootstrap, online):
+    rdap_bootstrap.respond("/domain/limited.test", status=429, headers={'Retry-After': '1'})
+    rdap_bootstrap.respond("/domain/limited.test", body=rdap_domain("limited.test"))
+    rdap_bootstrap.respond("/domain/other.test", body=rdap_domain("other.test"))
+
+    start = time.monotonic()
+    results = asyncio.run(whoisfinder._query_whois_async(["limited.test", "other.test"], 60, 2, 60))
+    elapsed = time.monotonic() - start
+
+    assert set(results) == {"limited.test", "other.test"}
+    assert results["limited.test"]['entities']['registrar'][0]['name'] == "Example Registrar"
+    assert rdap_bootstrap.count("/domain/limited.test") == 2
+    #both the server and the tld buckets wait for the Retry-After delay, not for the default backoff
+    assert 1 <= elapsed < whoisfinder.BACKOFF_BASE_SECONDS
+
+
+def test_query_whois_gives_up_after_max_retries(rdap_bootstrap, online, monkeypatch):
+    monkeypatch.setattr(whoisfinder, 'MAX_RATE_LIMITED_RETRIES', 2)
+    rdap_bootstrap.respond("/domain/limited.test", status=429, headers={'Retry-After': '0'})
+
+    results = asyncio.run(whoisfinder._query_whois_async(["limited.test"], 600, 1, 600))
+
+    assert results == {}
+    assert rdap_bootstrap.count("/domain/limited.test") == 3